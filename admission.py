@@ -0,0 +1,127 @@
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable
+
+class TokenBucket():
+    '''
+    Holds up to rate tokens and refills at rate / per tokens a second, so short bursts pass and a sustained flood is held to the rate.
+    Refilled lazily on each take, there is no timer.
+    '''
+    def __init__(self, rate: int, per: float, now: float):
+        self.capacity = rate
+        self.fill_rate = rate / per
+        self.tokens = float(rate)
+        self.updated = now
+        self.notified = False   # whether the current limited stretch was already reported
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+
+    def take(self, now: float):
+        '''
+        Takes a token. Returns 0 when it got one, otherwise the seconds until the next token.
+        '''
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.notified = False
+            return 0.0
+        return (1 - self.tokens) / self.fill_rate
+
+class RateLimiter():
+    '''
+    A token bucket per key, e.g. per user id or channel id.
+    Buckets are created on first use. Once there are more than max_keys, the full ones are dropped,
+    since a full bucket is the same as no bucket.
+    '''
+    def __init__(self, rate: int, per: float, max_keys: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.per = per
+        self.max_keys = max_keys
+        self.clock = clock
+        self.buckets: Dict[Hashable, TokenBucket] = {}
+        self.limited = 0
+
+    def take(self, key: Hashable):
+        '''
+        Returns 0 when the key may go ahead, otherwise the seconds until it may.
+        '''
+        now = self.clock()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self._prune(now)
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.per, now)
+
+        retry_after = bucket.take(now)
+        if retry_after:
+            self.limited += 1
+        return retry_after
+
+    def refund(self, key: Hashable):
+        '''
+        Gives back a token taken by a command that another limiter turned away.
+        '''
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            bucket.tokens = min(bucket.capacity, bucket.tokens + 1)
+
+    def notice_due(self, key: Hashable):
+        '''
+        True the first time it is called for a key since the key was last limited, so a flood gets one notice and not one per message.
+        '''
+        bucket = self.buckets.get(key)
+        if bucket is None or bucket.notified:
+            return False
+        bucket.notified = True
+        return True
+
+    def _prune(self, now: float):
+        for key, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self.buckets[key]
+
+class ConcurrencyLimit():
+    '''
+    Caps how many DB-bound commands run at once. Unlike a semaphore it never waits,
+    a command that finds every slot taken is turned away so a flood can not build an unbounded queue.
+    Only used from the event loop, so a counter is enough.
+    '''
+    def __init__(self, max_running: int):
+        self.max_running = max_running
+        self.running = 0
+        self.rejected = 0
+
+    def try_acquire(self):
+        if self.running >= self.max_running:
+            self.rejected += 1
+            return False
+        self.running += 1
+        return True
+
+    def release(self):
+        self.running -= 1
+
+class Coalescer():
+    '''
+    Shares one in-flight call between every caller asking for the same key,
+    e.g. a burst of list_scores for one board runs a single query and formats it once.
+    Only the first caller's call runs, a failure is raised to everyone waiting on it.
+    '''
+    def __init__(self):
+        self.in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable]):
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            #Shielded so a caller giving up does not cancel the call for the others
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(call())
+        self.in_flight[key] = future
+        future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(future)
@@ -0,0 +1,97 @@
+import asyncio
+import unittest
+from admission import RateLimiter, ConcurrencyLimit, Coalescer
+
+class RateLimiterTest(unittest.TestCase):
+    def test_token_bucket(self):
+        now = [0.0]
+        limiter = RateLimiter(rate=3, per=6.0, clock=lambda: now[0])
+        #A burst up to the rate passes, then one token comes back every 2s
+        self.assertEqual([0, 0, 0], [limiter.take("user1") for _ in range(3)])
+        self.assertAlmostEqual(2.0, limiter.take("user1"))
+        self.assertEqual(0, limiter.take("user2"))
+
+        #One notice per limited stretch
+        self.assertTrue(limiter.notice_due("user1"))
+        self.assertFalse(limiter.notice_due("user1"))
+        now[0] = 2.0
+        self.assertEqual(0, limiter.take("user1"))
+        self.assertTrue(limiter.take("user1") > 0)
+        self.assertTrue(limiter.notice_due("user1"))
+        self.assertEqual(2, limiter.limited)
+
+    def test_refund(self):
+        limiter = RateLimiter(rate=1, per=10.0, clock=lambda: 0.0)
+        self.assertEqual(0, limiter.take("user1"))
+        limiter.refund("user1")
+        self.assertEqual(0, limiter.take("user1"))
+        self.assertTrue(limiter.take("user1") > 0)
+        #Never more than a full bucket
+        limiter.refund("user1")
+        limiter.refund("user1")
+        self.assertEqual(1, limiter.buckets["user1"].tokens)
+
+    def test_prune(self):
+        now = [0.0]
+        limiter = RateLimiter(rate=1, per=1.0, max_keys=2, clock=lambda: now[0])
+        limiter.take("user1")
+        now[0] = 0.5
+        limiter.take("user2")
+        now[0] = 1.0
+        #user1 is full again and dropped, user2 still owes half a token
+        limiter.take("user3")
+        self.assertEqual({"user2", "user3"}, set(limiter.buckets))
+
+class ConcurrencyLimitTest(unittest.TestCase):
+    def test_try_acquire(self):
+        limit = ConcurrencyLimit(2)
+        self.assertTrue(limit.try_acquire())
+        self.assertTrue(limit.try_acquire())
+        #Full, the caller is turned away instead of waiting
+        self.assertFalse(limit.try_acquire())
+        limit.release()
+        self.assertTrue(limit.try_acquire())
+        self.assertEqual((2, 1), (limit.running, limit.rejected))
+
+class CoalescerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_shared_call(self):
+        coalescer = Coalescer()
+        calls = []
+        async def render(name):
+            calls.append(name)
+            await asyncio.sleep(0.01)
+            return f"page {name}"
+
+        results = await asyncio.gather(*[coalescer.run("board", lambda: render("board")) for _ in range(5)],
+                                       coalescer.run("other", lambda: render("other")))
+        self.assertEqual(["page board"] * 5 + ["page other"], results)
+        self.assertEqual(["board", "other"], calls)
+        self.assertEqual(4, coalescer.coalesced)
+
+        #Nothing is kept once the call is done
+        self.assertEqual({}, coalescer.in_flight)
+        await coalescer.run("board", lambda: render("board"))
+        self.assertEqual(3, len(calls))
+
+    async def test_failure_and_cancel(self):
+        coalescer = Coalescer()
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ConnectionError("DB unavailable")
+
+        results = await asyncio.gather(coalescer.run("board", fail), coalescer.run("board", fail), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ConnectionError) for result in results))
+
+        #A caller giving up does not cancel the call for the others
+        async def slow():
+            await asyncio.sleep(0.02)
+            return "page"
+        first = asyncio.create_task(coalescer.run("board", slow))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(coalescer.run("board", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual("page", await second)
+
+if __name__ == '__main__':
+    unittest.main()
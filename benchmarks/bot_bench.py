@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+import yaml
+from botdata import BotData
+from metrics import metrics
+
+# Times BotData and the bot.py command callbacks against a synthetic server.
+# Runs against a throwaway SQLite file by default, pass --storage-url mongodb://localhost:27017 to use a local mongod.
+# Results are written as JSON, pass an earlier result file as --compare to see the change per benchmark.
+# Usage: python benchmarks/bot_bench.py [--games 20] [--scores 20000] [--output results.json] [--compare old.json]
+BENCH_DB_NAME = "BOTBENCHDATA"
+BENCH_GUILD_ID = 41771983423143937
+SCORE_FMT = "%M:%S.%f"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark BotData and bot commands on synthetic data.")
+    parser.add_argument("--games", type=int, default=20, help="Number of games")
+    parser.add_argument("--channels", type=int, default=10, help="Number of channels, games are spread across them")
+    parser.add_argument("--channels-per-game", type=int, default=2, help="Channels each game is linked to")
+    parser.add_argument("--depth", type=int, default=2, help="Category nesting depth")
+    parser.add_argument("--branching", type=int, default=3, help="Categories per level, a game has branching^depth leaf categories")
+    parser.add_argument("--scores", type=int, default=20000, help="Scores seeded before timing")
+    parser.add_argument("--hot-share", type=float, default=0.1, help="Share of the seeded scores that go to one hot category")
+    parser.add_argument("--players", type=int, default=200, help="Distinct players submitting scores")
+    parser.add_argument("--runs", type=int, default=200, help="Timed runs per benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--storage-url", default=None, help="Storage to run against, defaults to a temporary SQLite file")
+    parser.add_argument("--output", default=None, help="Where to write the JSON results")
+    parser.add_argument("--compare", default=None, help="Earlier JSON results to compare against")
+    return parser.parse_args()
+
+#Synthetic data
+def category_config(depth: int, branching: int, prefix: str = "cat"):
+    categories = []
+    for index in range(branching):
+        category = {"name": f"{prefix}{index}"}
+        if depth > 1:
+            category["subcategory"] = {"label": "Track", "category": category_config(depth - 1, branching, f"{prefix}{index}-")}
+        categories.append(category)
+    return categories
+
+def games_config(args):
+    games = []
+    for index in range(args.games):
+        channels = [f"channel{(index + offset) % args.channels}" for offset in range(min(args.channels_per_game, args.channels))]
+        game = {"name": f"game{index}", "channel": channels, "enabled": index % 5 != 4}
+        if args.depth > 0:
+            game["category"] = [{**category, "score_fmt": SCORE_FMT} for category in category_config(args.depth, args.branching)]
+        games.append(game)
+    return games
+
+def random_time(rng):
+    return f"{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}.{rng.randint(0, 999999):06d}"
+
+def seed_scores(bot_data: BotData, args, rng):
+    '''
+    Fills the storage with args.scores scores, a hot_share of them in the first category of the first game.
+    Returns the (game, category path) of the hot category.
+    '''
+    targets = [(game, path) for game in bot_data.routes.games for path in bot_data.get_categories_for_game(game, None)]
+    hot = targets[0]
+    hot_count = int(args.scores * args.hot_share)
+
+    batch = []
+    for index in range(args.scores):
+        game, path = hot if index < hot_count else rng.choice(targets)
+        batch.append(bot_data.prepare_score(f"player{rng.randrange(args.players)}", game, random_time(rng), path, BENCH_GUILD_ID))
+        if len(batch) == 1000:
+            bot_data.insert_scores(batch)
+            batch = []
+    bot_data.insert_scores(batch)
+    return hot
+
+#Timing
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+        "min_ms": samples[0] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+def measure(func, runs: int):
+    samples = []
+    for run in range(runs):
+        start = time.perf_counter()
+        func(run)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+async def ameasure(func, runs: int):
+    samples = []
+    for run in range(runs):
+        start = time.perf_counter()
+        await func(run)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+#Command callbacks are driven with a stand-in for discord's Context
+class FakeContext():
+    def __init__(self, channel_name: str, user_name: str, guild_id: int = BENCH_GUILD_ID):
+        self.guild = SimpleNamespace(id=guild_id)
+        self.channel = SimpleNamespace(id=hash(channel_name), name=channel_name)
+        self.message = SimpleNamespace(author=SimpleNamespace(id=hash(user_name), name=user_name))
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content if content is not None else kwargs)
+
+class FakeInteraction():
+    def __init__(self, ctx: FakeContext, game_name: str = None):
+        self.guild_id = ctx.guild.id
+        self.channel_id = ctx.channel.id
+        self.channel = ctx.channel
+        self.namespace = SimpleNamespace(game_name=game_name)
+
+def run_checks(command, ctx):
+    return all(check(ctx) for check in command.checks)
+
+async def run_command(command, ctx, *args):
+    #Same bookkeeping PBBot.invoke does, so the DB ops each command makes end up in the results
+    with metrics.command(command.qualified_name):
+        await command.callback(ctx, *args)
+
+async def uncached(bot, command):
+    #Times a command the way it runs right after a new score, with no rendered response to reuse
+    bot.bot_data.response_cache.clear()
+    await command
+
+def bench_botdata(bot_data: BotData, config, args, rng, results):
+    bot_data.storage.drop()
+    results["init_games_config_cold"] = measure(lambda run: bot_data._init_games_config(config), 1)
+    results["init_games_config_warm"] = measure(lambda run: bot_data._init_games_config(config), max(1, args.runs // 10))
+    bot_data._init_games_config_snapshot(config, force_sync=True)
+    results["init_games_config_snapshot"] = measure(lambda run: bot_data._init_games_config_snapshot(config), max(1, args.runs // 10))
+    results["get_active_channels"] = measure(lambda run: bot_data.get_active_channels(), args.runs)
+
+    start = time.perf_counter()
+    hot_game, hot_path = seed_scores(bot_data, args, rng)
+    results["seed_scores"] = {"runs": 1, "scores": args.scores, "total_s": time.perf_counter() - start}
+
+    results["add_score"] = measure(lambda run: bot_data.add_score(f"player{run % args.players}", hot_game, random_time(rng), hot_path, BENCH_GUILD_ID), args.runs)
+    results["get_scores_hot"] = measure(lambda run: bot_data.get_scores(hot_game, hot_path, BENCH_GUILD_ID), max(1, args.runs // 10))
+    results["get_scores_page_hot"] = measure(lambda run: bot_data.get_scores_page(hot_game, hot_path, guild_id=BENCH_GUILD_ID), args.runs)
+    results["get_leaderboard_hot"] = measure(lambda run: bot_data.get_leaderboard(hot_game, hot_path, guild_id=BENCH_GUILD_ID), args.runs)
+    results["get_rank_hot"] = measure(lambda run: bot_data.get_rank(f"player{run % args.players}", hot_game, hot_path, BENCH_GUILD_ID), args.runs)
+    results["get_profile"] = measure(lambda run: bot_data.get_profile(f"player{run % args.players}", BENCH_GUILD_ID), args.runs)
+    results["load_leaderboard"] = measure(lambda run: bot_data._load_leaderboard(), 1)
+    return hot_game, hot_path
+
+async def bench_commands(bot, hot_game, hot_path, args, rng, results):
+    channel = bot.bot_data.get_channels()[0]
+    for candidate in bot.bot_data.get_channels():
+        if hot_game in bot.bot_data.get_games_in_channel(candidate):
+            channel = candidate
+    ctx = FakeContext(channel, "bench-player")
+
+    results["cmd_channel_check"] = measure(lambda run: run_checks(bot.add_score, ctx), args.runs)
+    results["cmd_add_score"] = await ameasure(lambda run: run_command(bot.add_score, ctx, hot_game, random_time(rng), hot_path), args.runs)
+    results["cmd_list_scores"] = await ameasure(lambda run: run_command(bot.list_scores, ctx, hot_game, hot_path), args.runs)
+    results["cmd_list_scores_uncached"] = await ameasure(lambda run: uncached(bot, run_command(bot.list_scores, ctx, hot_game, hot_path)), args.runs)
+    results["cmd_leaderboard"] = await ameasure(lambda run: run_command(bot.leaderboard, ctx, hot_game, hot_path), args.runs)
+    results["cmd_rank"] = await ameasure(lambda run: run_command(bot.rank, ctx, hot_game, hot_path, f"player{run % args.players}"), args.runs)
+    results["cmd_profile"] = await ameasure(lambda run: run_command(bot.profile, ctx, f"player{run % args.players}"), args.runs)
+    if bot.score_queue:
+        await bot.score_queue.flush()
+
+    for name in ("add_score", "list_scores", "leaderboard"):
+        results[f"cmd_{name}"]["db_ops_per_run"] = metrics.commands[name].db_ops.mean()
+    results["cmd_invalid_category"] = await ameasure(lambda run: bot.leaderboard.callback(ctx, hot_game, "no-such-category"), args.runs)
+
+    #Autocomplete handlers, one call per keystroke
+    interaction = FakeInteraction(ctx, hot_game)
+    results["autocomplete_game"] = await ameasure(lambda run: bot.game_autocomplete(interaction, hot_game[:run % len(hot_game)]), args.runs)
+    results["autocomplete_category"] = await ameasure(lambda run: bot.category_autocomplete(interaction, hot_path[:run % len(hot_path)]), args.runs)
+
+def import_bot(work_dir: str, storage_url: str, config):
+    '''
+    Imports bot.py with a config pointing at the benchmark storage. bot.py reads its configs from the working directory.
+    '''
+    with open(os.path.join(REPO_DIR, "default-config.yml"), 'r') as config_file:
+        base_config = yaml.load(config_file, Loader=yaml.FullLoader)["base_config"]
+    base_config.update({"storage_url": storage_url, "db_name": BENCH_DB_NAME})
+    with open(os.path.join(work_dir, "config.yml"), 'w') as config_file:
+        yaml.dump({"base_config": base_config}, config_file)
+    with open(os.path.join(work_dir, "games-config.yml"), 'w') as config_file:
+        yaml.dump(config, config_file)
+
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        import bot
+    finally:
+        os.chdir(cwd)
+    return bot
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_results(results, previous=None):
+    for name, result in results.items():
+        if "mean_ms" not in result:
+            print(f"{name:<26} {result['total_s'] * 1000:>10.2f} ms total")
+            continue
+
+        line = f"{name:<26} {result['mean_ms']:>10.3f} ms mean  {result['p95_ms']:>10.3f} ms p95  ({result['runs']} runs)"
+        old = (previous or {}).get(name)
+        if old and old.get("mean_ms"):
+            line += f"  {(result['mean_ms'] - old['mean_ms']) / old['mean_ms'] * 100:+.1f}% vs previous"
+        print(line)
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    config = games_config(args)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        storage_url = args.storage_url or f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+        results = {}
+        bot_data = BotData(storage_url, BENCH_DB_NAME)
+        hot_game, hot_path = bench_botdata(bot_data, config, args, rng, results)
+
+        bot = import_bot(work_dir, storage_url, config)
+        asyncio.run(bench_commands(bot, hot_game, hot_path, args, rng, results))
+        bot.async_data.shutdown()
+
+        bot_data.storage.drop()
+        bot_data.storage.close()
+        bot.bot_data.storage.close()
+
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "storage": "sqlite" if storage_url.startswith("sqlite://") else "mongo",
+            "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "storage_url")},
+        },
+        "results": results,
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r') as compare_file:
+            previous = json.load(compare_file)["results"]
+
+    print_results(results, previous)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2)
+        print(f"Wrote results to {args.output}")
+
+if __name__ == "__main__":
+    main()
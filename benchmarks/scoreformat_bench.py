@@ -0,0 +1,34 @@
+import os
+import sys
+import random
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from scoreformat import compile_time_format
+
+# Compares the legacy strptime/strftime datetime scores against integer microseconds
+# parsed and formatted by a precompiled TimeFormat.
+# Usage: python benchmarks/scoreformat_bench.py [number of scores]
+SCORE_FMT = "%M:%S.%f"
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+random.seed(0)
+score_values = [f"{random.randint(0, 59):02d}:{random.randint(0, 59):02d}.{random.randint(0, 999999):06d}" for _ in range(count)]
+time_format = compile_time_format(SCORE_FMT)
+legacy_scores = [datetime.strptime(value, SCORE_FMT) for value in score_values]
+micro_scores = [time_format.parse(value) for value in score_values]
+
+def bench(name, func, number=5):
+    seconds = min(timeit.repeat(func, number=1, repeat=number))
+    print(f"{name:<28} {seconds * 1000:>10.2f} ms  {seconds / count * 1e9:>8.0f} ns/score")
+
+print(f"{count} scores, format {SCORE_FMT}")
+bench("parse strptime", lambda: [datetime.strptime(value, SCORE_FMT) for value in score_values])
+bench("parse TimeFormat", lambda: [time_format.parse(value) for value in score_values])
+bench("format strftime", lambda: [score.strftime(SCORE_FMT) for score in legacy_scores])
+bench("format TimeFormat", lambda: [time_format.format(score) for score in micro_scores])
+bench("sort datetime", lambda: sorted(legacy_scores))
+bench("sort int", lambda: sorted(micro_scores))
+bench("diff datetime", lambda: [a - b for a, b in zip(legacy_scores, legacy_scores[1:])])
+bench("diff int", lambda: [a - b for a, b in zip(micro_scores, micro_scores[1:])])
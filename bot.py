@@ -1,19 +1,37 @@
 import discord
+from discord import app_commands
 from discord.ext import commands
 import yaml
-from botdata import BotData
+import asyncio
+import logging
+import tempfile
+import aiohttp
+import scoreio
+from botdata import BotData, AsyncBotData
+from routing import ChannelRef
+from leaderboard import RankChange
+from scorequeue import ScoreQueue
+from configwatcher import ConfigWatcher
+from admission import RateLimiter, ConcurrencyLimit, Coalescer
+from metrics import metrics
 from datetime import datetime
 
+log = logging.getLogger("bot")
+
 # Loading Base Config
 try:
-    print("Loading Config...")
     with open("config.yml", 'r') as config_file:
         config = yaml.load(config_file, Loader=yaml.FullLoader)
 except Exception as e:
-    print(e)
-    print("Unable to load config.yml. Make sure you created your configuration.")
+    log.error("Unable to load config.yml. Make sure you created your configuration. %s", e)
     exit(1)
 
+# Debug logging is off by default, disabled log calls cost a level check and nothing else
+logging.basicConfig(
+    level=config["base_config"].get("log_level", "INFO"),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+
 token               = config["base_config"]["auth_token"]
 admin_role_enabled  = config["base_config"]["admin_role"]["enabled"]
 admin_role_name     = config["base_config"]["admin_role"]["role"]
@@ -21,29 +39,235 @@ user_role_enabled   = config["base_config"]["user_role"]["enabled"]
 user_role_name      = config["base_config"]["user_role"]["role"]
 mongo_url           = config["base_config"]["mongo_url"]
 db_name             = config["base_config"]["db_name"]
+storage_url         = config["base_config"].get("storage_url", mongo_url)
+db_workers          = config["base_config"].get("db_workers", 4)
+page_size           = config["base_config"].get("page_size", 10)
+batching_config     = config["base_config"].get("score_batching", {})
+metrics_config      = config["base_config"].get("metrics", {})
+sharding_config     = config["base_config"].get("sharding", {})
+config_watch        = config["base_config"].get("config_watch", {})
+slash_config        = config["base_config"].get("slash_commands", {})
+admission_config    = config["base_config"].get("admission", {})
+archive_config      = config["base_config"].get("score_archive", {})
+snapshot_config     = config["base_config"].get("config_snapshot", {})
+mongo_client_config = config["base_config"].get("mongo_client", {})
+sharding_enabled    = sharding_config.get("enabled", False)
+shard_count         = sharding_config.get("shard_count")
+shard_ids           = sharding_config.get("shard_ids")
+response_cache_mb   = config["base_config"].get("response_cache_mb", 4)
 # DB Data init and config loading
-bot_data = BotData(mongo_url, db_name, "games-config.yml")
+# A process running a subset of the shards only keeps its own guilds in memory.
+# An unchanged games-config.yml is loaded from the snapshot of the last sync in one read.
+bot_data = BotData(storage_url, db_name, "games-config.yml", shard_ids if sharding_enabled else None, shard_count or 1,
+                   int(response_cache_mb * 1024 * 1024), snapshot_config.get("enabled", True), snapshot_config.get("force_resync", False),
+                   {name: value for name, value in mongo_client_config.items() if name != "warm_up"})
+# DB calls made from commands go through async_data so they never block the event loop
+async_data = AsyncBotData(bot_data, db_workers)
+# Optional write-behind batching of score submissions
+score_queue = None
+if batching_config.get("enabled", False):
+    score_queue = ScoreQueue(
+        async_data,
+        batching_config.get("max_batch", 100),
+        batching_config.get("max_delay", 1.0),
+        batching_config.get("durability", "flush")
+    )
+
+def log_active_config():
+    # Read from the routing table each time, a reload of games-config.yml replaces it
+    log.info("Active Channels: [%s]", ", ".join(bot_data.get_active_channels()))
+    log.info("Active Games: [%s]", ", ".join(bot_data.get_active_games()))
+
+log_active_config()
 
-active_channels = bot_data.get_active_channels()#[game['channel'] for game in config['games'] if game['enabled']]
-active_games    = bot_data.get_active_games()#[game['name'] for game in config['games'] if game['enabled']]
+async def reload_games_config():
+    stats, changed_games = await async_data.reload_games_config("games-config.yml")
+    log_active_config()
+    return stats, changed_games
 
-print(f'Active Channels: [{", ".join(active_channels)}]')
-print(f'Active Games: [{", ".join(active_games)}]')
+async def sync_slash_commands():
+    synced = await bot.tree.sync()
+    log.info("Synced %d slash commands", len(synced))
+    return synced
+
+def finish_command_run(ctx):
+    # Ends the timing get_context started for a slash invocation, once
+    run = getattr(ctx, "metrics_run", None)
+    if run:
+        ctx.metrics_run = None
+        run.failed = ctx.command_failed
+        metrics.finish_command(run)
+
+async def compact_scores_periodically(interval):
+    # Archives superseded attempts of games with a retention, see BotData.compact_scores
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await async_data.compact_scores()
+        except Exception as e:
+            log.error("Failed to compact scores: %s", e)
 
 # Bot Init
 intents = discord.Intents.default()
 intents.message_content = True
 
-bot = commands.Bot(command_prefix = '!', intents=intents)
+# AutoShardedBot runs every shard over its own gateway connection in this process.
+# Setting shard_ids runs only those shards, so several processes can split the shards and share the DB.
+BotBase = commands.AutoShardedBot if sharding_enabled else commands.Bot
+
+class PBBot(BotBase):
+    async def setup_hook(self):
+        # Runs before the gateway connects, so no command waits on opening DB connections
+        if mongo_client_config.get("warm_up", True):
+            await async_data.warm_up()
+        self.loop_lag_task = asyncio.create_task(metrics.monitor_loop_lag(metrics_config.get("loop_lag_interval", 0.5)))
+        self.metrics_runner = None
+        if metrics_config.get("enabled", False):
+            self.metrics_runner = await metrics.start_http_server(metrics_config.get("host", "0.0.0.0"), metrics_config.get("port", 9100))
+        self.config_watch_task = None
+        if config_watch.get("enabled", False):
+            watcher = ConfigWatcher("games-config.yml", reload_games_config, config_watch.get("interval", 5.0))
+            self.config_watch_task = asyncio.create_task(watcher.run())
+        self.compaction_task = None
+        if archive_config.get("enabled", False):
+            self.compaction_task = asyncio.create_task(compact_scores_periodically(archive_config.get("interval", 3600)))
+        # Registers the slash commands with discord. Syncing is rate limited, so only the process running shard 0 does it.
+        if slash_config.get("sync_on_startup", False) and (not sharding_enabled or not shard_ids or 0 in shard_ids):
+            await sync_slash_commands()
+
+    async def get_context(self, origin, *, cls=commands.Context):
+        ctx = await super().get_context(origin, cls=cls)
+        # Slash invocations of hybrid commands never go through invoke, they are timed from here
+        # until release_db_slot or on_command_error calls finish_command_run
+        if isinstance(origin, discord.Interaction) and ctx.command is not None:
+            ctx.metrics_run = metrics.start_command(ctx.command.qualified_name)
+        return ctx
+
+    async def invoke(self, ctx):
+        # Times every prefix command end to end, checks and error handlers included
+        if ctx.command is None:
+            return await super().invoke(ctx)
+        with metrics.command(ctx.command.qualified_name) as run:
+            await super().invoke(ctx)
+            run.failed = ctx.command_failed
+
+    async def close(self):
+        # Write out any queued scores before the connection goes away
+        if score_queue:
+            await score_queue.close()
+        if getattr(self, "loop_lag_task", None):
+            self.loop_lag_task.cancel()
+        if getattr(self, "config_watch_task", None):
+            self.config_watch_task.cancel()
+        if getattr(self, "compaction_task", None):
+            self.compaction_task.cancel()
+        if getattr(self, "metrics_runner", None):
+            await self.metrics_runner.cleanup()
+        await super().close()
+
+if sharding_enabled:
+    bot = PBBot(command_prefix = '!', intents=intents, shard_count=shard_count, shard_ids=shard_ids)
+else:
+    bot = PBBot(command_prefix = '!', intents=intents)
+
+# Admission control. Every command spends a token from its user's and its channel's bucket,
+# and commands that hit the DB need one of a fixed number of slots or get a busy reply.
+admission_enabled = admission_config.get("enabled", True)
+user_limits = RateLimiter(admission_config.get("user_rate", 5), admission_config.get("user_per", 10.0))
+channel_limits = RateLimiter(admission_config.get("channel_rate", 20), admission_config.get("channel_per", 10.0))
+db_commands = ConcurrencyLimit(admission_config.get("max_db_commands", 8))
+# Identical requests in flight at the same time share one result
+coalescer = Coalescer()
+
+def ctx_guild_id(ctx):
+    return ctx.guild.id if ctx.guild else None
+
+def channel_ref(ctx):
+    # Channels are keyed by (guild_id, channel_id), names are only unique within a guild
+    return ChannelRef(ctx_guild_id(ctx), ctx.channel.id, ctx.channel.name)
 
 # Error Handling Setup
 class InvalidChannelCheckFailure(commands.CheckFailure):
     pass
 
+class RateLimitedCheckFailure(commands.CheckFailure):
+    def __init__(self, message, notify):
+        super().__init__(message)
+        self.notify = notify
+
+class BusyError(commands.CommandError):
+    pass
+
+BUSY_MESSAGE = 'The bot is busy right now, try again in a few seconds.'
+
+def take_rate_limit(user_id, channel_id):
+    # Returns None when the user may go ahead in the channel, otherwise the RateLimitedCheckFailure to report
+    if not admission_enabled:
+        return None
+    limiter, key = user_limits, user_id
+    retry_after = user_limits.take(user_id)
+    if not retry_after:
+        retry_after = channel_limits.take(channel_id)
+        if retry_after:
+            # The command is not run, so it does not count against the user
+            user_limits.refund(user_id)
+            limiter, key = channel_limits, channel_id
+    if retry_after:
+        log.debug("Rate limited %s in %s for %.1fs", user_id, channel_id, retry_after)
+        # One notice per limited stretch of the bucket that turned it away, so the replies can not turn into a flood of their own
+        return RateLimitedCheckFailure(f'Slow down, try again in {retry_after:.0f}s.', limiter.notice_due(key))
+    return None
+
+@bot.check_once
+async def check_rate_limits(ctx):
+    limited = take_rate_limit(ctx.author.id, ctx.channel.id)
+    if limited:
+        raise limited
+    return True
+
+@bot.before_invoke
+async def acquire_db_slot(ctx):
+    # Runs after the checks, so a command turned away by them never takes a slot
+    if admission_enabled and ctx.command.extras.get("db_bound"):
+        if not db_commands.try_acquire():
+            raise BusyError(BUSY_MESSAGE)
+        ctx.holds_db_slot = True
+
+def free_db_slot(ctx):
+    # The flag makes a second release a no-op
+    if getattr(ctx, "holds_db_slot", False):
+        ctx.holds_db_slot = False
+        db_commands.release()
+
+@bot.after_invoke
+async def release_db_slot(ctx):
+    # Also called from on_command_error, slash invocations of hybrid commands skip the after hooks when the callback raises.
+    # Ends the timing of slash invocations too, for the same reason.
+    free_db_slot(ctx)
+    finish_command_run(ctx)
+
 # Bot Basic Events
 @bot.event
 async def on_ready():
-    print(f'We have logged in as {bot.user}')
+    log.info("We have logged in as %s", bot.user)
+
+@bot.event
+async def on_guild_available(guild):
+    # Pins the guild's config channels by id, one batched write per guild and none once they are bound
+    channels = [ChannelRef(guild.id, channel.id, channel.name) for channel in guild.text_channels]
+    bound = await async_data.bind_guild_channels(guild.id, channels)
+    log.debug("Bound %d channels in guild %s", bound, guild.id)
+
+@bot.event
+async def on_guild_join(guild):
+    # A guild the bot left had its boards dropped, its stored scores are still there
+    loaded = await async_data.load_guild(guild.id)
+    log.debug("Loaded %d personal bests of guild %s", loaded, guild.id)
+    await on_guild_available(guild)
+
+@bot.event
+async def on_guild_remove(guild):
+    bot_data.drop_guild(guild.id)
 
 # Custom Checks
 def check_admin_role_config():
@@ -74,12 +298,12 @@ def determine_valid_channel():
     # More or less, for all enabled games, grab all valid channels and determine if the command should continue.
     # Ideally, an exception that results in a channel message is thrown for channels in the game list.
     # Otherwise, a silent exception should occur to avoid spamming channels that are not bot enabled.
+    # Served from the in-memory routing table, so the check never waits on the DB.
     def predicate(ctx):
-        channel_name = ctx.channel.name
-        if channel_name in bot_data.get_active_channels():
+        if bot_data.is_channel_active(channel_ref(ctx)):
             return True
         else:
-            raise InvalidChannelCheckFailure(f'#{channel_name} is not currently active for a game.')
+            raise InvalidChannelCheckFailure(f'#{ctx.channel.name} is not currently active for a game.')
     return commands.check(predicate)
 
 #def determine_game(ctx):
@@ -100,87 +324,391 @@ async def add(ctx, *args):
         #print(f"Got arg: {arg}")
     #await ctx.send(f'[{kwargs}] Just testing... ')
 
-#def validate_name_and_category(game_name, category_name='Default'):
+async def validate_game_and_category(ctx, game_name, category_name='Default'):
+    #Validate game
+    active_game_list = bot_data.get_games_in_channel(channel_ref(ctx))
+    log.debug("Active games: %s", active_game_list)
+    if not game_name in active_game_list:
+        await ctx.send(f'Invalid game selected for this channel. Valid games are {", ".join(active_game_list)}')
+        return False
+
+    #Validate category
+    if not bot_data.is_category_available_for_game(category_name, game_name):
+        active_categories = ", ".join(bot_data.get_categories_for_game(game_name))
+        if len(active_categories) > 1800:
+            active_categories = active_categories[:1800] + "..."
+        await ctx.send(f'Invalid category selected for this game. Valid categoreis are {active_categories}')
+        return False
+
+    return True
 
 
-#TODO Add autocomple for games in current channel
-#TODO Add autocomplete for categories of selected game
+# Autocomplete is called on every keystroke, both handlers are served from in-memory prefix indexes.
+def interaction_channel_ref(interaction):
+    return ChannelRef(interaction.guild_id, interaction.channel_id, getattr(interaction.channel, "name", None))
+
+async def game_autocomplete(interaction, current: str):
+    return [app_commands.Choice(name=name, value=name) for name in bot_data.complete_games(interaction_channel_ref(interaction), current)]
+
+async def category_autocomplete(interaction, current: str):
+    game_name = getattr(interaction.namespace, "game_name", None) or ""
+    # Choice names and values are capped at 100 characters
+    return [app_commands.Choice(name=path, value=path) for path in bot_data.complete_categories(game_name, current) if len(path) <= 100]
+
 #TODO 'Default' is a special category case that needs to be fleshed out.
-#TODO Implement as slash command?
 #TODO Better validation. Score value validation doens't exist yet.
 @determine_valid_channel()
-@bot.command()
+@bot.hybrid_command(extras={"db_bound": True})
+@app_commands.autocomplete(game_name=game_autocomplete, category_name=category_autocomplete)
 async def add_score(ctx, game_name, score, category_name='Default'):
     user_id = ctx.message.author.id
-    print("Getting user_name")
     user_name = ctx.message.author.name
-    print(f"Got user_name {user_name}")
-    channel_name = ctx.channel.name
 
-    #Validate game
-    active_game_list = bot_data.get_games_in_channel(channel_name)
-    print(f"Active games: {active_game_list}")
-    if not game_name in active_game_list:
-        await ctx.send(f'Invalid game selected for this channel. Valid games are {", ".join(active_game_list)}')
-        return False
-
-    #Validate category
-    active_category_list = bot_data.get_categories_for_game(game_name)
-    print(f"Active categories: {active_category_list}")
-    if not category_name in active_category_list:
-        await ctx.send(f'Invalid category selected for this game. Valid categoreis are {", ".join(active_category_list)}')
+    if not await validate_game_and_category(ctx, game_name, category_name):
         return False
 
     #Add score data
-    bot_data.add_score(user_name, game_name, score, category_name)
-    await ctx.send(f'Successfully added score={score} to {game_name}:{category_name} for user {user_name}')
+    rank_change = None
+    if score_queue:
+        # The queue is the backpressure for batched writes. Holding a DB slot until the flush would cap every batch at max_db_commands.
+        free_db_slot(ctx)
+        # Validated now, written with the next batch
+        new_score = bot_data.prepare_score(user_name, game_name, score, category_name, ctx_guild_id(ctx))
+        previous_rank = bot_data.get_rank(user_name, game_name, category_name, ctx_guild_id(ctx)) if new_score else None
+        added = new_score is not None and await score_queue.add(new_score)
+        # The leaderboard only has the score once its batch is written
+        if added and score_queue.durability == "flush":
+            rank_change = RankChange(new_score.value, previous_rank, bot_data.get_rank(user_name, game_name, category_name, ctx_guild_id(ctx)))
+    else:
+        added = await async_data.add_score(user_name, game_name, score, category_name, ctx_guild_id(ctx))
+        rank_change = added or None
+
+    if added:
+        msg = f'Successfully added score={score} to {game_name}:{category_name} for user {user_name}'
+        if rank_change:
+            msg += "\n" + rank_change_message(game_name, category_name, rank_change)
+        await ctx.send(msg)
+    else:
+        await ctx.send(f'Unable to add score={score} to {game_name}:{category_name}. Check the score format.')
+
+def rank_change_message(game_name, category_name, change):
+    # Deltas are new minus old, so an improved time is negative and improved points are positive
+    current, previous = change.current, change.previous
+    fmt = lambda value: bot_data.format_score(game_name, category_name, value)
+    delta = lambda value, base: bot_data.format_score_delta(game_name, category_name, value - base)
+
+    msg_list = []
+    if previous is None:
+        msg_list.append(f"First score, ranked #{current.rank} of {current.board_size}")
+    elif change.is_personal_best:
+        msg_list.append(f"New personal best: {fmt(previous.best)} -> {fmt(current.best)} ({delta(current.best, previous.best)})")
+        if current.rank != previous.rank:
+            msg_list.append(f"Moved from #{previous.rank} to #{current.rank} of {current.board_size}")
+        else:
+            msg_list.append(f"Still #{current.rank} of {current.board_size}")
+    else:
+        msg_list.append(f"Personal best is still {fmt(current.best)} ({delta(change.value, current.best)}), ranked #{current.rank} of {current.board_size}")
+
+    if current.rank == 1:
+        msg_list.append("That's the record!" if change.is_personal_best else "You hold the record")
+    else:
+        msg_list.append(f"Record: {fmt(current.record)} by {current.record_holder} ({delta(current.best, current.record)})")
+    return "\n".join(msg_list)
+
+def score_page_embed(game_name, category_name, score_list):
+    msg_list = []
+    for user_name, value, create_time in score_list:
+        msg_list.append(f"{user_name} set {value} on {create_time.strftime('%m/%d/%Y %H:%M:%S')}")
+
+    # Embed descriptions are capped at 4096 characters, page_size keeps pages well under that.
+    return discord.Embed(title=f'Scores set for {game_name}:{category_name}', description="\n".join(msg_list)[:4096])
+
+async def cached_response(key, render, store=True):
+    # Repeat views of a board between submissions skip the DB and formatting.
+    # render returns the response and its approximate size in bytes.
+    # With store False, identical renders in flight are still shared but the response is not kept.
+    if key is None:
+        return (await render())[0]
+    if not store:
+        return await coalescer.run((key, bot_data.response_cache.version(key)), lambda: render_into_cache(key, None, render))
+    response, version = bot_data.response_cache.get(key)
+    if response is None:
+        # Misses for the same view at the same version share one render
+        response = await coalescer.run((key, version), lambda: render_into_cache(key, version, render))
+    return response
+
+async def render_into_cache(key, version, render):
+    # A version of None only renders
+    response, size = await render()
+    if version is not None:
+        bot_data.response_cache.put(key, version, response, size)
+    return response
+
+async def render_score_page(game_name, category_name, guild_id, after=None, before=None):
+    # Returns (embed, prev_cursor, next_cursor), an empty page has an empty description
+    async def render():
+        score_list, prev_cursor, next_cursor = await async_data.get_scores_page(
+            game_name, category_name, page_size, after=after, before=before, guild_id=guild_id)
+        embed = score_page_embed(game_name, category_name, score_list)
+        return (embed, prev_cursor, next_cursor), len(embed.title.encode()) + len(embed.description.encode())
+
+    # Pages read from a lagging replica could be cached as current while missing the newest scores, they are only coalesced
+    key = bot_data.response_key("list_scores", game_name, category_name, guild_id, (page_size, after, before))
+    return await cached_response(key, render, store=not bot_data.reads_may_lag)
+
+class ScorePageView(discord.ui.View):
+    '''
+    Prev/Next buttons for list_scores. Holds the keyset cursors of the page currently shown,
+    so moving between pages only ever fetches one page from the DB.
+    '''
+    def __init__(self, game_name, category_name, guild_id, prev_cursor, next_cursor):
+        super().__init__(timeout=300)
+        self.game_name = game_name
+        self.category_name = category_name
+        self.guild_id = guild_id
+        self.set_cursors(prev_cursor, next_cursor)
+
+    def set_cursors(self, prev_cursor, next_cursor):
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+        self.prev_page.disabled = prev_cursor is None
+        self.next_page.disabled = next_cursor is None
+
+    async def show_page(self, interaction, after=None, before=None):
+        # Button clicks skip the command checks and hooks, so they go through the same rate limits and DB slots here
+        limited = take_rate_limit(interaction.user.id, interaction.channel_id)
+        if limited:
+            await self.turn_away(interaction, str(limited) if limited.notify else None)
+            return
+        if admission_enabled and not db_commands.try_acquire():
+            await self.turn_away(interaction, BUSY_MESSAGE)
+            return
+        try:
+            embed, prev_cursor, next_cursor = await render_score_page(self.game_name, self.category_name, self.guild_id, after, before)
+        finally:
+            if admission_enabled:
+                db_commands.release()
+        self.set_cursors(prev_cursor, next_cursor)
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    async def turn_away(self, interaction, msg):
+        # Every interaction needs a response, a click without a notice due is acknowledged silently
+        if msg:
+            await interaction.response.send_message(msg, ephemeral=True)
+        else:
+            await interaction.response.defer()
+
+    @discord.ui.button(label="Prev", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction, button):
+        await self.show_page(interaction, before=self.prev_cursor)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        await self.show_page(interaction, after=self.next_cursor)
 
 @determine_valid_channel()
-@bot.command()
+@bot.hybrid_command(extras={"db_bound": True})
+@app_commands.autocomplete(game_name=game_autocomplete, category_name=category_autocomplete)
 async def list_scores(ctx, game_name, category_name='Default'):
     user_id = ctx.message.author.id
-    channel_name = ctx.channel.name
-    #Validate game
-    active_game_list = bot_data.get_games_in_channel(channel_name)
-    print(f"Active games: {active_game_list}")
-    if not game_name in active_game_list:
-        await ctx.send(f'Invalid game selected for this channel. Valid games are {", ".join(active_game_list)}')
+    if not await validate_game_and_category(ctx, game_name, category_name):
         return False
 
-    #Validate category
-    active_category_list = bot_data.get_categories_for_game(game_name)
-    print(f"Active categories: {active_category_list}")
-    if not category_name in active_category_list:
-        await ctx.send(f'Invalid category selected for this game. Valid categoreis are {", ".join(active_category_list)}')
+    # Scores come back sorted best first, one page at a time.
+    embed, prev_cursor, next_cursor = await render_score_page(game_name, category_name, ctx_guild_id(ctx))
+    if embed.description:
+        view = ScorePageView(game_name, category_name, ctx_guild_id(ctx), prev_cursor, next_cursor)
+        await ctx.send(embed=embed, view=view)
+    else:
+        await ctx.send(f'No scores set for {game_name}:{category_name}')
+
+@determine_valid_channel()
+@bot.command()
+async def leaderboard(ctx, game_name, category_name='Default'):
+    if not await validate_game_and_category(ctx, game_name, category_name):
         return False
 
-    score_list = bot_data.get_scores(game_name)
-    print(f"Got score_list: {score_list}")
+    # Personal bests are kept current on every add_score, so this never scans score history.
+    async def render():
+        top_scores = bot_data.get_leaderboard(game_name, category_name, guild_id=ctx_guild_id(ctx))
+        msg_list = []
+        for rank, (user_name, value, create_time) in enumerate(top_scores, start=1):
+            msg_list.append(f"#{rank} {user_name} {value} on {create_time.strftime('%m/%d/%Y')}")
+
+        msg = "\n".join(msg_list)
+        if(len(top_scores) > 0):
+            msg = f'Leaderboard for {game_name}:{category_name}\n {msg}'
+        else:
+            msg = f'No scores set for {game_name}:{category_name}'
+        return msg, len(msg.encode())
+
+    await ctx.send(await cached_response(bot_data.response_key("leaderboard", game_name, category_name, ctx_guild_id(ctx)), render))
+
+@determine_valid_channel()
+@bot.hybrid_command()
+@app_commands.autocomplete(game_name=game_autocomplete, category_name=category_autocomplete)
+async def rank(ctx, game_name, category_name='Default', player_name=None):
+    # Defaults to the caller. Served from the in-memory leaderboard, a bisect per lookup.
+    player_name = player_name or ctx.message.author.name
+    if not await validate_game_and_category(ctx, game_name, category_name):
+        return False
+
+    player_rank = bot_data.get_rank(player_name, game_name, category_name, ctx_guild_id(ctx))
+    if player_rank is None:
+        await ctx.send(f'No scores set by {player_name} for {game_name}:{category_name}')
+        return
+
+    best = bot_data.format_score(game_name, category_name, player_rank.best)
+    msg = f'{player_name} is ranked #{player_rank.rank} of {player_rank.board_size} on {game_name}:{category_name} with {best}'
+    if player_rank.rank > 1:
+        record = bot_data.format_score(game_name, category_name, player_rank.record)
+        gap = bot_data.format_score_delta(game_name, category_name, player_rank.best - player_rank.record)
+        msg += f'\nRecord: {record} by {player_rank.record_holder} ({gap})'
+    await ctx.send(msg)
+
+@determine_valid_channel()
+@bot.hybrid_command()
+async def profile(ctx, player_name=None):
+    # A player's best and rank in every category they have played, across every game.
+    # Served from the in-memory leaderboard, one bisect per category the player has a score in.
+    player_name = player_name or ctx.message.author.name
+    standings = bot_data.get_profile(player_name, ctx_guild_id(ctx))
+    if not standings:
+        await ctx.send(f'No scores set by {player_name}')
+        return
+
     msg_list = []
-    for score in score_list:
-        user_name = score[0]
-        create_time = score[2].strftime("%m/%d/%Y %H:%M:%S")
-        value = score[1]
-        msg_list.append(f"{user_name} set {value} on {create_time}")
+    for game_name, category_path, player_rank in standings:
+        best = bot_data.format_score(game_name, category_path, player_rank.best)
+        msg_list.append(f"{game_name}:{category_path} #{player_rank.rank} of {player_rank.board_size} with {best}")
+    records = sum(1 for _, _, player_rank in standings if player_rank.rank == 1)
+    embed = discord.Embed(title=f'Profile for {player_name}', description="\n".join(msg_list)[:4096])
+    embed.set_footer(text=f'{len(standings)} categories, {records} records')
+    await ctx.send(embed=embed)
+
+@determine_valid_channel()
+@bot.hybrid_command(extras={"db_bound": True})
+@app_commands.autocomplete(game_name=game_autocomplete, category_name=category_autocomplete)
+async def history(ctx, game_name, category_name='Default', player_name=None):
+    # Every attempt, newest first. Reads the archive too, so it still shows attempts compaction moved out.
+    player_name = player_name or ctx.message.author.name
+    if not await validate_game_and_category(ctx, game_name, category_name):
+        return False
+
+    attempts = await async_data.get_player_history(player_name, game_name, category_name, page_size, ctx_guild_id(ctx))
+    if not attempts:
+        await ctx.send(f'No scores set by {player_name} for {game_name}:{category_name}')
+        return
+
+    msg_list = [f"{value} on {create_time.strftime('%m/%d/%Y %H:%M:%S')}" for value, create_time in attempts]
+    await ctx.send(embed=discord.Embed(title=f'Latest attempts by {player_name} for {game_name}:{category_name}', description="\n".join(msg_list)[:4096]))
+
+async def download_attachment(attachment, file):
+    # Streamed to disk in chunks, attachment.read() would hold the whole file in memory
+    async with aiohttp.ClientSession() as session:
+        async with session.get(attachment.url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                file.write(chunk)
+    file.seek(0)
 
+@check_admin_role_config()
+@bot.command(extras={"db_bound": True})
+async def import_scores(ctx):
+    # Rows are validated against their category and written in batches, see scoreio.py for the columns.
+    if not ctx.message.attachments:
+        await ctx.send(f'Attach a CSV or JSONL file with the columns {", ".join(scoreio.COLUMNS)}')
+        return
+
+    attachment = ctx.message.attachments[0]
+    with tempfile.TemporaryFile() as file:
+        await download_attachment(attachment, file)
+        result = await async_data.run(scoreio.import_scores_file, bot_data, file, scoreio.format_for(attachment.filename), ctx_guild_id(ctx))
+
+    msg_list = [f'{result.summary()} from {attachment.filename}']
+    msg_list += [f'Line {line}: {reason}' for line, reason in result.rejects[:10]]
+    if result.rejected > 10:
+        msg_list.append(f'...and {result.rejected - 10} more')
     msg = "\n".join(msg_list)
-    if(len(score_list) > 0):
-        await ctx.send(f'Scores set for {game_name}:{category_name}\n {msg}')
-    else:
-        await ctx.send(f'No scores set for {game_name}:{category_name}')
+    if len(msg) > 1980:
+        msg = msg[:1980] + "..."
+    await ctx.send(msg)
+
+@determine_valid_channel()
+@bot.command(extras={"db_bound": True})
+async def export_scores(ctx, game_name, category_name='Default', file_format='csv'):
+    if not await validate_game_and_category(ctx, game_name, category_name):
+        return False
+    if file_format not in scoreio.FORMATS:
+        await ctx.send(f'Invalid format. Valid formats are {", ".join(scoreio.FORMATS)}')
+        return False
+
+    # Written page by page to a temporary file, the history is never held in memory
+    with tempfile.TemporaryFile() as file:
+        written = await async_data.run(scoreio.export_scores_file, bot_data, file, game_name, category_name, ctx_guild_id(ctx), file_format)
+        file.seek(0)
+        file_name = f'{game_name}-{category_name}.{file_format}'.replace("/", "_")
+        try:
+            await ctx.send(f'Exported {written} scores for {game_name}:{category_name}', file=discord.File(file, filename=file_name))
+        except discord.HTTPException as e:
+            log.warning("Failed to send export of %s:%s: %s", game_name, category_name, e)
+            await ctx.send('The export is too large to attach. Run python scoreio.py export on the bot host instead.')
+
+@check_admin_role_config()
+@bot.command()
+async def stats(ctx):
+    # Messages are capped at 2000 characters, the full set is on the metrics endpoint.
+    summary = metrics.summary()
+    summary += (f"\nAdmission: {db_commands.running}/{db_commands.max_running} DB commands running, "
+                f"{db_commands.rejected} turned away busy, {user_limits.limited + channel_limits.limited} rate limited, "
+                f"{coalescer.coalesced} coalesced")
+    if len(summary) > 1980:
+        summary = summary[:1980] + "..."
+    await ctx.send(f'```\n{summary}\n```')
+
+@check_admin_role_config()
+@bot.command()
+async def sync_commands(ctx):
+    # For when the slash commands changed and sync_on_startup is off
+    synced = await sync_slash_commands()
+    await ctx.send(f'Synced {len(synced)} slash commands.')
+
+@check_admin_role_config()
+@bot.command(extras={"db_bound": True})
+async def reload_config(ctx):
+    # Only games and channels that changed are written, in-flight commands keep the routes they started with
+    try:
+        stats, changed_games = await reload_games_config()
+    except Exception as e:
+        log.error("Failed to reload games config: %s", e)
+        await ctx.send(f'Failed to reload games-config.yml: {e}')
+        return
+
+    changed = ", ".join(changed_games) if changed_games else "none"
+    if len(changed) > 1800:
+        changed = changed[:1800] + "..."
+    await ctx.send(f'Reloaded games-config.yml. Changed games: {changed}. Channel updates: {stats["channel_writes"]}')
 
 
 # Error Handling
 @bot.event
 async def on_command_error(ctx, error):
+    await release_db_slot(ctx)
     if isinstance(error, InvalidChannelCheckFailure):
         await ctx.send(error)
+    if isinstance(error, RateLimitedCheckFailure) and error.notify:
+        await ctx.send(error)
+    if isinstance(error, BusyError):
+        await ctx.send(error)
     if isinstance(error, discord.ext.commands.errors.MissingRole):
         await ctx.send(error)
 
 @add.error
 async def add_error(ctx, error):
-    print(f"Add Command Error. : [{error}]")
+    log.warning("Add Command Error. : [%s]", error)
 
 # Launch
-bot.run(token)
\ No newline at end of file
+# Guarded so the command callbacks can be imported and driven by benchmarks/bot_bench.py
+if __name__ == "__main__":
+    bot.run(token)
+    async_data.shutdown()
\ No newline at end of file
@@ -1,37 +1,90 @@
-from pymongo import MongoClient
 from model import *
-from typing import List, Tuple
-from datetime import datetime
+from storage import create_storage, MeteredStorage
+from routing import RoutingTable, GameRoute, ChannelRef, shard_for_guild
+from leaderboard import Leaderboard
+from responsecache import ResponseCache
+from scoreformat import compile_time_format
+from typing import List, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import asyncio
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import time
 import yaml
 
+log = logging.getLogger(__name__)
+
+#Bump when a change to the sync would build different routes from the same games config, so stored snapshots stop matching
+SNAPSHOT_VERSION = 1
+SNAPSHOT_NAME = "games_config"
+
 class BotData():
     '''
-    Provides functions to interact with bot data stored in mongo DB.
+    Provides functions to interact with bot data stored in mongo DB or SQLite.
+    The backend is picked from the url, see storage.create_storage.
+    When the bot runs as several shard processes sharing one DB, shard_ids and shard_count limit
+    the per-guild state each process keeps in memory to the guilds its shards serve.
+    With use_snapshot, an unchanged games config is loaded from the snapshot of the last sync instead of synced again,
+    force_sync syncs regardless. mongo_options are the mongo client settings, see storage.MongoStorage.
     '''
-    def __init__(self, url: str, db_name: str = 'BOTDATA', games_config = None):
-        self.mongo_client = MongoClient(url)
-        self.db = self.mongo_client[db_name]
-        init_model(self.db)
+    def __init__(self, url: str, db_name: str = 'BOTDATA', games_config = None,
+                 shard_ids: Optional[List[int]] = None, shard_count: int = 1, response_cache_bytes: int = 4 * 1024 * 1024,
+                 use_snapshot: bool = False, force_sync: bool = False, mongo_options: dict = None):
+        #Every storage call is counted as a DB operation of the command making it
+        self.storage = MeteredStorage(create_storage(url, db_name, mongo_options))
+        #Score listings, history and exports may come from a replica behind the latest writes
+        self.reads_may_lag = self.storage.reads_may_lag
+        self.shard_ids = set(shard_ids) if shard_ids is not None else None
+        self.shard_count = shard_count
+        self.routes = RoutingTable()
+        #Serializes writers of the routing table. Readers use whatever table self.routes points at, reloads swap in a new one.
+        self.routes_lock = Lock()
+        self.leaderboard = Leaderboard()
+        #Rendered list_scores and leaderboard responses, every new score in a category makes its entries stale
+        self.response_cache = ResponseCache(response_cache_bytes)
 
         if(games_config):
             #Games config can be passed as a file or pre-loaded dict
             if(isinstance(games_config, str)):
                 games_config = self.load_config_file(games_config)
 
-            self._init_games_config(games_config)
+            #The sync rewrites the categories of changed games, embedded scores from before the scores collection would go with them
+            migrated = self.migrate_embedded_scores()
+            if migrated:
+                log.warning("Migrated %d embedded scores to the scores collection before syncing the games config", migrated)
+
+            if use_snapshot:
+                self._init_games_config_snapshot(games_config, force_sync)
+            else:
+                self._init_games_config(games_config)
+        else:
+            self._load_routes()
+
+        self._load_leaderboard()
 
     #Private methods
-    def _init_category(self, category_config, cat_label="Category"):
+    def _init_category(self, category_config, cat_label="Category", parent_score_type="Time", parent_score_fmt=None):
         cat_name = category_config["name"]
-        score_type = category_config.get("score_type", "Time")
-        score_fmt = category_config.get("score_fmt", None)
+        #Subcategories inherit the scoring rules of their parent unless they override them
+        score_type = category_config.get("score_type", parent_score_type)
+        score_fmt = category_config.get("score_fmt", parent_score_fmt)
         enabled = category_config.get("enabled", True)
+        #Compiled here so a bad score_fmt fails the sync or reload instead of rejecting every submitted score
+        if score_type == "Time":
+            try:
+                compile_time_format(score_fmt)
+            except ValueError as e:
+                raise ValueError(f"Invalid score_fmt for {cat_name}: {e}") from e
 
         if "subcategory" in category_config:
             subcategory_config = category_config["subcategory"]
-            cat_label = subcategory_config.get("label", "Category")
-            categories = self._init_game_categories(subcategory_config["category"], cat_label)
-            print("Created subcategory")
+            sub_label = subcategory_config.get("label", "Category")
+            categories = self._init_game_categories(subcategory_config["category"], sub_label, score_type, score_fmt)
+            log.debug("Created subcategory for %s", cat_name)
         else:
             categories = None
 
@@ -45,100 +98,280 @@ class BotData():
         )
         return category
 
-    def _init_game_categories(self, category_config, cat_label="Category"):
+    def _init_game_categories(self, category_config, cat_label="Category", score_type="Time", score_fmt=None):
         categories = []
         for category in category_config:
-            categories.append(self._init_category(category, cat_label))
+            categories.append(self._init_category(category, cat_label, score_type, score_fmt))
         return categories
         
-    def _init_games_config(self, games_config):
+    def _init_game_config(self, config):
         '''
-        Syncs the provided games_config dict state with the state of the DB.
-        Only adds new channels and games if they are not currently present in DB.
-        Should we be able to toggle enabled state on existing channels/games with this?
+        Returns the (enabled, categories, retention) state a single game entry of the games config describes.
         '''
-        for config in games_config:
-            channel_list = config['channel']
-            name = config['name']
-            enabled = config['enabled']
-            if("category" in config):
-                categories = self._init_game_categories(config['category'])
-            else:
-                category = Category(
-                    score_type="Time",
-                    score_fmt="%M:%S.%f", 
-                    categories=None
-                )
-                categories = [category]
+        if("category" in config):
+            categories = self._init_game_categories(config['category'])
+        else:
+            category = Category(
+                score_type="Time",
+                score_fmt="%M:%S.%f", 
+                categories=None
+            )
+            categories = [category]
+
+        retention = config.get("retention")
+        if retention is not None and (not isinstance(retention, int) or retention < 0):
+            raise ValueError(f"Invalid retention {retention} for {config['name']}, expected a whole number of attempts")
+        return config['enabled'], categories, retention
+
+    def _init_games_config(self, games_config, snapshot_hash: str = None):
+        '''
+        Syncs the provided games_config dict state with the state of the DB in a single pass.
+        Games and channels are each read once, the difference is computed in memory
+        and applied with at most one batched write for games and one for channel links.
+        New games and channels are added, existing games pick up changes to their enabled state and categories,
+        and channels are linked to any configured games they are missing.
+        Config channels are either a channel name, which applies in every guild,
+        or a {guild_id, channel_id} mapping for one specific channel.
+        When snapshot_hash is given, the resulting game and channel state is saved as the snapshot of that config.
+        Returns a dict with the number of DB operations and writes it took.
+        '''
+        start_time = time.perf_counter()
+        with self.routes_lock:
+            db_games = {game["name"]: game for game in self.storage.load_games()}
+            db_channels = {self._channel_key(channel): channel for channel in self.storage.load_channels()}
+            sync_stats, _ = self._sync_games_config(games_config, db_games, db_channels, 2)
+            if snapshot_hash:
+                #Every guild's channels, the routes of this process may only hold its own shards' guilds
+                self.storage.save_snapshot(SNAPSHOT_NAME, {"hash": snapshot_hash, "games": list(db_games.values()),
+                                                           "channels": list(db_channels.values())})
+                sync_stats["db_ops"] += 1
+
+        log.info("Synced games config in %.3fs: %s", time.perf_counter() - start_time, sync_stats)
+        return sync_stats
+
+    def _init_games_config_snapshot(self, games_config, force_sync: bool = False):
+        '''
+        Startup path of the bot. When the games config hashes the same as the config of the stored snapshot,
+        the routing table is built from the snapshot with a single read and the sync is skipped.
+        Otherwise, or with force_sync, runs the full sync and snapshots its result.
+        Writes to games or channels made after startup delete the snapshot, so the next start syncs again.
+        Returns True when the snapshot was used.
+        '''
+        start_time = time.perf_counter()
+        config_hash = self._config_hash(games_config)
+        with self.routes_lock:
+            snapshot = None if force_sync else self.storage.load_snapshot(SNAPSHOT_NAME)
+            if snapshot and snapshot["hash"] == config_hash:
+                self._build_routes(snapshot["games"], snapshot["channels"])
+                log.info("Loaded unchanged games config from its snapshot in %.3fs", time.perf_counter() - start_time)
+                return True
+
+        log.info("Games config %s, running a full sync", "resync forced" if force_sync else "changed or not snapshotted")
+        self._init_games_config(games_config, config_hash)
+        return False
 
+    def _config_hash(self, games_config):
+        #Hashes the parsed config, so comments and formatting do not count as changes
+        content = json.dumps([SNAPSHOT_VERSION, games_config], sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
 
-            if not (game := self._get_game(name)):
-                game = self.add_game(name, categories, enabled)
-            else:
-                game = self._get_game(name)
+    def _snapshot_stale(self):
+        self.storage.delete_snapshot(SNAPSHOT_NAME)
 
-            for channel in channel_list:
-                if not self._get_channel(channel):
-                   new_channel = self._add_channel(channel, [game])
+    def _sync_games_config(self, games_config, db_games: dict, db_channels: dict, db_ops: int, unchanged_routes: dict = None):
+        '''
+        Applies the difference between games_config and the given game and channel state, then swaps in the routing table built from the result.
+        The whole config is parsed before anything is written, so a malformed entry leaves storage and routing untouched.
+        Returns the sync stats and the names of the games that were written.
+        '''
+        #Games
+        game_writes = []
+        config_channels = {}
+        for config in games_config:
+            name = config['name']
+            enabled, categories, retention = self._init_game_config(config)
+            category_docs = [category.dict() for category in categories]
+
+            db_game = db_games.get(name)
+            db_categories = [Category.parse_obj(category).dict() for category in db_game["categories"]] if db_game else None
+            if not db_game or db_game["is_enabled"] != enabled or db_categories != category_docs or db_game.get("retention") != retention:
+                game_writes.append({"name": name, "is_enabled": enabled, "categories": category_docs, "retention": retention})
+
+            db_games[name] = {"id": None, **(db_game or {}), "name": name, "is_enabled": enabled, "categories": category_docs,
+                              "retention": retention}
+            for channel in config['channel']:
+                if isinstance(channel, dict):
+                    channel = (channel["guild_id"], channel["channel_id"])
+                config_channels.setdefault(channel, []).append(name)
+
+        if game_writes:
+            game_ids = self.storage.upsert_games(game_writes)
+            db_ops += 1
+            for name, game_id in game_ids.items():
+                db_games[name]["id"] = game_id
+
+        #Channels
+        channel_links = {}
+        channel_bindings = []
+        for key, game_names in config_channels.items():
+            if isinstance(key, tuple):
+                db_channel = db_channels.setdefault(key, {"guild_id": key[0], "channel_id": key[1], "name": None, "games": []})
+            else:
+                db_channel = db_channels.setdefault(key, {"guild_id": None, "channel_id": None, "name": key, "games": []})
+            missing_ids = [db_games[name]["id"] for name in game_names if db_games[name]["id"] not in db_channel["games"]]
+            if missing_ids:
+                if isinstance(key, tuple):
+                    channel_bindings.append({"guild_id": key[0], "channel_id": key[1], "name": None, "games": missing_ids})
                 else:
-                    chan = self._get_channel(channel)
-                    if game.name not in self.get_games_in_channel(chan.name) + self.get_games_in_channel(chan.name, False):
-                        self._add_game_to_channel(game, chan)
+                    channel_links[key] = missing_ids
+                db_channel["games"] = db_channel["games"] + missing_ids
+
+        if channel_links:
+            self.storage.link_channel_games(channel_links)
+            db_ops += 1
+        if channel_bindings:
+            self.storage.bind_channels(channel_bindings)
+            db_ops += 1
+
+        #Only games that were written get their category index rebuilt, the rest of the routes are carried over
+        written = {game["name"] for game in game_writes}
+        if unchanged_routes:
+            unchanged_routes = {name: route for name, route in unchanged_routes.items() if name not in written}
+        self._build_routes(db_games.values(), db_channels.values(), unchanged_routes)
+
+        sync_stats = {"db_ops": db_ops, "game_writes": len(game_writes), "channel_writes": len(channel_links) + len(channel_bindings)}
+        return sync_stats, sorted(written)
+
+    def _routes_state(self, routes: RoutingTable):
+        '''
+        Returns the (games, channels) dicts the routing table was built from, in the shape storage loads them.
+        Lets a config reload diff against memory instead of reading every game and channel back.
+        '''
+        games = {name: {"id": game.id, "name": name, "is_enabled": game.is_enabled,
+                        "categories": [category.dict() for category in game.categories], "retention": game.retention}
+                 for name, game in routes.games.items()}
+
+        def game_ids(game_names):
+            return [games[name]["id"] for name in game_names if name in games]
+
+        channels = {name: {"guild_id": None, "channel_id": None, "name": name, "games": game_ids(game_names)}
+                    for name, game_names in routes.channels.items()}
+        for guild_id, bound_channels in routes.guilds.items():
+            for channel_id, bound in bound_channels.items():
+                channels[(guild_id, channel_id)] = {"guild_id": guild_id, "channel_id": channel_id, "name": bound.name,
+                                                   "games": game_ids(bound.game_names)}
+        return games, channels
+
+    def _load_routes(self):
+        '''
+        Builds the in-memory routing table with a single read of the stored games and channels.
+        '''
+        with self.routes_lock:
+            self._build_routes(self.storage.load_games(), self.storage.load_channels())
+
+    def _build_routes(self, games, channels, unchanged_routes: dict = None):
+        '''
+        Builds the routing table from stored game and channel dicts and swaps it in.
+        Channels link to game ids, game names are resolved from the ids.
+        Channels bound in guilds served by other shard processes are left out.
+        GameRoutes in unchanged_routes are reused as they are instead of being parsed and indexed again.
+        '''
+        routes = RoutingTable()
+        game_names = {}
+        unchanged_routes = unchanged_routes or {}
+        for game in games:
+            game_names[game["id"]] = game["name"]
+            route = unchanged_routes.get(game["name"])
+            if route is not None and route.id == game["id"]:
+                routes.games[game["name"]] = route
+                continue
+            categories = [Category.parse_obj(category) for category in game["categories"]]
+            routes.set_game(game["name"], game["is_enabled"], categories, game["id"], game.get("retention"))
+
+        for channel in channels:
+            channel_games = [game_names[game_id] for game_id in channel["games"] if game_id in game_names]
+            if channel["channel_id"] is None:
+                routes.set_channel(channel["name"], channel_games)
+            elif self.owns_guild(channel["guild_id"]):
+                routes.bind_channel(channel["guild_id"], channel["channel_id"], channel["name"], channel_games)
+
+        self.routes = routes
+
+    def _channel_key(self, channel: dict):
+        return channel["name"] if channel["channel_id"] is None else (channel["guild_id"], channel["channel_id"])
+
+    def _load_leaderboard(self):
+        '''
+        Builds the personal best index with a single query for every player's best score.
+        Only guilds served by this process are kept.
+        '''
+        leaderboard = Leaderboard()
+        for score in self.storage.find_personal_bests():
+            if self.owns_guild(score.guild_id):
+                leaderboard.add_score(score.game, score.category, score.score_type, score.player_id, score.value, score.create_time, score.guild_id)
 
-    def _get_channel(self, name: str):
-        return Channel.find(Channel.name == name, fetch_links = True).first_or_none()
+        self.leaderboard = leaderboard
 
     def _get_game(self, name: str):
-        return Game.find(Game.name == name).first_or_none()
+        return self.routes.get_game(name)
 
-    def _get_category(self, game: Game, category_name: str):
-        for category in game.categories: 
-            if category.name == category_name:
-                return category
-            elif hasattr(category, "categories"):
-                return self._get_category(category, category_name)
+    def _get_category(self, game: GameRoute, category_name: str):
+        return self._resolve_category(game.name, category_name)[1]
 
-    def _add_channel(self, name: str, games: List[Game]):
-        channel = Channel(name=name, games=games)
-        channel.save()
-        return channel
-
-    def _add_game_to_channel(self, game: Game, channel: Channel):
-        channel.games.append(game)
-        channel.save()
+    def _resolve_category(self, game_name: str, category_name: str):
+        '''
+        Returns a (category_path, category) tuple from the game's precomputed category path index.
+        '''
+        game = self.routes.get_game(game_name)
+        return game.get_category(category_name) if game else (None, None)
+
+    def _add_channel(self, channel: Union[ChannelRef, str], games: List[GameRoute]):
+        self._snapshot_stale()
+        if isinstance(channel, str):
+            self.storage.link_channel_games({channel: [game.id for game in games]})
+            self.routes.set_channel(channel, [game.name for game in games])
+        else:
+            self.storage.bind_channels([{"guild_id": channel.guild_id, "channel_id": channel.channel_id, "name": channel.name,
+                                         "games": [game.id for game in games]}])
+            self.routes.bind_channel(channel.guild_id, channel.channel_id, channel.name, [game.name for game in games])
+
+    def _add_game_to_channel(self, game: GameRoute, channel: Union[ChannelRef, str]):
+        self._snapshot_stale()
+        if isinstance(channel, str):
+            self.storage.link_channel_games({channel: [game.id]})
+        else:
+            self.storage.bind_channels([{"guild_id": channel.guild_id, "channel_id": channel.channel_id, "name": channel.name, "games": [game.id]}])
+        self.routes.add_game_to_channel(channel, game.name)
 
     def _add_category(self, name: str, category: Category, parent_node):
-        if(isinstance(parent_node, Game) or isinstance(parent_node, Category)):
+        if(isinstance(parent_node, GameRoute) or isinstance(parent_node, Category)):
             parent_node.categories.append(category)
         else:
-            print(f"Invalid parent_node type {type(parent_node)}")
+            log.warning("Invalid parent_node type %s", type(parent_node))
             return False
      
-    def _add_score_to_category(self, player_id: str, category: Category, score_value: str):
+    def _create_score(self, player_id: str, game_name: str, category_path: str, category: Category, score_value: str):
         try:
             score = None
             match category.score_type:
                 case "Time":
-                    time = datetime.strptime(score_value, category.score_fmt)
-                    score = TimeScore(player_id=player_id, value=time)
+                    time = compile_time_format(category.score_fmt).parse(score_value)
+                    score = ScoreEntry(game=game_name, category=category_path, player_id=player_id, score_type="Time", value=time)
                 case "Point":
                     points = int(score_value)
-                    score = PointScore(player_id=player_id, value=points)
+                    score = ScoreEntry(game=game_name, category=category_path, player_id=player_id, score_type="Point", value=points)
                 case _:
-                    print("Invalid score type selected.")
-                    return False
+                    log.warning("Invalid score type %s for %s", category.score_type, category.name)
 
-        except ValueError as e:
-            print(f"Invalid score value for {category.name}")
-            print(f"Expected format is {category.score_fmt}")
-            return False
+        except ValueError:
+            log.debug("Invalid score value %s for %s, expected format is %s", score_value, category.name, category.score_fmt)
 
-        if(score):
-            print("Added new score with value: {score.value} for player_id: {player_id}")
-            category.scores.append(score)
-            return True
+        return score
 
-        return False
+    def _format_score_value(self, category: Category, value):
+        if category.score_type == "Time":
+            return compile_time_format(category.score_fmt).format(value)
+        return value
 
     #Public methods
     def load_config_file(self, file_name: str):
@@ -147,80 +380,405 @@ class BotData():
                 config = yaml.load(config_file, Loader=yaml.FullLoader)
                 return config
         except Exception as e:
-            print(e)
-            print(f"Failed to load to load config: {file_name}")
+            log.error("Failed to load config %s: %s", file_name, e)
+
+    def add_game(self, name: str, categories: List[Category], is_enabled: bool = True, retention: Optional[int] = None):
+        self._snapshot_stale()
+        game_ids = self.storage.upsert_games([{"name": name, "is_enabled": is_enabled, "categories": [category.dict() for category in categories],
+                                               "retention": retention}])
+        game_id = game_ids.get(name)
+        if game_id is None:
+            #Mongo only returns the ids of the games it inserted, an existing game keeps the id it was stored with
+            game = self._get_game(name)
+            game_id = game.id if game else next(game["id"] for game in self.storage.load_games() if game["name"] == name)
+        return self.routes.set_game(name, is_enabled, categories, game_id, retention)
+
+    def prepare_score(self, player_id: str, game_name: str, score_value: str, category_name: str='Default', guild_id: int = None):
+        '''
+        Validates a submission and returns the ScoreEntry to write, or None if it is invalid.
+        Only uses the in-memory routing table, nothing is written.
+        '''
+        category_path, category = self._resolve_category(game_name, category_name)
+        if(category):
+            score = self._create_score(player_id, game_name, category_path, category, score_value)
+            if score:
+                score.guild_id = guild_id
+            return score
+
+        log.debug("Failed to add score %s:%s for %s:%s", player_id, score_value, game_name, category_name)
+        return None
+
+    def _score_added(self, score: ScoreEntry):
+        #score_type comes from the record, a reload may have removed the category since the score was validated
+        rank_change = self.leaderboard.add_score(score.game, score.category, score.score_type, score.player_id, score.value, score.create_time, score.guild_id)
+        #Bumped once the score is both stored and ranked, so nothing rendered before it can be cached as current
+        self.response_cache.invalidate(score.guild_id, score.game, score.category)
+        return rank_change
+
+    def add_score(self, player_id: str, game_name: str, score_value: str, category_name: str='Default', guild_id: int = None):
+        '''
+        Validates and writes a submission. Returns the RankChange it made on the leaderboard, or False if it is invalid.
+        '''
+        score = self.prepare_score(player_id, game_name, score_value, category_name, guild_id)
+        if(score):
+            self.storage.insert_scores([score])
+            rank_change = self._score_added(score)
+            log.debug("Added new score with value %s for player_id %s", score.value, player_id)
+            return rank_change
 
-    def add_game(self, name: str, categories: List[Category], is_enabled: bool = True):
-        new_game = Game(name=name, is_enabled=is_enabled, categories=categories)
-        new_game.save()
-        return new_game
+        log.debug("Failed to save score")
+        return False
 
-    def add_score(self, player_id: str, game_name: str, score_value: str, category_name: str='Default'):
-        game = self._get_game(game_name)
-        category = self._get_category(game, category_name)
-        if(category):
-            print(f"Adding score to {category.name}")
-            added_score = self._add_score_to_category(player_id, category, score_value)
-            if(added_score):
-                game.save()
-                print("Saved score to game")
-            else:
-                print("Failed to save score")
-        else:
-            print(f"Failed to add score {player_id}:{score_value} for {game_name}:{category_name}.")
+    def insert_scores(self, scores: List[ScoreEntry]):
+        '''
+        Writes already validated scores with a single bulk insert.
+        Once written, a score that fails to rank is logged and left for the next leaderboard load instead of failing the batch.
+        '''
+        if scores:
+            self.storage.insert_scores(scores)
+            for score in scores:
+                try:
+                    self._score_added(score)
+                except Exception as e:
+                    log.error("Failed to rank stored score %s for %s:%s: %s", score.id, score.game, score.category, e)
+        return len(scores)
+
+    #Migrations only apply to data written by older versions of the bot, which only ran on mongo DB
+    def migrate_embedded_scores(self):
+        return self.storage.migrate_embedded_scores()
+
+    def migrate_time_scores(self):
+        return self.storage.migrate_time_scores()
+
+    def migrate_guild_scores(self, guild_id: int):
+        return self.storage.migrate_guild_scores(guild_id)
+
+    def warm_up(self):
+        '''
+        Opens storage connections ahead of the first command. Returns the seconds it took.
+        '''
+        start_time = time.perf_counter()
+        self.storage.warm_up()
+        elapsed = time.perf_counter() - start_time
+        log.info("Warmed up storage connections in %.3fs", elapsed)
+        return elapsed
 
-    def get_channels(self):
-        return [channel.name for channel in Channel.find_all()]
+    def owns_guild(self, guild_id: Optional[int]):
+        '''
+        Whether this process serves the guild. Always true unless it runs a subset of the shards.
+        '''
+        if self.shard_ids is None or guild_id is None:
+            return True
+        return shard_for_guild(guild_id, self.shard_count) in self.shard_ids
 
-    def get_active_channels(self):
+    def bind_guild_channels(self, guild_id: int, channels: List[ChannelRef]):
         '''
-        Returns a list of active channel names.
-        A channel is considered active if it has at least one active game within it.
+        Binds a guild's channels that match games config channel names by (guild_id, channel_id), with one batched write.
+        Called when a guild becomes available, so bound channels keep their games when renamed.
+        Returns the number of channels written.
         '''
-        active_channel_list = []
-        for game_name in self.get_active_games():
-            game = self._get_game(game_name)
-            channels = Channel.find_all(fetch_links = True)
+        with self.routes_lock:
+            bindings = []
             for channel in channels:
-                if game in channel.games:
-                    active_channel_list.append(channel.name)
+                config_games = self.routes.channels.get(channel.name, [])
+                bound = self.routes.get_bound_channel(guild_id, channel.channel_id)
+                bound_games = bound.game_names if bound else []
+                missing_games = [name for name in config_games if name not in bound_games and name in self.routes.games]
+                if missing_games or (bound and bound.name != channel.name):
+                    bindings.append((channel, bound_games + missing_games, missing_games))
+
+            if bindings:
+                self._snapshot_stale()
+                self.storage.bind_channels([{"guild_id": guild_id, "channel_id": channel.channel_id, "name": channel.name,
+                                             "games": [self.routes.get_game(name).id for name in missing_games]}
+                                            for channel, _, missing_games in bindings])
+                for channel, game_names, _ in bindings:
+                    self.routes.bind_channel(guild_id, channel.channel_id, channel.name, game_names)
+        return len(bindings)
+
+    def drop_guild(self, guild_id: int):
+        '''
+        Evicts a guild's in-memory state, for guilds the bot left. Stored data is kept.
+        '''
+        with self.routes_lock:
+            self.routes.drop_guild(guild_id)
+        self.leaderboard.drop_guild(guild_id)
+
+    def load_guild(self, guild_id: int):
+        '''
+        Restores a guild's leaderboards from its stored personal bests, for guilds the bot joined again after drop_guild.
+        Scores already on the boards are kept, so a score added while the query runs is not lost.
+        Returns the number of personal bests loaded.
+        '''
+        if not self.owns_guild(guild_id):
+            return 0
+        scores = list(self.storage.find_personal_bests(guild_id))
+        for score in scores:
+            self.leaderboard.add_score(score.game, score.category, score.score_type, score.player_id, score.value, score.create_time, score.guild_id)
+        for game_name, category_path in set((score.game, score.category) for score in scores):
+            self.response_cache.invalidate(guild_id, game_name, category_path)
+        return len(scores)
+
+    def reload_games_config(self, games_config = "games-config.yml"):
+        '''
+        Re-reads the games config and applies only what changed since the routing table was built, without a restart.
+        The diff runs against the in-memory routes, so an unchanged config makes no DB calls at all,
+        and only games whose enabled state or categories changed are written and re-indexed.
+        The new routing table is swapped in with a single assignment, commands see either the old routes or the new ones.
+        Like the startup sync, games and channels dropped from the config are kept.
+        Raises ValueError when the config can not be loaded. Returns the sync stats and the names of the written games.
+        '''
+        if(isinstance(games_config, str)):
+            games_config = self.load_config_file(games_config)
+        if not isinstance(games_config, list):
+            raise ValueError("Games config is missing or is not a list of games")
+
+        start_time = time.perf_counter()
+        with self.routes_lock:
+            routes = self.routes
+            db_games, db_channels = self._routes_state(routes)
+            sync_stats, changed_games = self._sync_games_config(games_config, db_games, db_channels, 0, routes.games)
+            if sync_stats["db_ops"]:
+                self._snapshot_stale()
+        #Changed categories and score formats change how cached responses would render
+        if changed_games:
+            self.response_cache.clear()
+
+        log.info("Reloaded games config in %.3fs: %s, changed games: [%s]", time.perf_counter() - start_time, sync_stats, ", ".join(changed_games))
+        return sync_stats, changed_games
+
+    def compact_scores(self):
+        '''
+        Moves superseded attempts into the archive for every game with a retention set in the games config.
+        Each player keeps their personal best and their retention most recent attempts in the scores every other query reads,
+        so those stay small however many attempts get submitted. Archived attempts are only read by get_player_history.
+        Personal bests are never archived, so the leaderboard is unaffected.
+        Returns a game name -> number of scores archived dict.
+        '''
+        start_time = time.perf_counter()
+        archived = {}
+        for name, game in self.routes.games.items():
+            if game.retention is not None:
+                archived[name] = self.storage.archive_scores(name, game.retention)
+        #list_scores pages show the scores that are left
+        if any(archived.values()):
+            self.response_cache.clear()
+
+        log.info("Compacted scores in %.3fs, archived: %s", time.perf_counter() - start_time, archived)
+        return archived
+
+    def get_channels(self, guild_id: Optional[int] = None):
+        '''
+        Returns the games config channel names, or the channels bound in a guild as ChannelRefs when guild_id is given.
+        '''
+        return self.routes.get_channels(guild_id)
 
-        return active_channel_list
+    def get_active_channels(self, guild_id: Optional[int] = None):
+        '''
+        Returns a list of active channels, see get_channels.
+        A channel is considered active if it has at least one active game within it.
+        '''
+        return self.routes.get_active_channels(guild_id)
 
-    #TODO maybe create a sepearate method to get active Game objects, or maybe just get the names in the bot.py code?
     def get_active_games(self):
-        return [game.name for game in Game.find_many(Game.is_enabled == True)]
+        return self.routes.get_active_games()
 
-    #Assumes channel names are uniqe. Could require a (channel, server) pair if multiple servers need to be considered.
+    #Channels are ChannelRefs keyed by (guild_id, channel_id), a plain name only matches the games config channel names.
     #game_enabled = None should return all games in the channel
-    def get_games_in_channel(self, channel_name: str, game_enabled: bool = True):
-        channel =  self._get_channel(channel_name)
-        if(channel):
-            return [game.name for game in channel.games if game_enabled is None or game.is_enabled == game_enabled]
+    def get_games_in_channel(self, channel: Union[ChannelRef, str], game_enabled: bool = True):
+        return self.routes.get_games_in_channel(channel, game_enabled)
 
     def get_categories_for_game(self, game_name: str, category_enabled: bool = True):
-        game = self._get_game(game_name)
-        print(f"Got game: {game.name}")
+        '''
+        Returns the full paths of every category scores can be submitted to, e.g. '3lap/Rainbow Road'.
+        '''
+        game = self.routes.get_game(game_name)
         if(game):
-            self._get_category()
-            cat_list = [category.name for category in game.categories if category.is_enabled == category_enabled]
-
-            print(f"Got Categories: {cat_list}")
-            return cat_list
+            return game.get_category_paths(category_enabled)
         else:
-            print("Game not found")
+            log.debug("Game %s not found", game_name)
             return []
 
-    def get_scores(self, game_name: str, category_name: str = 'Default'):
-        game = self._get_game(game_name)
-        category = self._get_category(game, category_name)
-        if category.score_type == "Time":
-            return [(score.player_id, score.value.strftime(category.score_fmt), score.create_time) for score in category.scores]
+    def is_channel_active(self, channel: Union[ChannelRef, str]):
+        return self.routes.is_channel_active(channel)
+
+    #Autocomplete runs on every keystroke, both are served from prefix indexes in the routing table
+    def complete_games(self, channel: Union[ChannelRef, str], prefix: str = ""):
+        return self.routes.complete_games(channel, prefix)
+
+    def complete_categories(self, game_name: str, prefix: str = ""):
+        return self.routes.complete_categories(game_name, prefix)
+
+    def get_scores(self, game_name: str, category_name: str = 'Default', guild_id: int = None):
+        category_path, category = self._resolve_category(game_name, category_name)
+        if not category:
+            return []
+
+        scores = self.storage.find_scores(game_name, category_path, guild_id)
+        return [(score.player_id, self._format_score_value(category, score.value), score.create_time) for score in scores]
+
+    def get_scores_page(self, game_name: str, category_name: str = 'Default', page_size: int = 10,
+                        after: Tuple = None, before: Tuple = None, order_by: str = "value", guild_id: int = None):
+        '''
+        Returns one page of scores as a (scores, prev_cursor, next_cursor) tuple, sorted and limited by the DB.
+        order_by is "value" (best first) or "create_time" (newest first).
+        Pages are keyset based: pass next_cursor as after, or prev_cursor as before, to move between pages.
+        A cursor is None when there is no page in that direction.
+        Every page is a bounded index range scan, so its cost does not grow with the number of scores.
+        '''
+        category_path, category = self._resolve_category(game_name, category_name)
+        if not category:
+            return [], None, None
+
+        if order_by == "value":
+            direction = -1 if category.score_type == "Point" else 1
         else:
-            return [(score.player_id,  score.value, score.create_time) for score in category.scores]
+            direction = -1
+
+        #Paging backwards walks the index the other way and flips the rows afterwards
+        cursor = before or after
+        if before:
+            direction = -direction
+
+        scores = self.storage.find_scores_page(game_name, category_path, order_by, direction, cursor, page_size + 1, guild_id)
+        has_more = len(scores) > page_size
+        scores = scores[:page_size]
+        if before:
+            scores.reverse()
+
+        if not scores:
+            return [], None, None
+
+        first_cursor = (getattr(scores[0], order_by), scores[0].id)
+        last_cursor = (getattr(scores[-1], order_by), scores[-1].id)
+        if before:
+            prev_cursor, next_cursor = (first_cursor if has_more else None), last_cursor
+        else:
+            prev_cursor, next_cursor = (first_cursor if after else None), (last_cursor if has_more else None)
+
+        return (
+            [(score.player_id, self._format_score_value(category, score.value), score.create_time) for score in scores],
+            prev_cursor,
+            next_cursor
+        )
+
+    def get_player_history(self, player_id: str, game_name: str, category_name: str = 'Default', count: int = 10, guild_id: int = None):
+        '''
+        Returns a player's count most recent attempts in a category, newest first, archived attempts included.
+        '''
+        category_path, category = self._resolve_category(game_name, category_name)
+        if not category:
+            return []
 
-    def is_game_available_for_channel(self, game_name: str, channel_name: str):
-        return game_name in self.get_games_in_channel(channel_name)
+        scores = self.storage.find_player_scores(game_name, category_path, player_id, count, guild_id)
+        return [(self._format_score_value(category, score.value), score.create_time) for score in scores]
 
+    def get_leaderboard(self, game_name: str, category_name: str = 'Default', count: int = 10, guild_id: int = None):
+        '''
+        Returns the top count personal bests for a category, best first, from the in-memory index.
+        '''
+        category_path, category = self._resolve_category(game_name, category_name)
+        if not category:
+            return []
+
+        return [(player_id, self._format_score_value(category, value), create_time)
+                for player_id, value, create_time in self.leaderboard.top(game_name, category_path, count, guild_id)]
+
+    def response_key(self, view: str, game_name: str, category_name: str = 'Default', guild_id: int = None, page = None):
+        '''
+        Returns the response_cache key for a rendered view of a category, or None when the category does not exist.
+        '''
+        category_path = self._resolve_category(game_name, category_name)[0]
+        return (view, guild_id, game_name, category_path, page) if category_path else None
+
+    def get_rank(self, player_id: str, game_name: str, category_name: str = 'Default', guild_id: int = None):
+        '''
+        Returns the player's BoardRank in a category from the in-memory index, or None without a score.
+        Values are raw, see format_score and format_score_delta.
+        '''
+        category_path, category = self._resolve_category(game_name, category_name)
+        if not category:
+            return None
+        return self.leaderboard.get_rank(game_name, category_path, player_id, guild_id)
+
+    def get_profile(self, player_id: str, guild_id: int = None):
+        '''
+        Returns the player's standing in every category they have a score in, as (game_name, category_path, BoardRank) tuples
+        sorted by game and category. Served from the leaderboard's per-player index, so it makes no DB calls
+        and its cost only grows with the number of categories the player has played.
+        Games that are no longer configured are left out. Values are raw, see format_score.
+        '''
+        return [(game_name, category_path, player_rank) for game_name, category_path, player_rank in self.leaderboard.profile(player_id, guild_id)
+                if self._resolve_category(game_name, category_path)[1]]
+
+    def format_score(self, game_name: str, category_name: str, value):
+        category = self._resolve_category(game_name, category_name)[1]
+        return self._format_score_value(category, value) if category else str(value)
+
+    def format_score_delta(self, game_name: str, category_name: str, delta):
+        '''
+        Formats the difference of two scores with its sign, e.g. -00:01.500000 or +25.
+        '''
+        category = self._resolve_category(game_name, category_name)[1]
+        if category and category.score_type == "Time":
+            return ("+" if delta >= 0 else "") + self._format_score_value(category, delta)
+        return f"{delta:+d}"
+
+    def is_game_available_for_channel(self, game_name: str, channel: Union[ChannelRef, str]):
+        return game_name in self.get_games_in_channel(channel)
+
+    #Accepts a full category path or a leaf name that is unique within the game
     def is_category_available_for_game(self, category_name: str, game_name: str):
-        return category_name in self.get_categories_for_game(game_name)
+        game = self.routes.get_game(game_name)
+        path = game.get_category_path(category_name) if game else None
+        return path is not None and game.enabled_paths[path]
+
+class AsyncBotData():
+    '''
+    Awaitable wrapper around BotData for use from the bot's event loop.
+    Calls that hit the DB run on a bounded thread pool so a slow query never blocks the loop.
+    Lookups served from the in-memory routing table are cheap and can be called on bot_data directly.
+    '''
+    def __init__(self, bot_data: BotData, max_workers: int = 4):
+        self.bot_data = bot_data
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="botdata")
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        #run_in_executor does not carry context variables over, copy them so DB ops are counted against the calling command
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, func, *args, **kwargs))
+
+    async def add_score(self, player_id: str, game_name: str, score_value: str, category_name: str='Default', guild_id: int = None):
+        return await self.run(self.bot_data.add_score, player_id, game_name, score_value, category_name, guild_id)
+
+    async def insert_scores(self, scores: List[ScoreEntry]):
+        return await self.run(self.bot_data.insert_scores, scores)
+
+    async def get_scores(self, game_name: str, category_name: str = 'Default', guild_id: int = None):
+        return await self.run(self.bot_data.get_scores, game_name, category_name, guild_id)
+
+    async def get_scores_page(self, game_name: str, category_name: str = 'Default', page_size: int = 10,
+                              after: Tuple = None, before: Tuple = None, order_by: str = "value", guild_id: int = None):
+        return await self.run(self.bot_data.get_scores_page, game_name, category_name, page_size, after, before, order_by, guild_id)
+
+    async def get_player_history(self, player_id: str, game_name: str, category_name: str = 'Default', count: int = 10, guild_id: int = None):
+        return await self.run(self.bot_data.get_player_history, player_id, game_name, category_name, count, guild_id)
+
+    async def compact_scores(self):
+        return await self.run(self.bot_data.compact_scores)
+
+    async def bind_guild_channels(self, guild_id: int, channels: List[ChannelRef]):
+        return await self.run(self.bot_data.bind_guild_channels, guild_id, channels)
+
+    async def load_guild(self, guild_id: int):
+        return await self.run(self.bot_data.load_guild, guild_id)
+
+    async def reload_games_config(self, games_config = "games-config.yml"):
+        return await self.run(self.bot_data.reload_games_config, games_config)
+
+    async def warm_up(self):
+        return await self.run(self.bot_data.warm_up)
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
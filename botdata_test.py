@@ -1,9 +1,18 @@
 import yaml
+import time
+import asyncio
+from datetime import datetime
 import unittest
-from botdata import BotData
+from botdata import BotData, AsyncBotData
+from routing import ChannelRef
+from metrics import metrics
 from model import *
+from storage import MongoStorage
 
-class BotDataIntegrationTest(unittest.TestCase):
+class BotDataIntegrationTest():
+    '''
+    Backend independent BotData tests, run against every storage backend by the TestCase classes below.
+    '''
     TEST_DB_NAME = "BOTTESTDATA"
     #@classmethod
     def _load_test_config(configName: str):
@@ -13,69 +22,97 @@ class BotDataIntegrationTest(unittest.TestCase):
         except Exception as e:
             BotDataIntegrationTest.fail(f"Failed to load test config file: {configName} with Exception: {e}")
 
+    @classmethod
+    def _storage_url(self):
+        raise NotImplementedError
+
     @classmethod
     def setUpClass(self):
         self.config = self._load_test_config("test-config.yml")
-        self.mongo_url = self.config["base_config"]["mongo_url"]
         self.games_config = self.config["games"]
-        self.bot_data = BotData(self.mongo_url, self.TEST_DB_NAME)
+        self.bot_data = BotData(self._storage_url(), self.TEST_DB_NAME)
+        self.storage = self.bot_data.storage
 
     def setUp(self):
         #Make sure we start with a clean slate
-        self.bot_data.mongo_client.drop_database(self.TEST_DB_NAME)
+        self.storage.drop()
         self.bot_data._init_games_config(self.games_config)
-        self.db = self.bot_data.mongo_client.BOTTESTDATA
+        self.bot_data._load_leaderboard()
 
+    def _stored_channels(self):
+        game_names = {game["id"]: game["name"] for game in self.storage.load_games()}
+        return {channel["name"] if channel["channel_id"] is None else (channel["guild_id"], channel["channel_id"]):
+                [game_names[game_id] for game_id in channel["games"]] for channel in self.storage.load_channels()}
 
     def test_init_config(self):
         #Init games config again to check for idempotency
         self.bot_data._init_games_config(self.games_config)
 
-        #Check for expected collections
-        db_collections = self.db.list_collection_names()
-        assert_collections = ['games', 'channels']
-        for collection in assert_collections:
-            self.assertIn(collection, db_collections)
-
         #Check for expected games
-        #self.bot_data.add_game("Junk game",[("test", "test", True)]) #Makes it fail
-        db_games = [ game['name'] for game in self.db.games.find() ]
+        db_games = [ game['name'] for game in self.storage.load_games() ]
         assert_games = [ game['name'] for game in self.games_config ]
         self.assertEqual(assert_games, db_games)
 
-        #Idempotency check
-        db_channels = Channel.find_many()
-        db_channels_fetch_links = Channel.find_many(fetch_links = True)
-        no_fetch_chan_lengths = [len(chan.games) for chan in db_channels]
-        fetch_chan_lengths = [len(chan.games) for chan in db_channels_fetch_links]
-        self.assertEquals(no_fetch_chan_lengths, fetch_chan_lengths)
-
-        #Check for expected channels having expected games. This gets nasty.
-        db_channels = [ {channel.name : [game.name for game in channel.games ] } for channel in Channel.find_many(fetch_links = True)]
-        assert_channels = [{game['name'] : game['channel']} for game in self.games_config]
-        #Check for channels not loaded from config
-        #assert_channels.append({"mk64" : ["Junk channel"]})
-        print("Assert channels: ")
-        for channel in assert_channels:
-            print(f"Keys = {list(channel.keys())[0]}")
-            print(f"Values = {list(channel.values())[0]}")
-
-        print("\nDB Channels: ")
-        for channel in db_channels:
-            print(f"Keys = {list(channel.keys())[0]}")
-            print(f"Values = {list(channel.values())[0]}")
-
-        print("\nDB Channels: ")
-        for channel in db_channels:
-            d_chan_key = list(channel.keys())[0]
-            d_chan_values = list(channel.values())[0]
-            for a_channel in assert_channels:
-                a_chan_key = list(a_channel.keys())[0]
-                a_chan_values = list(a_channel.values())[0]
-                if d_chan_key in a_chan_values:
-                    print(f"Found d_chan_key={d_chan_key} in a_chan_values={a_chan_values}")
-                    print(f"Asserting a_chan_key={a_chan_key} in d_chan_values={d_chan_values}")
-                    self.assertIn(a_chan_key, d_chan_values)
+        #Check for expected channels having expected games, each linked once
+        assert_channels = {}
+        for game in self.games_config:
+            for channel in game['channel']:
+                assert_channels.setdefault(channel, []).append(game['name'])
+        self.assertEqual(assert_channels, self._stored_channels())
+
+    def test_init_config_diff(self):
+        #An unchanged config only costs the two reads
+        self.assertEqual({"db_ops": 2, "game_writes": 0, "channel_writes": 0}, self.bot_data._init_games_config(self.games_config))
+
+        changed_config = [dict(game) for game in self.games_config]
+        changed_config[0]["enabled"] = not changed_config[0]["enabled"]
+        changed_config[0]["channel"] = changed_config[0]["channel"] + ["new-test"]
+        sync_stats = self.bot_data._init_games_config(changed_config)
+
+        self.assertEqual({"db_ops": 4, "game_writes": 1, "channel_writes": 1}, sync_stats)
+        db_games = {game["name"]: game for game in self.storage.load_games()}
+        self.assertEqual(changed_config[0]["enabled"], db_games[changed_config[0]["name"]]["is_enabled"])
+        self.assertEqual([changed_config[0]["name"]], self.bot_data.get_games_in_channel("new-test", None))
+
+    def test_reload_games_config(self):
+        #An unchanged config is diffed against memory and makes no DB calls
+        self.assertEqual(({"db_ops": 0, "game_writes": 0, "channel_writes": 0}, []), self.bot_data.reload_games_config(self.games_config))
+
+        self.bot_data.bind_guild_channels(5, [ChannelRef(5, 50, self.games_config[0]["channel"][0])])
+        unchanged_route = self.bot_data.routes.get_game(self.games_config[1]["name"])
+        changed_config = [dict(game) for game in self.games_config]
+        changed_config[0]["enabled"] = not changed_config[0]["enabled"]
+        changed_config[0]["channel"] = changed_config[0]["channel"] + ["new-test"]
+        changed_config.append({"name": "reload-game", "channel": ["reload-test"], "enabled": True,
+                               "category": [{"name": "Any%"}, {"name": "100%"}]})
+        sync_stats, changed_games = self.bot_data.reload_games_config(changed_config)
+
+        self.assertEqual({"db_ops": 2, "game_writes": 2, "channel_writes": 2}, sync_stats)
+        self.assertEqual(sorted([changed_config[0]["name"], "reload-game"]), changed_games)
+        self.assertEqual(["reload-game"], self.bot_data.get_games_in_channel("reload-test"))
+        self.assertEqual(["Any%", "100%"], self.bot_data.get_categories_for_game("reload-game"))
+        self.assertEqual(["reload-game"], self.bot_data.complete_games("reload-test", "rel"))
+        self.assertEqual(["100%"], self.bot_data.complete_categories("reload-game", "1"))
+        self.assertEqual(changed_config[0]["enabled"], self.bot_data.routes.get_game(changed_config[0]["name"]).is_enabled)
+        #Unchanged games keep their route and guild bindings survive the reload
+        self.assertIs(unchanged_route, self.bot_data.routes.get_game(self.games_config[1]["name"]))
+        self.assertIsNotNone(self.bot_data.routes.get_bound_channel(5, 50))
+
+        #Memory and storage agree, a full sync finds nothing left to write
+        self.assertEqual({"db_ops": 2, "game_writes": 0, "channel_writes": 0}, self.bot_data._init_games_config(changed_config))
+
+    def test_reload_games_config_invalid(self):
+        routes = self.bot_data.routes
+        with self.assertRaises(ValueError):
+            self.bot_data.reload_games_config("missing-games-config.yml")
+        with self.assertRaises(KeyError):
+            self.bot_data.reload_games_config(self.games_config + [{"name": "no-channel", "enabled": True}])
+        with self.assertRaises(ValueError):
+            self.bot_data.reload_games_config([dict(self.games_config[0], retention=-1)])
+        with self.assertRaises(ValueError):
+            self.bot_data.reload_games_config([dict(self.games_config[0], category=[{"name": "Any%", "score_fmt": "%M:%S.%Q"}])])
+        self.assertIs(routes, self.bot_data.routes)
+        self.assertNotIn("no-channel", [game["name"] for game in self.storage.load_games()])
 
     def test_get_active_games(self):
         db_active_games = set(self.bot_data.get_active_games())
@@ -118,13 +155,429 @@ class BotDataIntegrationTest(unittest.TestCase):
         #category = Category(name="Single track", score_type="Time", score_fmt="%H:%M:%S", subcategory=[subcategory])
         #game = Game(name="mk64", is_enabled=True, categories=[category])
         #game.save()
-    #def test_get_categories_for_game(self):
-        #db_cats_for_game = self.bot_data.get_categories_for_game()
+    def test_get_categories_for_game(self):
+        self.assertEqual(["3lap/Rainbow Road", "3lap/Toad Turnpike"], self.bot_data.get_categories_for_game("mk64"))
+        self.assertEqual(["Default"], self.bot_data.get_categories_for_game("cyber-hook"))
+        self.assertTrue(self.bot_data.is_category_available_for_game("Toad Turnpike", "mk64"))
+        self.assertTrue(self.bot_data.is_category_available_for_game("3lap/Toad Turnpike", "mk64"))
+        self.assertFalse(self.bot_data.is_category_available_for_game("3lap", "mk64"))
     
+    def test_routes_match_db(self):
+        #Routing table rebuilt from the DB should match the one kept current by the write paths
+        cached_channels = {channel: set(self.bot_data.get_games_in_channel(channel, None)) for channel in self.bot_data.get_channels()}
+        self.bot_data._load_routes()
+        db_channels = {channel: set(self.bot_data.get_games_in_channel(channel, None)) for channel in self.bot_data.get_channels()}
+        self.assertEqual(cached_channels, db_channels)
+
+    def test_routes_updated_by_writes(self):
+        game = self.bot_data.add_game("route-test", [Category(score_type="Point")])
+        self.bot_data._add_channel("route-test-channel", [game])
+
+        self.assertIn("route-test", self.bot_data.get_active_games())
+        self.assertIn("route-test-channel", self.bot_data.get_active_channels())
+        self.assertEqual(["route-test"], self.bot_data.get_games_in_channel("route-test-channel"))
+        self.assertEqual(["Default"], self.bot_data.get_categories_for_game("route-test"))
+
+        #Updating an existing game keeps its id in the routes
+        self.assertEqual(game.id, self.bot_data.add_game("route-test", [Category(score_type="Time")], False).id)
+        self.assertEqual(["route-test"], self.bot_data.get_games_in_channel("route-test-channel", None))
+
     def test_get_category(self):
         game = self.bot_data._get_game("mk64")
         category = self.bot_data._get_category(game, "Toad Turnpike")
         self.assertEqual("Toad Turnpike", category.name)
 
+    def test_games_config_snapshot(self):
+        self.bot_data.bind_guild_channels(5, [ChannelRef(5, 50, "cyber-hook-test")])
+        #No snapshot yet, the first start syncs and snapshots the result
+        self.assertFalse(self.bot_data._init_games_config_snapshot(self.games_config))
+        synced_state = self.bot_data._routes_state(self.bot_data.routes)
+
+        #An unchanged config is loaded with one read and builds the same routes, guild bindings included
+        with metrics.command("snapshot-test") as run:
+            self.assertTrue(self.bot_data._init_games_config_snapshot(self.games_config))
+        self.assertEqual(1, run.db_ops)
+        self.assertEqual(synced_state, self.bot_data._routes_state(self.bot_data.routes))
+        self.assertEqual(["cyber-hook"], self.bot_data.get_games_in_channel(ChannelRef(5, 50, "cyber-hook-test")))
+
+        self.assertFalse(self.bot_data._init_games_config_snapshot(self.games_config, force_sync=True))
+        changed_config = [dict(self.games_config[0], enabled=not self.games_config[0]["enabled"])] + self.games_config[1:]
+        self.assertFalse(self.bot_data._init_games_config_snapshot(changed_config))
+        self.assertTrue(self.bot_data._init_games_config_snapshot(changed_config))
+
+        #Writes after startup make the snapshot stale
+        self.bot_data.bind_guild_channels(6, [ChannelRef(6, 60, "cyber-hook-test")])
+        self.assertFalse(self.bot_data._init_games_config_snapshot(changed_config))
+        self.assertIsNotNone(self.bot_data.routes.get_bound_channel(6, 60))
+
+    def test_warm_up(self):
+        #Reads go to the primary unless a read preference says otherwise
+        self.assertFalse(self.bot_data.reads_may_lag)
+        self.assertGreaterEqual(self.bot_data.warm_up(), 0)
+
+    def test_add_score(self):
+        self.assertTrue(self.bot_data.add_score("player1", "cyber-hook", "01:02.500000"))
+        self.assertTrue(self.bot_data.add_score("player2", "mk64", "00:58.100000", "Toad Turnpike"))
+        self.assertFalse(self.bot_data.add_score("player1", "cyber-hook", "not a time"))
+
+        #Scores are stored keyed by game and full category path
+        db_scores = [ (score.game, score.category, score.player_id) for score in
+                      self.storage.find_scores("cyber-hook", "Default") + self.storage.find_scores("mk64", "3lap/Toad Turnpike") ]
+        self.assertEqual([("cyber-hook", "Default", "player1"), ("mk64", "3lap/Toad Turnpike", "player2")], db_scores)
+
+    def test_insert_scores(self):
+        scores = [self.bot_data.prepare_score(f"player{i}", "cyber-hook", f"01:0{i}.000000") for i in range(3)]
+        self.assertIsNone(self.bot_data.prepare_score("player1", "cyber-hook", "not a time"))
+        self.assertEqual(0, len(self.storage.find_scores("cyber-hook", "Default")))
+
+        self.assertEqual(3, self.bot_data.insert_scores(scores))
+        self.assertEqual(3, len(self.storage.find_scores("cyber-hook", "Default")))
+        self.assertEqual(["player0", "player1", "player2"], [score[0] for score in self.bot_data.get_leaderboard("cyber-hook")])
+
+    def test_insert_scores_after_reload(self):
+        #Validated before a reload removed its category, like a score waiting in the batching queue
+        queued = [self.bot_data.prepare_score("player1", "mk64", "01:30.000000", "Rainbow Road"),
+                  self.bot_data.prepare_score("player1", "cyber-hook", "01:00.000000")]
+        mk64_config = dict(self.games_config[1], category=[{"name": "3lap", "subcategory": {"label": "Map", "category": [{"name": "Toad Turnpike"}]}}])
+        self.bot_data.reload_games_config([self.games_config[0], mk64_config] + self.games_config[2:])
+
+        self.assertEqual(2, self.bot_data.insert_scores(queued))
+        self.assertEqual(1, self.bot_data.get_rank("player1", "cyber-hook").rank)
+        self.assertEqual(1, self.bot_data.leaderboard.get_rank("mk64", "3lap/Rainbow Road", "player1").rank)
+
+    def test_get_scores(self):
+        self.bot_data.add_score("player1", "cyber-hook", "01:02.500000")
+        self.bot_data.add_score("player2", "cyber-hook", "00:59.000000")
+        self.bot_data.add_score("player2", "mk64", "00:58.100000", "Toad Turnpike")
+
+        scores = self.bot_data.get_scores("cyber-hook")
+        self.assertEqual([("player1", "01:02.500000"), ("player2", "00:59.000000")], [score[:2] for score in scores])
+
+    def test_get_leaderboard(self):
+        self.bot_data.add_score("player1", "cyber-hook", "01:02.500000")
+        self.bot_data.add_score("player2", "cyber-hook", "00:59.000000")
+        self.bot_data.add_score("player1", "cyber-hook", "00:58.000000")
+        self.bot_data.add_score("player2", "cyber-hook", "01:05.000000")
+
+        assert_leaderboard = [("player1", "00:58.000000"), ("player2", "00:59.000000")]
+        self.assertEqual(assert_leaderboard, [score[:2] for score in self.bot_data.get_leaderboard("cyber-hook")])
+
+        #Rebuilding the index from the scores collection should give the same board
+        self.bot_data._load_leaderboard()
+        self.assertEqual(assert_leaderboard, [score[:2] for score in self.bot_data.get_leaderboard("cyber-hook")])
+
+    def test_load_point_leaderboard(self):
+        self.bot_data.add_game("point-test", [Category(score_type="Point")])
+        scores = [self.bot_data.prepare_score(player_id, "point-test", points) for player_id, points in
+                  [("player1", "300"), ("player2", "500"), ("player1", "700"), ("player2", "500"), ("player1", "100")]]
+        for hour, score in enumerate(scores):
+            score.create_time = datetime(2023, 1, 1, hour)
+        self.bot_data.insert_scores(scores)
+        live_board = self.bot_data.get_leaderboard("point-test")
+
+        #Point boards are rebuilt highest first, tied bests keep the earliest score like the live board
+        self.bot_data._load_leaderboard()
+        self.assertEqual([("player1", 700, datetime(2023, 1, 1, 2)), ("player2", 500, datetime(2023, 1, 1, 1))], self.bot_data.get_leaderboard("point-test"))
+        self.assertEqual(live_board, self.bot_data.get_leaderboard("point-test"))
+
+    def test_get_rank(self):
+        self.bot_data.add_score("player1", "cyber-hook", "00:58.000000")
+        self.bot_data.add_score("player2", "cyber-hook", "01:05.000000")
+        rank_change = self.bot_data.add_score("player2", "cyber-hook", "00:59.500000")
+
+        self.assertEqual((2, 2), (rank_change.previous.rank, rank_change.current.rank))
+        self.assertEqual("-00:05.500000", self.bot_data.format_score_delta("cyber-hook", "Default", rank_change.current.best - rank_change.previous.best))
+        self.assertEqual("+00:01.500000", self.bot_data.format_score_delta("cyber-hook", "Default", rank_change.current.best - rank_change.current.record))
+
+        #Ranks come from the same index the leaderboard is rebuilt into at startup
+        self.bot_data._load_leaderboard()
+        player_rank = self.bot_data.get_rank("player2", "cyber-hook")
+        self.assertEqual((2, "00:59.500000", "player1"), (player_rank.rank, self.bot_data.format_score("cyber-hook", "Default", player_rank.best), player_rank.record_holder))
+        self.assertIsNone(self.bot_data.get_rank("player3", "cyber-hook"))
+        self.assertIsNone(self.bot_data.get_rank("player1", "cyber-hook", "no-such-category"))
+
+    def test_get_profile(self):
+        self.bot_data.add_score("player1", "cyber-hook", "00:58.000000", guild_id=1)
+        self.bot_data.add_score("player2", "cyber-hook", "00:57.000000", guild_id=1)
+        self.bot_data.add_score("player1", "mk64", "01:30.000000", "Rainbow Road", guild_id=1)
+        self.bot_data.add_score("player1", "mk64", "01:10.000000", "Toad Turnpike", guild_id=2)
+
+        #Rebuilt from the personal bests at startup like the boards
+        self.bot_data._load_leaderboard()
+        profile = [(game, path, rank.rank, rank.board_size, self.bot_data.format_score(game, path, rank.best))
+                   for game, path, rank in self.bot_data.get_profile("player1", 1)]
+        self.assertEqual([("cyber-hook", "Default", 2, 2, "00:58.000000"), ("mk64", "3lap/Rainbow Road", 1, 1, "01:30.000000")], profile)
+        self.assertEqual([], self.bot_data.get_profile("player3", 1))
+
+    def test_compact_scores(self):
+        #cyber-hook keeps each player's best and their 2 most recent attempts, mk64 keeps everything
+        self.bot_data.reload_games_config([dict(self.games_config[0], retention=2)] + self.games_config[1:])
+        self.assertEqual({"cyber-hook": 2}, {game["name"]: game["retention"] for game in self.storage.load_games() if game["retention"] is not None})
+
+        times = ["01:05.000000", "00:58.000000", "01:02.000000", "01:03.000000", "01:01.000000", "01:04.000000"]
+        scores = [self.bot_data.prepare_score("player1", "cyber-hook", value) for value in times]
+        scores += [self.bot_data.prepare_score("player2", "cyber-hook", "01:00.000000")]
+        scores += [self.bot_data.prepare_score("player1", "mk64", value, "Toad Turnpike") for value in times]
+        for hour, score in enumerate(scores):
+            score.create_time = datetime(2023, 1, 1, hour)
+        self.bot_data.insert_scores(scores)
+
+        self.assertEqual({"cyber-hook": 3}, self.bot_data.compact_scores())
+        self.assertEqual({"cyber-hook": 0}, self.bot_data.compact_scores())
+        hot_scores = [score[:2] for score in self.bot_data.get_scores("cyber-hook")]
+        self.assertEqual([("player1", "00:58.000000"), ("player1", "01:01.000000"), ("player1", "01:04.000000"), ("player2", "01:00.000000")], hot_scores)
+        self.assertEqual(6, len(self.bot_data.get_scores("mk64", "Toad Turnpike")))
+
+        #History reads the archive too
+        self.assertEqual(list(reversed(times)), [value for value, _ in self.bot_data.get_player_history("player1", "cyber-hook")])
+        self.assertEqual(times[:-4:-1], [value for value, _ in self.bot_data.get_player_history("player1", "cyber-hook", count=3)])
+        self.assertEqual([], self.bot_data.get_player_history("player3", "cyber-hook"))
+
+        #Personal bests stay hot, so the leaderboard rebuilt at startup is unchanged
+        self.bot_data._load_leaderboard()
+        self.assertEqual([("player1", "00:58.000000"), ("player2", "01:00.000000")], [score[:2] for score in self.bot_data.get_leaderboard("cyber-hook")])
+
+    def test_response_cache(self):
+        key = self.bot_data.response_key("leaderboard", "mk64", "Toad Turnpike", 1)
+        self.assertEqual(("leaderboard", 1, "mk64", "3lap/Toad Turnpike", None), key)
+        self.assertIsNone(self.bot_data.response_key("leaderboard", "mk64", "no-such-category"))
+
+        self.bot_data.response_cache.put(key, self.bot_data.response_cache.get(key)[1], "rendered", 8)
+        self.bot_data.add_score("player1", "mk64", "00:58.100000", "Toad Turnpike", 2)
+        self.assertEqual("rendered", self.bot_data.response_cache.get(key)[0])
+        #A new score in the guild's category makes the response stale
+        self.bot_data.insert_scores([self.bot_data.prepare_score("player1", "mk64", "00:58.100000", "Toad Turnpike", 1)])
+        self.assertIsNone(self.bot_data.response_cache.get(key)[0])
+
+    def test_get_scores_page(self):
+        game = self.bot_data.add_game("route-test", [Category(score_type="Point")])
+        for points in [5, 3, 9, 1, 7]:
+            self.bot_data.add_score(f"player{points}", "route-test", str(points))
+
+        #Point scores page highest first
+        scores, prev_cursor, next_cursor = self.bot_data.get_scores_page("route-test", page_size=2)
+        self.assertEqual([9, 7], [score[1] for score in scores])
+        self.assertIsNone(prev_cursor)
+
+        scores, prev_cursor, next_cursor = self.bot_data.get_scores_page("route-test", page_size=2, after=next_cursor)
+        self.assertEqual([5, 3], [score[1] for score in scores])
+
+        last_page = self.bot_data.get_scores_page("route-test", page_size=2, after=next_cursor)
+        self.assertEqual([1], [score[1] for score in last_page[0]])
+        self.assertIsNone(last_page[2])
+
+        scores, prev_cursor, next_cursor = self.bot_data.get_scores_page("route-test", page_size=2, before=prev_cursor)
+        self.assertEqual([9, 7], [score[1] for score in scores])
+        self.assertIsNone(prev_cursor)
+
+        #Newest first
+        scores, _, _ = self.bot_data.get_scores_page("route-test", page_size=2, order_by="create_time")
+        self.assertEqual([7, 1], [score[1] for score in scores])
+
+        #Point boards rebuilt from the DB rank highest first
+        self.bot_data._load_leaderboard()
+        self.assertEqual([9, 7], [score[1] for score in self.bot_data.get_leaderboard("route-test", count=2)])
+
+    def test_bind_guild_channels(self):
+        channels = [ChannelRef(1, 10, "mk-test"), ChannelRef(1, 11, "off-topic")]
+        self.assertEqual(1, self.bot_data.bind_guild_channels(1, channels))
+        self.assertEqual(0, self.bot_data.bind_guild_channels(1, channels))
+
+        #Bound channels keep their games when renamed, same named channels in other guilds go by the config
+        self.assertEqual(["mk64"], self.bot_data.get_games_in_channel(ChannelRef(1, 10, "renamed")))
+        self.assertEqual(["mk64"], self.bot_data.get_games_in_channel(ChannelRef(2, 10, "mk-test")))
+        self.assertEqual([], self.bot_data.get_games_in_channel(ChannelRef(2, 10, "renamed")))
+        self.assertEqual([ChannelRef(1, 10, "mk-test")], self.bot_data.get_active_channels(1))
+
+        self.bot_data._load_routes()
+        self.assertEqual(["mk64"], self.bot_data.get_games_in_channel(ChannelRef(1, 10, "renamed")))
+        self.assertEqual(["mk64"], self._stored_channels()[(1, 10)])
+
+    def test_config_guild_channel(self):
+        guild_config = [dict(game) for game in self.games_config]
+        guild_config[0]["channel"] = guild_config[0]["channel"] + [{"guild_id": 5, "channel_id": 50}]
+
+        self.assertEqual({"db_ops": 3, "game_writes": 0, "channel_writes": 1}, self.bot_data._init_games_config(guild_config))
+        self.assertEqual({"db_ops": 2, "game_writes": 0, "channel_writes": 0}, self.bot_data._init_games_config(guild_config))
+        self.assertEqual([guild_config[0]["name"]], self.bot_data.get_games_in_channel(ChannelRef(5, 50, "any-name")))
+
+    def test_guild_scores(self):
+        self.bot_data.add_score("player1", "cyber-hook", "01:00.000000", guild_id=1)
+        self.bot_data.add_score("player2", "cyber-hook", "00:50.000000", guild_id=2)
+        self.bot_data.add_score("player3", "cyber-hook", "00:40.000000")
+
+        self.assertEqual(["player1"], [score[0] for score in self.bot_data.get_leaderboard("cyber-hook", guild_id=1)])
+        self.assertEqual(["player2"], [score[0] for score in self.bot_data.get_scores("cyber-hook", guild_id=2)])
+        self.assertEqual(["player2"], [score[0] for score in self.bot_data.get_scores_page("cyber-hook", guild_id=2)[0]])
+
+        #Scores from before guilds were tracked can be moved into one
+        self.assertEqual(1, self.bot_data.migrate_guild_scores(1))
+        self.bot_data._load_leaderboard()
+        self.assertEqual(["player3", "player1"], [score[0] for score in self.bot_data.get_leaderboard("cyber-hook", guild_id=1)])
+        self.assertEqual([], self.bot_data.get_leaderboard("cyber-hook"))
+
+    def test_rejoin_guild(self):
+        self.bot_data.add_score("player1", "cyber-hook", "00:50.000000", guild_id=1)
+        self.bot_data.add_score("player2", "cyber-hook", "00:40.000000", guild_id=1)
+        self.bot_data.add_score("player1", "cyber-hook", "00:45.000000", guild_id=2)
+
+        #Leaving a guild drops its boards, joining it again restores them from its stored scores
+        self.bot_data.drop_guild(1)
+        self.assertEqual([], self.bot_data.get_leaderboard("cyber-hook", guild_id=1))
+        self.assertEqual(2, self.bot_data.load_guild(1))
+
+        rank_change = self.bot_data.add_score("player3", "cyber-hook", "00:55.000000", guild_id=1)
+        self.assertEqual((3, 3), (rank_change.current.rank, rank_change.current.board_size))
+        self.assertEqual(["player2", "player1", "player3"], [score[0] for score in self.bot_data.get_leaderboard("cyber-hook", guild_id=1)])
+        self.assertEqual(["player1"], [score[0] for score in self.bot_data.get_leaderboard("cyber-hook", guild_id=2)])
+
+    def test_sharded_leaderboard(self):
+        shard0_guild, shard1_guild = 41771983423143937, 41771983427338241
+        self.bot_data.add_score("player1", "cyber-hook", "01:00.000000", guild_id=shard0_guild)
+        self.bot_data.add_score("player2", "cyber-hook", "01:00.000000", guild_id=shard1_guild)
+
+        #A process running shard 0 of 2 only keeps shard 0's guilds in memory
+        self.bot_data.shard_ids, self.bot_data.shard_count = {0}, 2
+        try:
+            self.bot_data._load_leaderboard()
+            self.assertEqual(["player1"], [score[0] for score in self.bot_data.get_leaderboard("cyber-hook", guild_id=shard0_guild)])
+            self.assertEqual([], self.bot_data.get_leaderboard("cyber-hook", guild_id=shard1_guild))
+        finally:
+            self.bot_data.shard_ids, self.bot_data.shard_count = None, 1
+
+class MongoBotDataIntegrationTest(BotDataIntegrationTest, unittest.TestCase):
+    @classmethod
+    def _storage_url(self):
+        return self._load_test_config("test-config.yml")["base_config"]["mongo_url"]
+
+    def setUp(self):
+        super().setUp()
+        self.db = self.storage.db
+
+    def test_client_options(self):
+        options = {"max_pool_size": 10, "min_pool_size": 2, "read_preference": "secondaryPreferred", "max_staleness_seconds": 120}
+        storage = MongoStorage(self._storage_url(), self.TEST_DB_NAME, options)
+        self.assertTrue(storage.reads_may_lag)
+        storage.warm_up()
+
+        #A single node serves secondaryPreferred reads itself, writes go through the primary handle
+        storage.insert_scores([self.bot_data.prepare_score("player1", "cyber-hook", "01:02.500000")])
+        self.assertEqual(["player1"], [score.player_id for score in storage.find_scores("cyber-hook", "Default")])
+
+        for invalid_options in ({"read_preference": "secondary", "max_staleness_seconds": 30}, {"read_preference": "fastest"}, {"pool_size": 10}):
+            with self.assertRaises(ValueError):
+                MongoStorage(self._storage_url(), self.TEST_DB_NAME, invalid_options)
+
+    def test_init_config_collections(self):
+        #Check for expected collections
+        db_collections = self.db.list_collection_names()
+        assert_collections = ['games', 'channels']
+        for collection in assert_collections:
+            self.assertIn(collection, db_collections)
+
+        #Links resolve to the same games whether they are fetched or not
+        db_channels = Channel.find_many()
+        db_channels_fetch_links = Channel.find_many(fetch_links = True)
+        no_fetch_chan_lengths = [len(chan.games) for chan in db_channels]
+        fetch_chan_lengths = [len(chan.games) for chan in db_channels_fetch_links]
+        self.assertEqual(no_fetch_chan_lengths, fetch_chan_lengths)
+
+    def test_scores_collection(self):
+        self.bot_data.add_score("player2", "mk64", "00:58.100000", "Toad Turnpike")
+
+        db_score = self.db.scores.find_one({"player_id": "player2"})
+        self.assertEqual((TimeScore._class_id, "3lap/Toad Turnpike", 58100000), (db_score["_class_id"], db_score["category"], db_score["value"]))
+        self.assertNotIn("scores", self.db.games.find_one({"name": "mk64"})["categories"][0])
+
+    def test_migrate_embedded_scores(self):
+        embedded_score = {"player_id": "player1", "value": 1500, "create_time": datetime(2023, 1, 1)}
+        self.db.games.insert_one({
+            "name": "legacy",
+            "is_enabled": True,
+            "categories": [{"name": "Default", "label": "Category", "is_enabled": True, "score_type": "Point",
+                            "score_fmt": None, "scores": [embedded_score], "categories": None}]
+        })
+
+        self.assertEqual(1, self.bot_data.migrate_embedded_scores())
+        self.assertEqual(0, self.bot_data.migrate_embedded_scores())
+
+        db_score = self.db.scores.find_one({"game": "legacy"})
+        self.assertEqual(("Default", "player1", 1500), (db_score["category"], db_score["player_id"], db_score["value"]))
+        self.assertNotIn("scores", self.db.games.find_one({"name": "legacy"})["categories"][0])
+
+    def test_sync_keeps_embedded_scores(self):
+        embedded_score = {"player_id": "player1", "value": 62500000, "create_time": datetime(2023, 1, 1)}
+        self.db.games.update_one({"name": "cyber-hook"}, {"$set": {"categories": [
+            {"name": "Default", "label": "Category", "is_enabled": True, "score_type": "Time",
+             "score_fmt": "%M:%S", "scores": [embedded_score], "categories": None}]}})
+
+        #The config's categories differ, the sync on start rewrites them only after the scores are moved out
+        bot_data = BotData(self._storage_url(), self.TEST_DB_NAME, self.games_config)
+        self.assertEqual([("player1", "01:02.500000")], [score[:2] for score in bot_data.get_scores("cyber-hook")])
+        self.assertNotIn("scores", self.db.games.find_one({"name": "cyber-hook"})["categories"][0])
+
+    def test_migrate_time_scores(self):
+        self.db.scores.insert_one({"_class_id": TimeScore._class_id, "game": "cyber-hook", "category": "Default", "player_id": "player1",
+                                   "value": datetime(1900, 1, 1, 0, 1, 2, 500000), "create_time": datetime(2023, 1, 1)})
+
+        self.assertEqual(1, self.bot_data.migrate_time_scores())
+        self.assertEqual(0, self.bot_data.migrate_time_scores())
+        self.assertEqual(62500000, self.db.scores.find_one({"player_id": "player1"})["value"])
+        self.assertEqual([("player1", "01:02.500000")], [score[:2] for score in self.bot_data.get_scores("cyber-hook")])
+
+class SqliteBotDataIntegrationTest(BotDataIntegrationTest, unittest.TestCase):
+    @classmethod
+    def _storage_url(self):
+        return "sqlite:///:memory:"
+
+    def test_migrations_noop(self):
+        #Nothing to migrate, SQLite was never written by the versions that embedded scores
+        self.assertEqual(0, self.bot_data.migrate_embedded_scores())
+        self.assertEqual(0, self.bot_data.migrate_time_scores())
+
+class SlowBotData():
+    '''
+    Stands in for BotData with a DB call that blocks for QUERY_TIME seconds.
+    '''
+    QUERY_TIME = 0.5
+
+    def get_scores(self, game_name, category_name='Default', guild_id=None):
+        time.sleep(self.QUERY_TIME)
+        return [(game_name, category_name)]
+
+class AsyncBotDataTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.async_data = AsyncBotData(SlowBotData(), max_workers=2)
+
+    def tearDown(self):
+        self.async_data.shutdown()
+
+    async def test_event_loop_responsive(self):
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker_task = asyncio.create_task(ticker())
+        scores = await self.async_data.get_scores("mk64")
+        ticker_task.cancel()
+
+        self.assertEqual([("mk64", "Default")], scores)
+        #A blocked loop would not get to tick at all while the query runs
+        self.assertGreater(ticks, 10)
+
+    async def test_concurrent_commands(self):
+        start = time.monotonic()
+        results = await asyncio.gather(
+            self.async_data.get_scores("mk64"),
+            self.async_data.get_scores("cyber-hook")
+        )
+        elapsed = time.monotonic() - start
+
+        self.assertEqual([[("mk64", "Default")], [("cyber-hook", "Default")]], results)
+        self.assertLess(elapsed, SlowBotData.QUERY_TIME * 2)
+
 if __name__ == '__main__':
     unittest.main()
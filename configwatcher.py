@@ -0,0 +1,61 @@
+import os
+import asyncio
+import hashlib
+import logging
+from typing import Awaitable, Callable, Optional
+
+log = logging.getLogger(__name__)
+
+class ConfigWatcher():
+    '''
+    Polls a config file and calls on_change when its content changes.
+    Polling the file's mtime and size is a stat call per interval, the content is only hashed when they move,
+    so saving the file without changing it does not trigger a reload.
+    A failing on_change is logged and the watcher keeps going, the next change is picked up as usual.
+    '''
+    def __init__(self, path: str, on_change: Callable[[], Awaitable], interval: float = 5.0):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.stat = self._stat()
+        self.digest = self._digest()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def _digest(self) -> Optional[str]:
+        try:
+            with open(self.path, 'rb') as config_file:
+                return hashlib.sha256(config_file.read()).hexdigest()
+        except OSError:
+            return None
+
+    async def check(self):
+        '''
+        Calls on_change if the file changed since the last check. Returns whether it did.
+        '''
+        stat = self._stat()
+        if stat == self.stat:
+            return False
+        self.stat = stat
+
+        digest = self._digest()
+        if digest is None or digest == self.digest:
+            return False
+        self.digest = digest
+
+        log.info("%s changed, reloading", self.path)
+        try:
+            await self.on_change()
+        except Exception as e:
+            log.error("Reloading %s failed: %s", self.path, e)
+        return True
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from configwatcher import ConfigWatcher
+
+class ConfigWatcherTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.work_dir.name, "games-config.yml")
+        self.write("games: []\n")
+        self.reloads = 0
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def write(self, content: str, mtime_ns: int = None):
+        with open(self.path, 'w') as config_file:
+            config_file.write(content)
+        if mtime_ns is not None:
+            os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+    async def on_change(self):
+        self.reloads += 1
+
+    async def test_check(self):
+        watcher = ConfigWatcher(self.path, self.on_change)
+        self.assertFalse(await watcher.check())
+
+        #Saving the same content is not a change
+        self.write("games: []\n", 1_000_000_000)
+        self.assertFalse(await watcher.check())
+
+        self.write("games:\n  - name: mk64\n", 2_000_000_000)
+        self.assertTrue(await watcher.check())
+        self.assertFalse(await watcher.check())
+        self.assertEqual(1, self.reloads)
+
+    async def test_missing_file(self):
+        watcher = ConfigWatcher(self.path, self.on_change)
+        os.remove(self.path)
+        self.assertFalse(await watcher.check())
+
+        self.write("games:\n  - name: mk64\n")
+        self.assertTrue(await watcher.check())
+
+    async def test_failed_reload(self):
+        async def fail():
+            raise ValueError("Invalid config")
+
+        watcher = ConfigWatcher(self.path, fail)
+        self.write("games: {}\n", 1_000_000_000)
+        self.assertTrue(await watcher.check())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+from bisect import bisect_left, insort
+from threading import Lock
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+class BoardRank(NamedTuple):
+    '''
+    A player's standing on a board. Values are raw, in the board's score units.
+    '''
+    rank: int               # 1 is the record
+    best: int
+    create_time: object
+    record: int
+    record_holder: str
+    board_size: int
+
+class RankChange(NamedTuple):
+    '''
+    What a submission did to the submitter's standing. previous is None on a first score,
+    and equals current when the submission did not beat the personal best.
+    '''
+    value: int
+    previous: Optional[BoardRank]
+    current: BoardRank
+
+    @property
+    def is_personal_best(self):
+        return self.previous is None or self.current.best != self.previous.best
+
+class Board():
+    '''
+    Personal bests for a single (game, category path), kept sorted best first.
+    Time scores rank lowest first, Point scores rank highest first.
+    '''
+    def __init__(self, score_type: str):
+        self.score_type = score_type
+        self.bests = {}     # player_id -> (value, create_time)
+        self.ranked = []    # sorted (sort_key, create_time, player_id), best first
+
+    def _sort_key(self, value):
+        return -value if self.score_type == "Point" else value
+
+    def _entry(self, player_id: str):
+        value, create_time = self.bests[player_id]
+        return (self._sort_key(value), create_time, player_id)
+
+    def update(self, player_id: str, value, create_time):
+        '''
+        Records a submission. Returns the player's previous best value when the submission replaces it,
+        None when it is their first score, and False when it does not beat their current best.
+        '''
+        previous = None
+        if player_id in self.bests:
+            previous = self.bests[player_id][0]
+            if self._sort_key(value) >= self._sort_key(previous):
+                return False
+            del self.ranked[bisect_left(self.ranked, self._entry(player_id))]
+
+        self.bests[player_id] = (value, create_time)
+        insort(self.ranked, self._entry(player_id))
+        return previous
+
+    def get_best(self, player_id: str):
+        return self.bests.get(player_id)
+
+    def get_rank(self, player_id: str) -> Optional[BoardRank]:
+        '''
+        The player's standing, found with a bisect of the sorted personal bests, so O(log n) in the board size.
+        '''
+        if player_id not in self.bests:
+            return None
+        value, create_time = self.bests[player_id]
+        _, _, record_holder = self.ranked[0]
+        return BoardRank(bisect_left(self.ranked, self._entry(player_id)) + 1, value, create_time,
+                         self.bests[record_holder][0], record_holder, len(self.ranked))
+
+    def submit(self, player_id: str, value, create_time) -> RankChange:
+        '''
+        Records a submission like update and returns the player's standing before and after it.
+        '''
+        previous = self.get_rank(player_id)
+        self.update(player_id, value, create_time)
+        return RankChange(value, previous, self.get_rank(player_id))
+
+    def top(self, count: int = 10):
+        '''
+        Returns up to count (player_id, value, create_time) tuples, best first.
+        '''
+        return [(player_id, self.bests[player_id][0], create_time) for _, create_time, player_id in self.ranked[:count]]
+
+    def __len__(self):
+        return len(self.ranked)
+
+class Leaderboard():
+    '''
+    Personal best index for every (game, category path), updated on each new score
+    so leaderboard views never have to scan score history.
+    Boards are partitioned per guild, scores from before guilds were tracked live under guild_id None.
+    Each guild also indexes the boards every player has a score on, so a player's profile only touches their own boards.
+    '''
+    def __init__(self):
+        self.guilds: Dict[Optional[int], Dict[Tuple[str, str], Board]] = {}
+        self.players: Dict[Optional[int], Dict[str, Dict[Tuple[str, str], Board]]] = {}  # guild_id -> player_id -> boards
+        self.lock = Lock()
+
+    def get_board(self, game_name: str, category_path: str, guild_id: Optional[int] = None):
+        return self.guilds.get(guild_id, {}).get((game_name, category_path))
+
+    def add_score(self, game_name: str, category_path: str, score_type: str, player_id: str, value, create_time, guild_id: Optional[int] = None):
+        '''
+        Records a submission and returns its RankChange.
+        '''
+        with self.lock:
+            board = self.guilds.setdefault(guild_id, {}).setdefault((game_name, category_path), Board(score_type))
+            self.players.setdefault(guild_id, {}).setdefault(player_id, {})[(game_name, category_path)] = board
+            return board.submit(player_id, value, create_time)
+
+    def get_rank(self, game_name: str, category_path: str, player_id: str, guild_id: Optional[int] = None):
+        with self.lock:
+            board = self.get_board(game_name, category_path, guild_id)
+            return board.get_rank(player_id) if board else None
+
+    def profile(self, player_id: str, guild_id: Optional[int] = None) -> List[Tuple[str, str, BoardRank]]:
+        '''
+        Returns a (game_name, category_path, BoardRank) tuple for every board the player has a score on, sorted by game and category.
+        O(k log n) for k boards of the player, however many games there are.
+        '''
+        with self.lock:
+            boards = self.players.get(guild_id, {}).get(player_id, {})
+            return [(game_name, category_path, boards[(game_name, category_path)].get_rank(player_id))
+                    for game_name, category_path in sorted(boards)]
+
+    def top(self, game_name: str, category_path: str, count: int = 10, guild_id: Optional[int] = None):
+        with self.lock:
+            board = self.get_board(game_name, category_path, guild_id)
+            return board.top(count) if board else []
+
+    def drop_guild(self, guild_id: int):
+        with self.lock:
+            self.guilds.pop(guild_id, None)
+            self.players.pop(guild_id, None)
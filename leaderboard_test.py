@@ -0,0 +1,114 @@
+import unittest
+from datetime import datetime
+from leaderboard import Board, BoardRank, Leaderboard
+
+class BoardTest(unittest.TestCase):
+    def test_time_lower_is_better(self):
+        board = Board("Time")
+        board.update("player1", 65.0, datetime(2023, 1, 1))
+        board.update("player2", 61.5, datetime(2023, 1, 2))
+        board.update("player3", 70.2, datetime(2023, 1, 3))
+
+        self.assertEqual(["player2", "player1", "player3"], [score[0] for score in board.top()])
+
+    def test_point_higher_is_better(self):
+        board = Board("Point")
+        board.update("player1", 1500, datetime(2023, 1, 1))
+        board.update("player2", 2200, datetime(2023, 1, 2))
+
+        self.assertEqual([("player2", 2200), ("player1", 1500)], [score[:2] for score in board.top()])
+
+    def test_update_keeps_personal_best(self):
+        board = Board("Time")
+        self.assertIsNone(board.update("player1", 65.0, datetime(2023, 1, 1)))
+        self.assertFalse(board.update("player1", 66.0, datetime(2023, 1, 2)))
+        self.assertEqual(65.0, board.update("player1", 60.0, datetime(2023, 1, 3)))
+
+        self.assertEqual(1, len(board))
+        self.assertEqual((60.0, datetime(2023, 1, 3)), board.get_best("player1"))
+
+    def test_ties_rank_earliest_first(self):
+        board = Board("Point")
+        board.update("player1", 100, datetime(2023, 1, 2))
+        board.update("player2", 100, datetime(2023, 1, 1))
+
+        self.assertEqual(["player2", "player1"], [score[0] for score in board.top()])
+
+    def test_top_count(self):
+        board = Board("Point")
+        for points in range(50):
+            board.update(f"player{points}", points, datetime(2023, 1, 1))
+
+        self.assertEqual([49, 48, 47], [score[1] for score in board.top(3)])
+
+    def test_get_rank(self):
+        board = Board("Time")
+        for index, time in enumerate([70.0, 60.0, 65.0, 80.0]):
+            board.update(f"player{index}", time, datetime(2023, 1, 1))
+
+        self.assertEqual(BoardRank(3, 70.0, datetime(2023, 1, 1), 60.0, "player1", 4), board.get_rank("player0"))
+        self.assertEqual(1, board.get_rank("player1").rank)
+        self.assertIsNone(board.get_rank("player9"))
+
+    def test_submit(self):
+        board = Board("Time")
+        for index, time in enumerate([60.0, 65.0, 70.0]):
+            board.update(f"player{index}", time, datetime(2023, 1, 1))
+
+        change = board.submit("player3", 75.0, datetime(2023, 1, 2))
+        self.assertIsNone(change.previous)
+        self.assertEqual(4, change.current.rank)
+        self.assertTrue(change.is_personal_best)
+
+        change = board.submit("player3", 62.0, datetime(2023, 1, 3))
+        self.assertEqual((4, 2), (change.previous.rank, change.current.rank))
+        self.assertEqual((75.0, 62.0), (change.previous.best, change.current.best))
+        self.assertTrue(change.is_personal_best)
+
+        change = board.submit("player3", 63.0, datetime(2023, 1, 4))
+        self.assertFalse(change.is_personal_best)
+        self.assertEqual(change.previous, change.current)
+
+        change = board.submit("player3", 55.0, datetime(2023, 1, 5))
+        self.assertEqual((1, 55.0, "player3"), (change.current.rank, change.current.record, change.current.record_holder))
+
+class LeaderboardTest(unittest.TestCase):
+    def test_boards_per_category(self):
+        leaderboard = Leaderboard()
+        leaderboard.add_score("mk64", "3lap/Rainbow Road", "Time", "player1", 300.0, datetime(2023, 1, 1))
+        leaderboard.add_score("mk64", "3lap/Toad Turnpike", "Time", "player2", 120.0, datetime(2023, 1, 1))
+
+        self.assertEqual(["player1"], [score[0] for score in leaderboard.top("mk64", "3lap/Rainbow Road")])
+        self.assertEqual([], leaderboard.top("mk64", "3lap/Wario Stadium"))
+        self.assertEqual(1, leaderboard.get_rank("mk64", "3lap/Rainbow Road", "player1").rank)
+        self.assertIsNone(leaderboard.get_rank("mk64", "3lap/Wario Stadium", "player1"))
+
+    def test_boards_per_guild(self):
+        leaderboard = Leaderboard()
+        leaderboard.add_score("mk64", "3lap/Rainbow Road", "Time", "player1", 300.0, datetime(2023, 1, 1), guild_id=1)
+        leaderboard.add_score("mk64", "3lap/Rainbow Road", "Time", "player2", 200.0, datetime(2023, 1, 1), guild_id=2)
+
+        self.assertEqual(["player1"], [score[0] for score in leaderboard.top("mk64", "3lap/Rainbow Road", guild_id=1)])
+        self.assertEqual([], leaderboard.top("mk64", "3lap/Rainbow Road"))
+
+        leaderboard.drop_guild(2)
+        self.assertEqual([], leaderboard.top("mk64", "3lap/Rainbow Road", guild_id=2))
+        self.assertEqual(1, len(leaderboard.get_board("mk64", "3lap/Rainbow Road", 1)))
+        self.assertEqual([], leaderboard.profile("player2", guild_id=2))
+
+    def test_profile(self):
+        leaderboard = Leaderboard()
+        leaderboard.add_score("tetris", "Marathon", "Point", "player1", 5000, datetime(2023, 1, 1))
+        leaderboard.add_score("tetris", "Marathon", "Point", "player2", 9000, datetime(2023, 1, 1))
+        leaderboard.add_score("mk64", "3lap/Toad Turnpike", "Time", "player1", 120.0, datetime(2023, 1, 1))
+        leaderboard.add_score("mk64", "3lap/Rainbow Road", "Time", "player2", 300.0, datetime(2023, 1, 1))
+        leaderboard.add_score("mk64", "3lap/Toad Turnpike", "Time", "player1", 110.0, datetime(2023, 1, 2))
+
+        #Only the player's own boards, sorted by game and category
+        profile = leaderboard.profile("player1")
+        self.assertEqual([("mk64", "3lap/Toad Turnpike", 1, 110.0), ("tetris", "Marathon", 2, 5000)],
+                         [(game, path, rank.rank, rank.best) for game, path, rank in profile])
+        self.assertEqual([], leaderboard.profile("player1", guild_id=1))
+
+if __name__ == '__main__':
+    unittest.main()
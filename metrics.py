@@ -0,0 +1,240 @@
+import asyncio
+import bisect
+import math
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Callable, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+#Latency buckets in seconds, the Prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+class Histogram():
+    '''
+    Cumulative bucket counts for the Prometheus endpoint, plus a window of recent samples for the percentiles !stats shows.
+    '''
+    def __init__(self, buckets = DEFAULT_BUCKETS, window: int = 1000):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)    # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def percentile(self, percent: float):
+        if not self.recent:
+            return 0.0
+        #Nearest rank
+        samples = sorted(self.recent)
+        return samples[max(0, math.ceil(len(samples) * percent / 100) - 1)]
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+class CommandRun():
+    '''
+    State of one command invocation, visible to everything it calls through the current_run context variable.
+    '''
+    def __init__(self, name: str):
+        self.name = name
+        self.db_ops = 0
+        self.failed = False
+        self.start = time.perf_counter()
+
+class CommandStats():
+    def __init__(self):
+        self.latency = Histogram()
+        self.db_ops = Histogram(buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100))
+        self.errors = 0
+
+current_run: ContextVar[Optional[CommandRun]] = ContextVar("current_run", default=None)
+
+class Metrics():
+    '''
+    In-process instrumentation: per-command latency and DB operation counts, DB operations by type,
+    cache hit rates and event loop lag.
+    DB operations are recorded from executor threads, so every update holds the lock.
+    '''
+    def __init__(self):
+        self.lock = Lock()
+        self.start_time = time.time()
+        self.commands: Dict[str, CommandStats] = {}
+        self.db_ops: Dict[str, int] = {}
+        self.cache_hits: Dict[str, int] = {}
+        self.cache_misses: Dict[str, int] = {}
+        self.cache_providers: Dict[str, Callable] = {}
+        self.loop_lag = Histogram(buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+    @contextmanager
+    def command(self, name: str):
+        '''
+        Times a command and counts the DB operations made while it runs, including ones made on executor threads.
+        '''
+        run = CommandRun(name)
+        token = current_run.set(run)
+        try:
+            yield run
+        except Exception:
+            run.failed = True
+            raise
+        finally:
+            current_run.reset(token)
+            self.finish_command(run)
+
+    def start_command(self, name: str):
+        '''
+        Starts timing a command that can not be wrapped in command(), because it finishes in a different callback than it starts in.
+        The run stays current for the rest of the calling task, pass it to finish_command once the command is done.
+        '''
+        run = CommandRun(name)
+        current_run.set(run)
+        return run
+
+    def finish_command(self, run: CommandRun):
+        elapsed = time.perf_counter() - run.start
+        with self.lock:
+            stats = self.commands.setdefault(run.name, CommandStats())
+            stats.latency.observe(elapsed)
+            stats.db_ops.observe(run.db_ops)
+            stats.errors += run.failed
+        log.debug("Command %s took %.3fms with %d DB ops", run.name, elapsed * 1000, run.db_ops)
+
+    def db_op(self, op_name: str):
+        run = current_run.get()
+        with self.lock:
+            self.db_ops[op_name] = self.db_ops.get(op_name, 0) + 1
+            if run:
+                run.db_ops += 1
+
+    def cache_hit(self, cache_name: str):
+        with self.lock:
+            self.cache_hits[cache_name] = self.cache_hits.get(cache_name, 0) + 1
+
+    def cache_miss(self, cache_name: str):
+        with self.lock:
+            self.cache_misses[cache_name] = self.cache_misses.get(cache_name, 0) + 1
+
+    def register_cache(self, cache_name: str, cache_info: Callable):
+        '''
+        Registers a cache that keeps its own counts, cache_info returns an object with hits and misses like functools.lru_cache's.
+        '''
+        self.cache_providers[cache_name] = cache_info
+
+    def cache_stats(self):
+        '''
+        Returns a {cache name: (hits, misses)} dict.
+        '''
+        with self.lock:
+            stats = {name: (hits, self.cache_misses.get(name, 0)) for name, hits in self.cache_hits.items()}
+            for name, misses in self.cache_misses.items():
+                stats.setdefault(name, (0, misses))
+        for name, cache_info in self.cache_providers.items():
+            info = cache_info()
+            stats[name] = (info.hits, info.misses)
+        return stats
+
+    def observe_loop_lag(self, lag: float):
+        with self.lock:
+            self.loop_lag.observe(lag)
+
+    async def monitor_loop_lag(self, interval: float = 0.5):
+        '''
+        Sleeps for interval and records how late the loop woke up. Anything blocking the loop shows up as lag.
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            self.observe_loop_lag(max(0.0, loop.time() - expected))
+
+    def summary(self):
+        '''
+        Plain text summary for the !stats command.
+        '''
+        lines = [f"Uptime: {time.time() - self.start_time:.0f}s", "Commands:"]
+        with self.lock:
+            for name, stats in sorted(self.commands.items()):
+                latency = stats.latency
+                lines.append(f"  {name}: {latency.count} runs, p50 {latency.percentile(50) * 1000:.1f}ms, "
+                             f"p95 {latency.percentile(95) * 1000:.1f}ms, max {latency.max * 1000:.1f}ms, "
+                             f"{stats.db_ops.mean():.1f} DB ops/run, {stats.errors} errors")
+            lines.append("DB ops: " + (", ".join(f"{name}={count}" for name, count in sorted(self.db_ops.items())) or "none"))
+            lag = self.loop_lag
+            lines.append(f"Event loop lag: p50 {lag.percentile(50) * 1000:.1f}ms, p95 {lag.percentile(95) * 1000:.1f}ms, max {lag.max * 1000:.1f}ms")
+
+        lines.append("Caches:")
+        for name, (hits, misses) in sorted(self.cache_stats().items()):
+            total = hits + misses
+            lines.append(f"  {name}: {hits}/{total} hits ({hits / total * 100 if total else 0:.1f}%)")
+        return "\n".join(lines)
+
+    def _render_histogram(self, lines, metric: str, histogram: Histogram, labels: str = ""):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+        label_set = f"{{{labels}}}" if labels else ""
+        lines.append(f"{metric}_sum{label_set} {histogram.sum}")
+        lines.append(f"{metric}_count{label_set} {histogram.count}")
+
+    def render_prometheus(self):
+        '''
+        Renders every metric in the Prometheus text exposition format.
+        '''
+        lines = ["# TYPE pb_bot_command_latency_seconds histogram"]
+        with self.lock:
+            for name, stats in sorted(self.commands.items()):
+                self._render_histogram(lines, "pb_bot_command_latency_seconds", stats.latency, f'command="{name}"')
+            lines.append("# TYPE pb_bot_command_db_ops histogram")
+            for name, stats in sorted(self.commands.items()):
+                self._render_histogram(lines, "pb_bot_command_db_ops", stats.db_ops, f'command="{name}"')
+            lines.append("# TYPE pb_bot_command_errors_total counter")
+            for name, stats in sorted(self.commands.items()):
+                lines.append(f'pb_bot_command_errors_total{{command="{name}"}} {stats.errors}')
+            lines.append("# TYPE pb_bot_db_ops_total counter")
+            for name, count in sorted(self.db_ops.items()):
+                lines.append(f'pb_bot_db_ops_total{{op="{name}"}} {count}')
+            lines.append("# TYPE pb_bot_event_loop_lag_seconds histogram")
+            self._render_histogram(lines, "pb_bot_event_loop_lag_seconds", self.loop_lag)
+
+        lines.append("# TYPE pb_bot_cache_hits_total counter")
+        cache_stats = sorted(self.cache_stats().items())
+        for name, (hits, _) in cache_stats:
+            lines.append(f'pb_bot_cache_hits_total{{cache="{name}"}} {hits}')
+        lines.append("# TYPE pb_bot_cache_misses_total counter")
+        for name, (_, misses) in cache_stats:
+            lines.append(f'pb_bot_cache_misses_total{{cache="{name}"}} {misses}')
+        return "\n".join(lines) + "\n"
+
+    async def start_http_server(self, host: str = "0.0.0.0", port: int = 9100):
+        '''
+        Serves render_prometheus() on /metrics. Uses aiohttp, which discord.py already depends on.
+        '''
+        from aiohttp import web
+
+        async def handle_metrics(request):
+            return web.Response(text=self.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        log.info("Serving metrics on http://%s:%d/metrics", host, port)
+        return runner
+
+#Shared by BotData, the storage backends and bot.py
+metrics = Metrics()
@@ -0,0 +1,116 @@
+import asyncio
+import unittest
+from functools import lru_cache
+from metrics import Metrics, Histogram, current_run
+from storage import MeteredStorage, SqliteStorage
+from botdata import AsyncBotData
+
+class HistogramTest(unittest.TestCase):
+    def test_observe(self):
+        histogram = Histogram(buckets=(0.1, 1.0))
+        for value in [0.05, 0.1, 0.5, 2.0]:
+            histogram.observe(value)
+
+        #Buckets are upper bounds, the last slot is +Inf
+        self.assertEqual([2, 1, 1], histogram.counts)
+        self.assertEqual(4, histogram.count)
+        self.assertAlmostEqual(0.6625, histogram.mean())
+        self.assertEqual(2.0, histogram.max)
+        self.assertEqual(0.1, histogram.percentile(50))
+        self.assertEqual(2.0, histogram.percentile(95))
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_command(self):
+        with self.metrics.command("add_score"):
+            self.metrics.db_op("insert_scores")
+            self.metrics.db_op("find_scores")
+        self.metrics.db_op("load_games")
+
+        stats = self.metrics.commands["add_score"]
+        self.assertEqual(1, stats.latency.count)
+        self.assertEqual(2, stats.db_ops.sum)
+        self.assertEqual(0, stats.errors)
+        self.assertEqual({"insert_scores": 1, "find_scores": 1, "load_games": 1}, self.metrics.db_ops)
+        self.assertIsNone(current_run.get())
+
+    def test_command_error(self):
+        with self.assertRaises(ValueError):
+            with self.metrics.command("add_score"):
+                raise ValueError()
+
+        with self.metrics.command("add_score") as run:
+            run.failed = True
+
+        self.assertEqual(2, self.metrics.commands["add_score"].errors)
+
+    def test_start_command(self):
+        async def slash_command():
+            run = self.metrics.start_command("rank")
+            self.metrics.db_op("find_scores")
+            return run
+
+        #Started in the command's task, finished from an error handler after it
+        run = asyncio.run(slash_command())
+        run.failed = True
+        self.metrics.finish_command(run)
+
+        stats = self.metrics.commands["rank"]
+        self.assertEqual((1, 1, 1), (stats.latency.count, stats.db_ops.sum, stats.errors))
+        self.assertIsNone(current_run.get())
+
+    def test_cache_stats(self):
+        @lru_cache
+        def square(value):
+            return value * value
+
+        square(2)
+        square(2)
+        self.metrics.register_cache("square", square.cache_info)
+        self.metrics.cache_hit("routes")
+        self.metrics.cache_miss("pages")
+
+        self.assertEqual({"square": (1, 1), "routes": (1, 0), "pages": (0, 1)}, self.metrics.cache_stats())
+        self.assertIn("square: 1/2 hits (50.0%)", self.metrics.summary())
+
+    def test_render_prometheus(self):
+        with self.metrics.command("leaderboard"):
+            self.metrics.db_op("find_scores")
+        self.metrics.observe_loop_lag(0.002)
+
+        text = self.metrics.render_prometheus()
+        self.assertIn('pb_bot_command_latency_seconds_count{command="leaderboard"} 1', text)
+        self.assertIn('pb_bot_command_db_ops_bucket{command="leaderboard",le="+Inf"} 1', text)
+        self.assertIn('pb_bot_db_ops_total{op="find_scores"} 1', text)
+        self.assertIn('pb_bot_event_loop_lag_seconds_bucket{le="0.005"} 1', text)
+        self.assertTrue(text.endswith("\n"))
+
+class MeteredStorageTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+        self.storage = MeteredStorage(SqliteStorage(":memory:"), self.metrics)
+
+    def tearDown(self):
+        self.storage.close()
+
+    async def test_db_ops_on_executor(self):
+        #DB calls run on the executor, the command they belong to has to come along with the context
+        async_data = AsyncBotData(self.storage)
+        with self.metrics.command("list_scores"):
+            await async_data.run(self.storage.load_games)
+            await async_data.run(self.storage.load_channels)
+        async_data.shutdown()
+
+        self.assertEqual(2, self.metrics.commands["list_scores"].db_ops.sum)
+        self.assertEqual({"load_games": 1, "load_channels": 1}, self.metrics.db_ops)
+
+    async def test_loop_lag(self):
+        monitor = asyncio.create_task(self.metrics.monitor_loop_lag(0.01))
+        await asyncio.sleep(0.05)
+        monitor.cancel()
+        self.assertGreater(self.metrics.loop_lag.count, 0)
+
+if __name__ == '__main__':
+    unittest.main()
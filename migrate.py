@@ -0,0 +1,32 @@
+import sys
+import yaml
+from botdata import BotData
+
+# One-off data migrations, run against the DB configured in config.yml.
+# Scores submitted before guilds were tracked are moved into guild_id when one is given.
+# Usage: python migrate.py [config file] [guild_id]
+config_file = sys.argv[1] if len(sys.argv) > 1 else "config.yml"
+guild_id = int(sys.argv[2]) if len(sys.argv) > 2 else None
+try:
+    with open(config_file, 'r') as file:
+        config = yaml.load(file, Loader=yaml.FullLoader)
+except Exception as e:
+    print(e)
+    print(f"Unable to load {config_file}.")
+    exit(1)
+
+base_config = config["base_config"]
+bot_data = BotData(base_config.get("storage_url", base_config["mongo_url"]), base_config["db_name"])
+
+print("Migrating embedded scores to the scores collection...")
+migrated = bot_data.migrate_embedded_scores()
+print(f"Migrated {migrated} scores.")
+
+print("Converting datetime time scores to microseconds...")
+converted = bot_data.migrate_time_scores()
+print(f"Converted {converted} scores.")
+
+if guild_id is not None:
+    print(f"Moving scores without a guild to guild {guild_id}...")
+    moved = bot_data.migrate_guild_scores(guild_id)
+    print(f"Moved {moved} scores.")
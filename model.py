@@ -1,21 +1,41 @@
-import uuid
-from datetime import datetime, time
-from typing import List, Optional
+from datetime import datetime
+from typing import Any, List, Optional
 from pydantic import BaseModel, Field
+from pymongo import IndexModel, ASCENDING
 from bunnet import Document, Link, Indexed, init_bunnet
 
-class Score(BaseModel):
-    #score_id: Indexed(int)
-    id: str = Field(default_factory=uuid.uuid4, alias='_id')
+#Storage independent score record passed between BotData and the storage backends.
+class ScoreEntry(BaseModel):
+    id: Optional[Any]
+    guild_id: Optional[int] #None for scores submitted before guilds were tracked
+    game: str
+    category: str #Full category path, e.g. '3lap/Rainbow Road'
     player_id: str
-    create_time: datetime = datetime.now()
+    score_type: str
+    value: int #Points, or microseconds for Time scores, see scoreformat.TimeFormat
+    create_time: datetime = Field(default_factory=datetime.now)
+
+#Mongo schema. Scores are stored in their own collection, one document per submission.
+class Score(Document):
+    guild_id: Optional[int]
+    game: str
+    category: str #Full category path, e.g. '3lap/Rainbow Road'
+    player_id: str
+    create_time: datetime = Field(default_factory=datetime.now)
 
     class Settings:
+        name = 'scores'
         is_root = True
-        #collection = "scores"   
+        #Every score query is scoped to one guild
+        indexes = [
+            IndexModel([("guild_id", ASCENDING), ("game", ASCENDING), ("category", ASCENDING), ("player_id", ASCENDING)]),
+            #_id is the tie breaker for keyset pagination
+            IndexModel([("guild_id", ASCENDING), ("game", ASCENDING), ("category", ASCENDING), ("value", ASCENDING), ("_id", ASCENDING)]),
+            IndexModel([("guild_id", ASCENDING), ("game", ASCENDING), ("category", ASCENDING), ("create_time", ASCENDING), ("_id", ASCENDING)]),
+        ]
 
 class TimeScore(Score):
-    value: datetime
+    value: int #Microseconds, see scoreformat.TimeFormat
 
 class PointScore(Score):
     value: int
@@ -26,27 +46,44 @@ class Category(BaseModel):
     is_enabled: bool = True
     score_type: str
     score_fmt: Optional[str]
-    scores: Optional[List[TimeScore|PointScore]] = []
+    categories: Optional[List['Category']]
 
-class Category(Category):
-    categories: Optional[List[Category]]
+Category.update_forward_refs()
 
 class Game(Document):
     #id: str = Field(default_factory=uuid.uuid4, alias='_id')
     name: str
     is_enabled: bool
     categories: List[Category] = []
+    retention: Optional[int] #Recent attempts kept per player besides their personal best, None keeps every attempt
 
     class Settings():
         name = 'games'
 
+#Channels bound by (guild_id, channel_id), or with only a name for the channel names in the games config, which apply in every guild.
 class Channel(Document):
-    name: str
+    guild_id: Optional[int]
+    channel_id: Optional[int]
+    name: Optional[str]
     games: List[Link[Game]] = [] #TODO Should this be optional?
 
     class Settings():
         name = 'channels'
+        indexes = [
+            IndexModel([("guild_id", ASCENDING), ("channel_id", ASCENDING)], unique=True,
+                       partialFilterExpression={"channel_id": {"$type": "number"}}),
+        ]
+
+#Superseded attempts moved out of the scores collection by compaction, see MongoStorage.archive_scores.
+#Archived documents keep their scores collection _id and fields, only player history queries read them.
+ARCHIVE_COLLECTION = 'scores_archive'
+ARCHIVE_INDEXES = [
+    IndexModel([("guild_id", ASCENDING), ("game", ASCENDING), ("category", ASCENDING), ("player_id", ASCENDING), ("create_time", ASCENDING)]),
+]
+
+#Routing state saved by the last full games config sync, keyed by name, see BotData._init_games_config_snapshot
+SNAPSHOT_COLLECTION = 'snapshots'
 
 # End of schema definitions
 def init_model(db):
-    init_bunnet(database=db, document_models=[Channel, Game ])
+    init_bunnet(database=db, document_models=[Channel, Game, Score, TimeScore, PointScore])
@@ -0,0 +1,83 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Hashable, Optional, Tuple
+from metrics import metrics
+
+class ResponseCache():
+    '''
+    LRU cache of rendered command responses with a memory cap.
+    Keys are (view, guild_id, game_name, category_path, page). Every (guild_id, game_name, category_path)
+    has a version counter that new scores bump, an entry only counts as a hit while the version it was rendered
+    at is still current, so stale entries never need to be found and deleted.
+    Scores are added from executor threads, so every operation holds the lock.
+    '''
+    def __init__(self, max_bytes: int = 4 * 1024 * 1024, name: str = "responses", metrics = metrics):
+        self.max_bytes = max_bytes
+        self.name = name
+        self.metrics = metrics
+        self.entries = OrderedDict()    # key -> (version, value, size), least recently used first
+        self.versions = {}              # (guild_id, game_name, category_path) -> version
+        self.size = 0
+        self.lock = Lock()
+
+    def get(self, key: Tuple) -> Tuple[Optional[object], int]:
+        '''
+        Returns (value, version), value is None on a miss.
+        Pass the version on to put, so a response rendered while a score came in is never stored as current.
+        '''
+        with self.lock:
+            version = self.versions.get(key[1:4], 0)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                value = entry[1]
+            else:
+                if entry is not None:
+                    self._remove(key)
+                value = None
+
+        if value is None:
+            self.metrics.cache_miss(self.name)
+        else:
+            self.metrics.cache_hit(self.name)
+        return value, version
+
+    def version(self, key: Tuple) -> int:
+        '''
+        Returns the current version of the key's category without looking up an entry.
+        '''
+        with self.lock:
+            return self.versions.get(key[1:4], 0)
+
+    def put(self, key: Tuple, version: int, value, size: int):
+        '''
+        Stores a rendered response. size is its approximate footprint in bytes, responses over the cap are not kept.
+        '''
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (version, value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, guild_id: Optional[int], game_name: str, category_path: str):
+        '''
+        Marks every cached response for the category stale.
+        '''
+        scope = (guild_id, game_name, category_path)
+        with self.lock:
+            self.versions[scope] = self.versions.get(scope, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key: Hashable):
+        self.size -= self.entries.pop(key)[2]
+
+    def __len__(self):
+        return len(self.entries)
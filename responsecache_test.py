@@ -0,0 +1,54 @@
+import unittest
+from metrics import Metrics
+from responsecache import ResponseCache
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+        self.cache = ResponseCache(max_bytes=100, metrics=self.metrics)
+
+    def test_versioning(self):
+        key = ("leaderboard", 1, "mk64", "3lap/Rainbow Road", None)
+        response, version = self.cache.get(key)
+        self.assertIsNone(response)
+        self.cache.put(key, version, "#1 player1", 10)
+        self.assertEqual(("#1 player1", version), self.cache.get(key))
+
+        #A new score makes the category's responses stale, other categories and guilds keep theirs
+        other_key = ("leaderboard", 2, "mk64", "3lap/Rainbow Road", None)
+        self.cache.put(other_key, self.cache.get(other_key)[1], "#1 player2", 10)
+        self.cache.invalidate(1, "mk64", "3lap/Rainbow Road")
+        self.assertIsNone(self.cache.get(key)[0])
+        self.assertEqual("#1 player2", self.cache.get(other_key)[0])
+        self.assertEqual(10, self.cache.size)
+
+        self.assertEqual({"responses": (2, 3)}, self.metrics.cache_stats())
+
+    def test_rendered_during_a_write(self):
+        key = ("list_scores", None, "mk64", "Default", None)
+        _, version = self.cache.get(key)
+        #A score lands while the page is being rendered, the page must not be cached as current
+        self.cache.invalidate(None, "mk64", "Default")
+        self.assertEqual(version + 1, self.cache.version(key))
+        self.cache.put(key, version, "page", 10)
+        self.assertIsNone(self.cache.get(key)[0])
+
+    def test_lru_memory_cap(self):
+        for index in range(3):
+            self.cache.put(("leaderboard", None, f"game{index}", "Default", None), 0, index, 40)
+        #game0 was evicted to keep the cache under 100 bytes
+        self.assertIsNone(self.cache.get(("leaderboard", None, "game0", "Default", None))[0])
+        self.assertEqual(1, self.cache.get(("leaderboard", None, "game1", "Default", None))[0])
+
+        #game1 was used last, so game2 goes next
+        self.cache.put(("leaderboard", None, "game3", "Default", None), 0, 3, 40)
+        self.assertIsNone(self.cache.get(("leaderboard", None, "game2", "Default", None))[0])
+        self.assertEqual(80, self.cache.size)
+
+        self.cache.put(("leaderboard", None, "huge", "Default", None), 0, "huge", 500)
+        self.assertEqual(2, len(self.cache))
+        self.cache.clear()
+        self.assertEqual((0, 0), (len(self.cache), self.cache.size))
+
+if __name__ == '__main__':
+    unittest.main()
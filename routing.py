@@ -0,0 +1,215 @@
+import bisect
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+from model import Category
+
+#Discord shows at most 25 autocomplete choices
+MAX_COMPLETIONS = 25
+
+class ChannelRef(NamedTuple):
+    '''
+    Identifies a discord channel. Channels are keyed by (guild_id, channel_id), the name is only used
+    to match the channel names in the games config.
+    '''
+    guild_id: Optional[int]
+    channel_id: Optional[int]
+    name: str
+
+def shard_for_guild(guild_id: int, shard_count: int):
+    '''
+    The shard discord routes a guild's events to.
+    '''
+    return (guild_id >> 22) % shard_count
+
+class PrefixIndex():
+    '''
+    Case-insensitive prefix lookups over a sorted array of (key, value) pairs.
+    A bisect finds the first key with the prefix and the matches are the run of keys after it,
+    so a lookup costs O(log n + matches) and never touches the DB.
+    Several keys can point at the same value, each value is returned once.
+    '''
+    def __init__(self, entries: Iterable[Tuple[str, str]]):
+        entries = sorted((key.casefold(), value) for key, value in entries)
+        self.keys = [key for key, _ in entries]
+        self.values = [value for _, value in entries]
+
+    def complete(self, prefix: str, limit: int = MAX_COMPLETIONS):
+        prefix = prefix.casefold()
+        matches = []
+        index = bisect.bisect_left(self.keys, prefix)
+        while index < len(self.keys) and len(matches) < limit and self.keys[index].startswith(prefix):
+            if self.values[index] not in matches:
+                matches.append(self.values[index])
+            index += 1
+        return matches
+
+class ChannelRoute():
+    '''
+    A channel bound by id within a guild, with the games linked to it directly.
+    '''
+    def __init__(self, name: Optional[str], game_names: List[str]):
+        self.name = name
+        self.game_names = list(game_names)
+
+class GameRoute():
+    '''
+    In-memory view of a game: its enabled state, category tree and a flattened index of that tree.
+    Scores are submitted to leaf categories, addressed by their full path, e.g. '3lap/Rainbow Road'.
+    '''
+    def __init__(self, name: str, is_enabled: bool, categories: List[Category], game_id = None, retention: Optional[int] = None):
+        self.id = game_id                                # storage id, used to link the game to channels
+        self.name = name
+        self.is_enabled = is_enabled
+        self.categories = categories or []
+        self.retention = retention                       # recent attempts kept hot per player besides their best, None keeps all
+        self.category_paths: Dict[str, Category] = {}   # full path -> leaf category
+        self.enabled_paths: Dict[str, bool] = {}        # full path -> enabled, including every parent
+        self.category_names: Dict[str, str] = {}        # leaf name -> full path, only for names that are unique
+        self._index_categories(self.categories)
+        #Enabled paths for autocomplete, by full path and by leaf name so 'Rain' offers every 'Rainbow Road'
+        enabled_paths = self.get_category_paths()
+        self.category_index = PrefixIndex(
+            [(path, path) for path in enabled_paths] +
+            [(self.category_paths[path].name, path) for path in enabled_paths if "/" in path]
+        )
+
+    def _index_categories(self, categories: List[Category]):
+        duplicate_names = set()
+        stack = [(category, None, True) for category in reversed(categories)]
+        while stack:
+            category, parent_path, parent_enabled = stack.pop()
+            path = f"{parent_path}/{category.name}" if parent_path else category.name
+            enabled = parent_enabled and category.is_enabled
+            if category.categories:
+                stack += [(subcategory, path, enabled) for subcategory in reversed(category.categories)]
+                continue
+
+            self.category_paths[path] = category
+            self.enabled_paths[path] = enabled
+            if category.name in self.category_names or category.name in duplicate_names:
+                duplicate_names.add(category.name)
+                self.category_names.pop(category.name, None)
+            else:
+                self.category_names[category.name] = path
+
+    def get_category_path(self, category_name: str):
+        '''
+        Resolves a full category path, or a leaf name that is unique within the game, to its full path.
+        '''
+        if category_name in self.category_paths:
+            return category_name
+        return self.category_names.get(category_name)
+
+    def get_category(self, category_name: str):
+        '''
+        Returns a (category_path, category) tuple, or (None, None) when the category does not exist.
+        '''
+        path = self.get_category_path(category_name)
+        return (path, self.category_paths[path]) if path else (None, None)
+
+    def get_category_paths(self, category_enabled: Optional[bool] = True):
+        return [path for path, enabled in self.enabled_paths.items() if category_enabled is None or enabled == category_enabled]
+
+class RoutingTable():
+    '''
+    In-memory routing of channel -> games -> category tree.
+    Built once from the DB and kept current by the BotData write paths, so command checks never have to query the DB.
+
+    Channel names from the games config apply in every guild. Channels bound by (guild_id, channel_id) are
+    partitioned per guild and get the games linked to them on top of the ones their name picks up.
+    A channel can be given as a ChannelRef or as a plain name, which only matches the games config names.
+    '''
+    def __init__(self):
+        self.games: Dict[str, GameRoute] = {}
+        self.channels: Dict[str, List[str]] = {}                    # config channel name -> game names
+        self.guilds: Dict[int, Dict[int, ChannelRoute]] = {}        # guild_id -> channel_id -> bound channel
+        self.game_indexes: Dict[object, PrefixIndex] = {}           # channel key -> enabled games, built on first use
+
+    def set_game(self, name: str, is_enabled: bool, categories: List[Category], game_id = None, retention: Optional[int] = None):
+        self.games[name] = GameRoute(name, is_enabled, categories, game_id, retention)
+        self.game_indexes.clear()
+        return self.games[name]
+
+    def set_channel(self, channel_name: str, game_names: List[str]):
+        self.channels[channel_name] = list(game_names)
+        self.game_indexes.clear()
+
+    def bind_channel(self, guild_id: int, channel_id: int, channel_name: Optional[str], game_names: List[str]):
+        self.guilds.setdefault(guild_id, {})[channel_id] = ChannelRoute(channel_name, game_names)
+        self.game_indexes.clear()
+
+    def get_bound_channel(self, guild_id: int, channel_id: int) -> Optional[ChannelRoute]:
+        return self.guilds.get(guild_id, {}).get(channel_id)
+
+    def drop_guild(self, guild_id: int):
+        self.guilds.pop(guild_id, None)
+        self.game_indexes.clear()
+
+    def add_game_to_channel(self, channel: Union[ChannelRef, str], game_name: str):
+        if isinstance(channel, str):
+            game_names = self.channels.setdefault(channel, [])
+        else:
+            bound = self.get_bound_channel(channel.guild_id, channel.channel_id)
+            if bound is None:
+                self.bind_channel(channel.guild_id, channel.channel_id, channel.name, [])
+                bound = self.get_bound_channel(channel.guild_id, channel.channel_id)
+            game_names = bound.game_names
+
+        if game_name not in game_names:
+            game_names.append(game_name)
+            self.game_indexes.clear()
+
+    def _channel_games(self, channel: Union[ChannelRef, str]):
+        if isinstance(channel, str):
+            return self.channels.get(channel, [])
+
+        bound = self.get_bound_channel(channel.guild_id, channel.channel_id)
+        config_games = self.channels.get(channel.name, [])
+        if bound is None:
+            return config_games
+        return bound.game_names + [name for name in config_games if name not in bound.game_names]
+
+    def get_game(self, name: str) -> Optional[GameRoute]:
+        return self.games.get(name)
+
+    def get_channels(self, guild_id: Optional[int] = None):
+        '''
+        Returns the config channel names, or the channels bound in a guild when guild_id is given.
+        '''
+        if guild_id is None:
+            return list(self.channels)
+        return [ChannelRef(guild_id, channel_id, bound.name) for channel_id, bound in self.guilds.get(guild_id, {}).items()]
+
+    def get_active_games(self):
+        return [game.name for game in self.games.values() if game.is_enabled]
+
+    def get_active_channels(self, guild_id: Optional[int] = None):
+        return [channel for channel in self.get_channels(guild_id) if self.is_channel_active(channel)]
+
+    #game_enabled = None returns all games in the channel
+    def get_games_in_channel(self, channel: Union[ChannelRef, str], game_enabled: Optional[bool] = True):
+        return [name for name in self._channel_games(channel)
+                if name in self.games and (game_enabled is None or self.games[name].is_enabled == game_enabled)]
+
+    def is_channel_active(self, channel: Union[ChannelRef, str]):
+        return any(self.games[name].is_enabled for name in self._channel_games(channel) if name in self.games)
+
+    def complete_games(self, channel: Union[ChannelRef, str], prefix: str, limit: int = MAX_COMPLETIONS):
+        '''
+        Enabled games in the channel starting with prefix. The index is built on the first lookup for a channel
+        and dropped whenever the channels or games it was built from change.
+        '''
+        if isinstance(channel, str) or self.get_bound_channel(channel.guild_id, channel.channel_id) is None:
+            #Unbound channels only get the config games for their name
+            key = channel if isinstance(channel, str) else channel.name
+        else:
+            key = (channel.guild_id, channel.channel_id)
+
+        index = self.game_indexes.get(key)
+        if index is None:
+            index = PrefixIndex((name, name) for name in self.get_games_in_channel(channel))
+            self.game_indexes[key] = index
+        return index.complete(prefix, limit)
+
+    def complete_categories(self, game_name: str, prefix: str, limit: int = MAX_COMPLETIONS):
+        game = self.get_game(game_name)
+        return game.category_index.complete(prefix, limit) if game else []
@@ -0,0 +1,103 @@
+import unittest
+from model import Category
+from routing import GameRoute, RoutingTable, ChannelRef, PrefixIndex, shard_for_guild
+
+class GameRouteTest(unittest.TestCase):
+    def setUp(self):
+        maps = lambda: [Category(name="Rainbow Road", score_type="Time"), Category(name="Toad Turnpike", score_type="Time")]
+        self.game = GameRoute("mk64", True, [
+            Category(name="3lap", score_type="Time", categories=maps()),
+            Category(name="1lap", score_type="Time", categories=maps() + [Category(name="Wario Stadium", score_type="Time")]),
+            Category(name="Retired", score_type="Time", is_enabled=False, categories=[Category(name="Old Map", score_type="Time")])
+        ])
+
+    def test_category_paths(self):
+        assert_paths = ["3lap/Rainbow Road", "3lap/Toad Turnpike", "1lap/Rainbow Road", "1lap/Toad Turnpike", "1lap/Wario Stadium"]
+        self.assertEqual(assert_paths, self.game.get_category_paths())
+        self.assertEqual(["Retired/Old Map"], self.game.get_category_paths(False))
+
+    def test_get_category(self):
+        #Every sibling is reachable by its full path
+        path, category = self.game.get_category("1lap/Toad Turnpike")
+        self.assertEqual(("1lap/Toad Turnpike", "Toad Turnpike"), (path, category.name))
+
+        #Unique leaf names resolve on their own, ambiguous ones need the full path
+        self.assertEqual("1lap/Wario Stadium", self.game.get_category_path("Wario Stadium"))
+        self.assertIsNone(self.game.get_category_path("Rainbow Road"))
+        self.assertEqual((None, None), self.game.get_category("3lap"))
+
+    def test_complete_categories(self):
+        #Leaf names match too, disabled categories are left out
+        self.assertEqual(["1lap/Rainbow Road", "3lap/Rainbow Road"], self.game.category_index.complete("rain"))
+        self.assertEqual(["3lap/Rainbow Road", "3lap/Toad Turnpike"], self.game.category_index.complete("3LAP/"))
+        self.assertEqual([], self.game.category_index.complete("Old"))
+        self.assertEqual(1, len(self.game.category_index.complete("", limit=1)))
+
+class PrefixIndexTest(unittest.TestCase):
+    def test_complete(self):
+        index = PrefixIndex([("mk64", "mk64"), ("mk8", "mk8"), ("Celeste", "celeste"), ("m", "m")])
+        self.assertEqual(["mk64", "mk8"], index.complete("mk"))
+        self.assertEqual(["celeste"], index.complete("cEl"))
+        self.assertEqual(["m", "mk64"], index.complete("m", limit=2))
+        self.assertEqual([], index.complete("z"))
+        self.assertEqual([], PrefixIndex([]).complete(""))
+
+class RoutingTableTest(unittest.TestCase):
+    def test_active_channels(self):
+        routes = RoutingTable()
+        routes.set_game("mk64", True, [Category(score_type="Time")])
+        routes.set_game("csgo-surf", False, [Category(score_type="Time")])
+        routes.set_channel("mk-test", ["mk64"])
+        routes.set_channel("csgo-test", ["csgo-surf"])
+        routes.add_game_to_channel("general-test", "mk64")
+        routes.add_game_to_channel("general-test", "csgo-surf")
+
+        self.assertEqual(["mk-test", "general-test"], routes.get_active_channels())
+        self.assertFalse(routes.is_channel_active("csgo-test"))
+        self.assertEqual(["mk64", "csgo-surf"], routes.get_games_in_channel("general-test", None))
+
+    def test_guild_channels(self):
+        routes = RoutingTable()
+        routes.set_game("mk64", True, [Category(score_type="Time")])
+        routes.set_game("cyber-hook", True, [Category(score_type="Time")])
+        routes.set_channel("mk-test", ["mk64"])
+        routes.bind_channel(1, 10, "mk-test", ["cyber-hook"])
+
+        #Same named channels in other guilds only pick up the config games
+        self.assertEqual(["cyber-hook", "mk64"], routes.get_games_in_channel(ChannelRef(1, 10, "mk-test")))
+        self.assertEqual(["mk64"], routes.get_games_in_channel(ChannelRef(2, 10, "mk-test")))
+        self.assertFalse(routes.is_channel_active(ChannelRef(2, 20, "off-topic")))
+
+        #Bound channels keep their games when renamed
+        self.assertEqual(["cyber-hook"], routes.get_games_in_channel(ChannelRef(1, 10, "renamed")))
+        routes.add_game_to_channel(ChannelRef(2, 20, "off-topic"), "cyber-hook")
+        self.assertEqual([ChannelRef(2, 20, "off-topic")], routes.get_active_channels(2))
+
+        routes.drop_guild(1)
+        self.assertEqual([], routes.get_channels(1))
+        self.assertEqual(["mk64"], routes.get_games_in_channel(ChannelRef(1, 10, "mk-test")))
+
+    def test_complete_games(self):
+        routes = RoutingTable()
+        routes.set_game("mk64", True, [Category(score_type="Time")])
+        routes.set_game("mk8", False, [Category(score_type="Time")])
+        routes.set_channel("mk-test", ["mk64", "mk8"])
+        self.assertEqual(["mk64"], routes.complete_games("mk-test", "mk"))
+        self.assertEqual(["mk64"], routes.complete_games(ChannelRef(1, 10, "mk-test"), ""))
+
+        #Indexes are rebuilt once the routes they were built from change
+        routes.set_game("mk8", True, [Category(score_type="Time")])
+        routes.bind_channel(1, 10, "mk-test", ["cyber-hook"])
+        routes.set_game("cyber-hook", True, [Category(score_type="Time")])
+        self.assertEqual(["mk64", "mk8"], routes.complete_games("mk-test", "MK"))
+        self.assertEqual(["cyber-hook", "mk64", "mk8"], routes.complete_games(ChannelRef(1, 10, "mk-test"), ""))
+        self.assertEqual([], routes.complete_categories("no-such-game", ""))
+
+    def test_shard_for_guild(self):
+        #Shards come from the guild id's timestamp bits, not the id itself
+        self.assertEqual(0, shard_for_guild(41771983423143937, 1))
+        self.assertEqual(0, shard_for_guild(41771983423143937, 2))
+        self.assertEqual(1, shard_for_guild(41771983427338241, 2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import re
+from datetime import datetime
+from functools import lru_cache
+from metrics import metrics
+
+DEFAULT_TIME_FORMAT = "%M:%S.%f"
+
+#strptime fills in 1900-01-01 for formats without a date, legacy datetime scores are offsets from it
+TIME_EPOCH = datetime(1900, 1, 1)
+
+MICROSECONDS = {
+    "H": 3600 * 1000000,
+    "M": 60 * 1000000,
+    "S": 1000000,
+}
+
+class TimeFormat():
+    '''
+    Parses and formats time scores for a single score_fmt.
+    Times are stored as integer microseconds, so sorting, comparisons and diffs are plain integer operations.
+    The format is compiled to a regex once and only the directives that make sense for a duration are supported:
+    %H, %M, %S, %f and %%. Field ranges match datetime.strptime.
+    '''
+    PATTERNS = {
+        "H": r"(?P<H>2[0-3]|[0-1]\d|\d)",
+        "M": r"(?P<M>[0-5]\d|\d)",
+        "S": r"(?P<S>6[0-1]|[0-5]\d|\d)",
+        "f": r"(?P<f>[0-9]{1,6})",
+    }
+
+    def __init__(self, score_fmt: str):
+        self.score_fmt = score_fmt
+        self.fields = []    # directive letters and literal strings, in format order
+        pattern = []
+        for directive, literal in re.findall(r"%(.)|([^%]+)", score_fmt):
+            if literal:
+                self.fields.append(literal)
+                pattern.append(r"\s+" if literal.isspace() else re.escape(literal))
+            elif directive == "%":
+                self.fields.append("%")
+                pattern.append("%")
+            elif directive in self.PATTERNS:
+                self.fields.append((directive,))
+                pattern.append(self.PATTERNS[directive])
+            else:
+                raise ValueError(f"Unsupported time directive %{directive} in {score_fmt}")
+
+        self.regex = re.compile("".join(pattern))
+        #Output template for format(), units missing from the format fold into the next smaller one
+        self.has_hours = ("H",) in self.fields
+        self.has_minutes = ("M",) in self.fields
+        template_fields = {"H": "{0:02d}", "M": "{1:02d}", "S": "{2:02d}", "f": "{3:06d}"}
+        self.template = "".join(template_fields[field[0]] if isinstance(field, tuple) else field.replace("{", "{{").replace("}", "}}")
+                                for field in self.fields)
+
+    def parse(self, score_value: str) -> int:
+        match = self.regex.fullmatch(score_value)
+        if not match:
+            raise ValueError(f"time data {score_value!r} does not match format {self.score_fmt!r}")
+
+        value = 0
+        for name, digits in match.groupdict().items():
+            if name == "f":
+                value += int(digits.ljust(6, "0"))
+            else:
+                value += int(digits) * MICROSECONDS[name]
+        return value
+
+    def format(self, value: int) -> str:
+        sign = "-" if value < 0 else ""
+        value = abs(value)
+        hours, value = divmod(value, MICROSECONDS["H"])
+        minutes, value = divmod(value, MICROSECONDS["M"])
+        seconds, micros = divmod(value, MICROSECONDS["S"])
+        if not self.has_hours:
+            minutes += hours * 60
+        if not self.has_minutes:
+            seconds += minutes * 60
+
+        return sign + self.template.format(hours, minutes, seconds, micros)
+
+def compile_time_format(score_fmt: str = None) -> TimeFormat:
+    '''
+    Returns the compiled TimeFormat for score_fmt, compiling it on first use.
+    '''
+    return _compile_time_format(score_fmt or DEFAULT_TIME_FORMAT)
+
+@lru_cache(maxsize=None)
+def _compile_time_format(score_fmt: str) -> TimeFormat:
+    return TimeFormat(score_fmt)
+
+metrics.register_cache("time_formats", _compile_time_format.cache_info)
+
+def datetime_to_micros(value: datetime) -> int:
+    '''
+    Converts a legacy strptime based datetime score into integer microseconds.
+    '''
+    delta = value - TIME_EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
@@ -0,0 +1,40 @@
+import unittest
+from datetime import datetime
+from scoreformat import TimeFormat, compile_time_format, datetime_to_micros
+
+class TimeFormatTest(unittest.TestCase):
+    def test_parse(self):
+        time_format = TimeFormat("%M:%S.%f")
+        self.assertEqual(62500000, time_format.parse("01:02.5"))
+        self.assertEqual(62500000, time_format.parse("1:2.500000"))
+        self.assertEqual(3723000000, TimeFormat("%H:%M:%S").parse("01:02:03"))
+
+    def test_parse_invalid(self):
+        time_format = TimeFormat("%M:%S.%f")
+        for score_value in ["not a time", "01:02", "60:00.0", "01:02.1234567", " 01:02.5"]:
+            with self.assertRaises(ValueError):
+                time_format.parse(score_value)
+
+    def test_unsupported_directive(self):
+        with self.assertRaises(ValueError):
+            TimeFormat("%Y %M:%S")
+
+    def test_format(self):
+        self.assertEqual("01:02.500000", TimeFormat("%M:%S.%f").format(62500000))
+        self.assertEqual("-00:01.500000", TimeFormat("%M:%S.%f").format(-1500000))
+        #Hours fold into minutes when the format has no %H
+        self.assertEqual("61:00.000000", TimeFormat("%M:%S.%f").format(3660000000))
+
+    def test_matches_strptime(self):
+        for score_fmt, score_value in [("%M:%S.%f", "59:59.999999"), ("%H:%M:%S", "23:5:9"), ("%S.%f", "7.25"), ("%M'%S\"", "1'02\"")]:
+            legacy = datetime.strptime(score_value, score_fmt)
+            time_format = compile_time_format(score_fmt)
+            self.assertEqual(datetime_to_micros(legacy), time_format.parse(score_value))
+            self.assertEqual(legacy.strftime(score_fmt), time_format.format(time_format.parse(score_value)))
+
+    def test_compiled_once(self):
+        self.assertIs(compile_time_format("%M:%S.%f"), compile_time_format("%M:%S.%f"))
+        self.assertIs(compile_time_format(None), compile_time_format("%M:%S.%f"))
+
+if __name__ == '__main__':
+    unittest.main()
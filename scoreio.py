@@ -0,0 +1,214 @@
+import io
+import csv
+import sys
+import json
+import yaml
+import logging
+import argparse
+from datetime import datetime
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+from model import ScoreEntry
+from botdata import BotData
+
+log = logging.getLogger(__name__)
+
+#Columns of both formats. create_time is optional on import and defaults to the time of the import.
+COLUMNS = ["game", "category", "player", "score", "create_time"]
+FORMATS = ("csv", "jsonl")
+
+class ImportResult():
+    '''
+    Outcome of an import. Only the first max_rejects rejects are kept, so a bad file can not grow it without bound.
+    '''
+    def __init__(self, max_rejects: int = 100):
+        self.imported = 0
+        self.rejected = 0
+        self.rejects: List[Tuple[int, str]] = []    # (line number, reason)
+        self.max_rejects = max_rejects
+
+    def reject(self, line: int, reason: str):
+        self.rejected += 1
+        if len(self.rejects) < self.max_rejects:
+            self.rejects.append((line, reason))
+
+    def summary(self):
+        return f"Imported {self.imported} scores, rejected {self.rejected}"
+
+class ScoreRow(NamedTuple):
+    line: int
+    fields: dict
+
+def format_for(file_name: str):
+    return "jsonl" if file_name.lower().endswith((".jsonl", ".ndjson")) else "csv"
+
+def read_rows(lines: TextIO, fmt: str = "csv") -> Iterator[ScoreRow]:
+    '''
+    Yields the rows of a CSV file with a header line, or of a JSONL file with one object per line, one at a time.
+    Lines that are not valid JSON come through with fields set to None.
+    '''
+    if fmt == "jsonl":
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                fields = json.loads(line)
+            except ValueError:
+                fields = None
+            yield ScoreRow(line_number, fields if isinstance(fields, dict) else None)
+    else:
+        reader = csv.DictReader(lines)
+        for fields in reader:
+            yield ScoreRow(reader.line_num, fields)
+
+def parse_create_time(value) -> Optional[datetime]:
+    '''
+    Parses an ISO 8601 time. Times with an offset are converted to local time, which is what the bot stores.
+    '''
+    if value in (None, ""):
+        return None
+    create_time = datetime.fromisoformat(str(value))
+    if create_time.tzinfo is not None:
+        create_time = create_time.astimezone().replace(tzinfo=None)
+    return create_time
+
+def prepare_row(bot_data, row: ScoreRow, guild_id: int = None) -> Tuple[Optional[ScoreEntry], Optional[str]]:
+    '''
+    Validates a row against its category's score_type and score_fmt. Returns (score, None) or (None, reason).
+    '''
+    if row.fields is None:
+        return None, "Not a JSON object"
+    missing = [column for column in ("game", "player", "score") if not str(row.fields.get(column) or "").strip()]
+    if missing:
+        return None, f"Missing {', '.join(missing)}"
+
+    game_name = str(row.fields["game"]).strip()
+    category_name = str(row.fields.get("category") or "Default").strip()
+    game = bot_data.routes.get_game(game_name)
+    if game is None:
+        return None, f"Unknown game {game_name}"
+    category_path, category = game.get_category(category_name)
+    if category is None:
+        return None, f"Unknown category {category_name} for {game_name}"
+
+    try:
+        create_time = parse_create_time(row.fields.get("create_time"))
+    except ValueError:
+        return None, f"Invalid create_time {row.fields.get('create_time')}, expected ISO 8601"
+
+    score_value = str(row.fields["score"]).strip()
+    score = bot_data.prepare_score(str(row.fields["player"]).strip(), game_name, score_value, category_path, guild_id)
+    if score is None:
+        expected = f"a {category.score_fmt or '%M:%S.%f'} time" if category.score_type == "Time" else "a whole number of points"
+        return None, f"Invalid score {score_value} for {game_name}:{category_path}, expected {expected}"
+    if create_time:
+        score.create_time = create_time
+    return score, None
+
+def import_scores(bot_data, rows: Iterator[ScoreRow], guild_id: int = None, batch_size: int = 1000, max_rejects: int = 100):
+    '''
+    Streams rows into storage with one bulk insert per batch_size valid scores.
+    Only one batch is held at a time, so memory does not grow with the size of the file.
+    Returns an ImportResult.
+    '''
+    result = ImportResult(max_rejects)
+    batch = []
+    for row in rows:
+        score, reason = prepare_row(bot_data, row, guild_id)
+        if score is None:
+            result.reject(row.line, reason)
+            continue
+
+        batch.append(score)
+        if len(batch) >= batch_size:
+            result.imported += bot_data.insert_scores(batch)
+            batch = []
+    result.imported += bot_data.insert_scores(batch)
+
+    log.info("%s%s", result.summary(), f" into guild {guild_id}" if guild_id is not None else "")
+    return result
+
+def export_scores(bot_data, out: TextIO, game_name: str, category_name: str = 'Default', guild_id: int = None,
+                  fmt: str = "csv", page_size: int = 1000):
+    '''
+    Streams a category's scores to out, newest first, one keyset page at a time.
+    The output can be imported again as it is. Attempts moved to the archive by compaction are not included.
+    Returns the number of scores written.
+    '''
+    game = bot_data.routes.get_game(game_name)
+    category_path = game.get_category_path(category_name) if game else None
+    if category_path is None:
+        raise ValueError(f"Unknown category {category_name} for {game_name}")
+
+    writer = csv.writer(out) if fmt == "csv" else None
+    if writer:
+        writer.writerow(COLUMNS)
+
+    written = 0
+    cursor = None
+    while True:
+        scores, _, cursor = bot_data.get_scores_page(game_name, category_path, page_size, after=cursor, order_by="create_time", guild_id=guild_id)
+        for player_id, value, create_time in scores:
+            row = [game_name, category_path, player_id, value, create_time.isoformat()]
+            if writer:
+                writer.writerow(row)
+            else:
+                out.write(json.dumps(dict(zip(COLUMNS, row))) + "\n")
+        written += len(scores)
+        if cursor is None:
+            return written
+
+#Binary file versions, for uploads and attachments that arrive as bytes
+def import_scores_file(bot_data, file: BinaryIO, fmt: str = "csv", guild_id: int = None, batch_size: int = 1000):
+    #utf-8-sig drops the byte order mark spreadsheet exports start with
+    lines = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        return import_scores(bot_data, read_rows(lines, fmt), guild_id, batch_size)
+    finally:
+        lines.detach()
+
+def export_scores_file(bot_data, file: BinaryIO, game_name: str, category_name: str = 'Default', guild_id: int = None, fmt: str = "csv"):
+    out = io.TextIOWrapper(file, encoding="utf-8", newline="")
+    try:
+        return export_scores(bot_data, out, game_name, category_name, guild_id, fmt)
+    finally:
+        out.flush()
+        out.detach()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import or export historical scores as CSV or JSONL.")
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("file", help="File to import from or export to, - for stdin or stdout")
+    parser.add_argument("--config", default="config.yml", help="Bot config with the storage to use")
+    parser.add_argument("--guild-id", type=int, default=None, help="Guild the scores belong to")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="Defaults to jsonl for .jsonl files and csv otherwise")
+    parser.add_argument("--game", help="Game to export")
+    parser.add_argument("--category", default="Default", help="Category to export")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    return parser.parse_args()
+
+# Runs against the storage configured in config.yml. A running bot picks imported scores up on its next start,
+# use the !import_scores command to import into a running bot.
+# Usage: python scoreio.py import scores.csv [--guild-id 123] | python scoreio.py export out.jsonl --game mk64 --category 3lap/Rainbow Road
+def main():
+    args = parse_args()
+    with open(args.config, 'r') as config_file:
+        base_config = yaml.load(config_file, Loader=yaml.FullLoader)["base_config"]
+    bot_data = BotData(base_config.get("storage_url", base_config["mongo_url"]), base_config["db_name"])
+    fmt = args.format or format_for(args.file)
+
+    if args.action == "import":
+        with (open(args.file, 'rb') if args.file != "-" else sys.stdin.buffer) as file:
+            result = import_scores_file(bot_data, file, fmt, args.guild_id, args.batch_size)
+        for line, reason in result.rejects:
+            print(f"Line {line}: {reason}", file=sys.stderr)
+        print(result.summary())
+    else:
+        if not args.game:
+            print("--game is required for export", file=sys.stderr)
+            exit(1)
+        with (open(args.file, 'wb') if args.file != "-" else sys.stdout.buffer) as file:
+            written = export_scores_file(bot_data, file, args.game, args.category, args.guild_id, fmt)
+        print(f"Exported {written} scores", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import io
+import unittest
+from datetime import datetime
+from botdata import BotData
+import scoreio
+
+GAMES_CONFIG = [
+    {"name": "mk64", "channel": ["mk-test"], "enabled": True, "category": [
+        {"name": "3lap", "score_fmt": "%M:%S.%f", "subcategory": {"label": "Map", "category": [{"name": "Rainbow Road"}, {"name": "Toad Turnpike"}]}}
+    ]},
+    {"name": "tetris", "channel": ["tetris-test"], "enabled": True, "category": [{"name": "Marathon", "score_type": "Point"}]},
+]
+
+CSV_ROWS = """game,category,player,score,create_time
+mk64,3lap/Rainbow Road,player1,01:02.500000,2021-03-01T12:00:00
+mk64,Toad Turnpike,player2,00:58.100000,
+tetris,Marathon,player1,120000,2021-03-02T12:00:00
+mk64,3lap/Rainbow Road,player3,not a time,
+mk64,Wario Stadium,player1,01:00.000000,
+tetris,Marathon,player2,12.5,
+nope,Default,player1,10,
+mk64,3lap/Rainbow Road,,01:00.000000,
+tetris,Marathon,player3,100,yesterday
+"""
+
+class ScoreIOTest(unittest.TestCase):
+    def setUp(self):
+        self.bot_data = BotData("sqlite:///:memory:", games_config=GAMES_CONFIG)
+        self.batches = []
+        insert_scores = self.bot_data.insert_scores
+        def recording_insert_scores(scores):
+            self.batches.append(len(scores))
+            return insert_scores(scores)
+        self.bot_data.insert_scores = recording_insert_scores
+
+    def tearDown(self):
+        self.bot_data.storage.close()
+
+    def test_import_csv(self):
+        result = scoreio.import_scores(self.bot_data, scoreio.read_rows(io.StringIO(CSV_ROWS)), guild_id=1, batch_size=2)
+
+        self.assertEqual((3, 6), (result.imported, result.rejected))
+        self.assertEqual([5, 6, 7, 8, 9, 10], [line for line, _ in result.rejects])
+        self.assertIn("expected a %M:%S.%f time", result.rejects[0][1])
+        self.assertIn("Unknown category Wario Stadium", result.rejects[1][1])
+        self.assertIn("expected a whole number of points", result.rejects[2][1])
+        self.assertEqual("Missing player", result.rejects[4][1])
+        #Written in batches of at most batch_size
+        self.assertEqual([2, 1], self.batches)
+
+        scores = self.bot_data.get_scores("mk64", "3lap/Rainbow Road", guild_id=1)
+        self.assertEqual([("player1", "01:02.500000", datetime(2021, 3, 1, 12))], scores)
+        self.assertEqual([("player1", 120000)], [score[:2] for score in self.bot_data.get_leaderboard("tetris", "Marathon", guild_id=1)])
+
+    def test_import_jsonl(self):
+        lines = io.StringIO('{"game": "tetris", "category": "Marathon", "player": "player1", "score": 500}\n\n[1, 2]\n{"game": \n')
+        result = scoreio.import_scores(self.bot_data, scoreio.read_rows(lines, "jsonl"))
+
+        self.assertEqual(1, result.imported)
+        self.assertEqual([(3, "Not a JSON object"), (4, "Not a JSON object")], result.rejects)
+
+    def test_max_rejects(self):
+        lines = io.StringIO("game,category,player,score\n" + "nope,Default,player1,10\n" * 20)
+        result = scoreio.import_scores(self.bot_data, scoreio.read_rows(lines), max_rejects=5)
+        self.assertEqual((20, 5), (result.rejected, len(result.rejects)))
+
+    def test_export_round_trip(self):
+        scoreio.import_scores_file(self.bot_data, io.BytesIO(("\ufeff" + CSV_ROWS).encode()), "csv", guild_id=1)
+
+        for guild_id, fmt in enumerate(scoreio.FORMATS, start=2):
+            file = io.BytesIO()
+            self.assertEqual(1, scoreio.export_scores_file(self.bot_data, file, "mk64", "Rainbow Road", 1, fmt))
+
+            #An export imports again as it is
+            file.seek(0)
+            result = scoreio.import_scores_file(self.bot_data, file, fmt, guild_id)
+            self.assertEqual((1, 0), (result.imported, result.rejected))
+            self.assertEqual(self.bot_data.get_scores("mk64", "3lap/Rainbow Road", 1), self.bot_data.get_scores("mk64", "3lap/Rainbow Road", guild_id))
+
+        with self.assertRaises(ValueError):
+            scoreio.export_scores(self.bot_data, io.StringIO(), "mk64", "Wario Stadium")
+
+if __name__ == '__main__':
+    unittest.main()
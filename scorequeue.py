@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from typing import List
+from model import ScoreEntry
+
+log = logging.getLogger(__name__)
+
+class ScoreQueue():
+    '''
+    Write-behind buffer for score submissions during busy events.
+    Scores are validated before they are queued and written in bulk once max_batch are waiting
+    or max_delay seconds after the first one of a batch was queued.
+
+    durability controls when add() returns:
+      "flush"   - after the batch holding the score has been written. A failed write raises to the caller.
+      "enqueue" - as soon as the score is queued. A failed write is only logged.
+    '''
+    DURABILITY_MODES = ("flush", "enqueue")
+
+    def __init__(self, async_data, max_batch: int = 100, max_delay: float = 1.0, durability: str = "flush"):
+        if durability not in self.DURABILITY_MODES:
+            raise ValueError(f"Invalid durability mode {durability}. Valid modes are {', '.join(self.DURABILITY_MODES)}")
+
+        self.async_data = async_data
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.durability = durability
+        self.pending = []           # (score, future) waiting for the next flush
+        self.flush_timer = None
+        self.flush_tasks = set()
+        self.closed = False
+
+    async def add(self, score: ScoreEntry):
+        if self.closed:
+            raise RuntimeError("Score queue is closed")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((score, future))
+
+        if len(self.pending) >= self.max_batch:
+            self._start_flush()
+        elif self.flush_timer is None:
+            self.flush_timer = loop.call_later(self.max_delay, self._start_flush)
+
+        if self.durability == "flush":
+            await future
+        return True
+
+    def _start_flush(self):
+        if self.flush_timer:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self._flush(batch))
+            self.flush_tasks.add(task)
+            task.add_done_callback(self.flush_tasks.discard)
+
+    async def _flush(self, batch: List):
+        try:
+            await self.async_data.insert_scores([score for score, _ in batch])
+        except Exception as e:
+            log.error("Failed to write %d queued scores: %s", len(batch), e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            #Nobody waits on the futures in enqueue mode
+            if self.durability == "enqueue":
+                for _, future in batch:
+                    future.exception()
+        else:
+            log.debug("Wrote %d queued scores", len(batch))
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(True)
+
+    async def flush(self):
+        '''
+        Writes everything queued so far and waits for all in flight writes.
+        '''
+        self._start_flush()
+        if self.flush_tasks:
+            await asyncio.gather(*self.flush_tasks, return_exceptions=True)
+
+    async def close(self):
+        '''
+        Stops accepting scores and flushes what is left, called on shutdown.
+        '''
+        self.closed = True
+        await self.flush()
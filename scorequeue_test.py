@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+from scorequeue import ScoreQueue
+
+class RecordingAsyncData():
+    '''
+    Stands in for AsyncBotData, records each bulk insert.
+    '''
+    def __init__(self, fail: bool = False):
+        self.batches = []
+        self.fail = fail
+
+    async def insert_scores(self, scores):
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise ConnectionError("DB unavailable")
+        self.batches.append(list(scores))
+        return len(scores)
+
+class ScoreQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def test_flush_on_batch_size(self):
+        async_data = RecordingAsyncData()
+        score_queue = ScoreQueue(async_data, max_batch=3, max_delay=60)
+
+        await asyncio.gather(*[score_queue.add(score) for score in range(6)])
+        self.assertEqual([[0, 1, 2], [3, 4, 5]], async_data.batches)
+
+    async def test_flush_on_delay(self):
+        async_data = RecordingAsyncData()
+        score_queue = ScoreQueue(async_data, max_batch=100, max_delay=0.05)
+
+        await asyncio.gather(score_queue.add(1), score_queue.add(2))
+        self.assertEqual([[1, 2]], async_data.batches)
+
+    async def test_ack_on_enqueue(self):
+        async_data = RecordingAsyncData()
+        score_queue = ScoreQueue(async_data, max_batch=100, max_delay=60, durability="enqueue")
+
+        self.assertTrue(await score_queue.add(1))
+        self.assertEqual([], async_data.batches)
+
+        #Shutdown writes whatever is still queued
+        await score_queue.close()
+        self.assertEqual([[1]], async_data.batches)
+        with self.assertRaises(RuntimeError):
+            await score_queue.add(2)
+
+    async def test_failed_flush(self):
+        score_queue = ScoreQueue(RecordingAsyncData(fail=True), max_batch=1, durability="flush")
+        with self.assertRaises(ConnectionError):
+            await score_queue.add(1)
+
+        score_queue = ScoreQueue(RecordingAsyncData(fail=True), max_batch=1, durability="enqueue")
+        self.assertTrue(await score_queue.add(1))
+        await score_queue.flush()
+
+    def test_invalid_durability(self):
+        with self.assertRaises(ValueError):
+            ScoreQueue(RecordingAsyncData(), durability="never")
+
+if __name__ == '__main__':
+    unittest.main()
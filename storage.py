@@ -0,0 +1,682 @@
+import json
+import logging
+import itertools
+import sqlite3
+from datetime import datetime
+from threading import Lock
+from typing import Dict, List, Optional
+from bson import DBRef
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient, UpdateOne, ReplaceOne
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+from model import *
+from scoreformat import datetime_to_micros, TIME_EPOCH
+from metrics import metrics, Metrics
+
+log = logging.getLogger(__name__)
+
+class Storage():
+    '''
+    Interface BotData uses to persist games, channels and scores.
+    Games are dicts with id, name, is_enabled, categories (a list of Category dicts) and retention.
+    Channels are dicts with guild_id, channel_id, name and games (the ids of the games linked to the channel).
+    Channels from the games config only have a name, guild_id and channel_id are None.
+    Scores are ScoreEntry records, every score query is scoped to one guild_id.
+    reads_may_lag is True when find_scores, find_scores_page and find_player_scores may be served by a replica
+    that is behind the latest writes.
+    '''
+    reads_may_lag = False
+
+    def load_games(self):
+        raise NotImplementedError
+
+    def load_channels(self):
+        raise NotImplementedError
+
+    def upsert_games(self, games: List[dict]) -> Dict[str, object]:
+        '''
+        Inserts or updates games by name in one batch. Returns a name -> id dict covering at least the games it created.
+        '''
+        raise NotImplementedError
+
+    def link_channel_games(self, channel_games: Dict[str, List]):
+        '''
+        Links game ids to games config channels by channel name in one batch, creating channels that do not exist yet.
+        '''
+        raise NotImplementedError
+
+    def bind_channels(self, channels: List[dict]):
+        '''
+        Inserts or updates channels by (guild_id, channel_id) in one batch and links the game ids in their games.
+        A name of None leaves the stored name alone.
+        '''
+        raise NotImplementedError
+
+    def insert_scores(self, scores: List[ScoreEntry]):
+        '''
+        Inserts scores in one batch and sets their ids.
+        '''
+        raise NotImplementedError
+
+    def find_scores(self, game_name: str, category_path: str, guild_id: int = None) -> List[ScoreEntry]:
+        '''
+        Returns every score in a category, oldest first.
+        '''
+        raise NotImplementedError
+
+    def find_scores_page(self, game_name: str, category_path: str, order_by: str, direction: int, cursor, limit: int,
+                         guild_id: int = None) -> List[ScoreEntry]:
+        '''
+        Returns up to limit scores in a category sorted by (order_by, id) in direction (1 or -1),
+        starting after cursor, an (order_by value, id) tuple, when one is given.
+        '''
+        raise NotImplementedError
+
+    def find_personal_bests(self, guild_id: int = None) -> List[ScoreEntry]:
+        '''
+        Returns the best score of every player in every category of every guild, or only of guild_id when it is given.
+        '''
+        raise NotImplementedError
+
+    def archive_scores(self, game_name: str, keep_recent: int) -> int:
+        '''
+        Moves every score of a game that is neither its player's personal best nor one of their keep_recent most recent scores
+        out of the scores the other queries read and into the archive. Returns the number of scores moved.
+        '''
+        raise NotImplementedError
+
+    def find_player_scores(self, game_name: str, category_path: str, player_id: str, limit: int, guild_id: int = None) -> List[ScoreEntry]:
+        '''
+        Returns up to limit of a player's scores in a category, archived ones included, newest first.
+        '''
+        raise NotImplementedError
+
+    def load_snapshot(self, name: str) -> Optional[dict]:
+        '''
+        Returns the snapshot saved under name, a dict with hash, games and channels, or None.
+        '''
+        raise NotImplementedError
+
+    def save_snapshot(self, name: str, snapshot: dict):
+        raise NotImplementedError
+
+    def delete_snapshot(self, name: str):
+        raise NotImplementedError
+
+    def drop(self):
+        '''
+        Deletes all stored data.
+        '''
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def warm_up(self):
+        '''
+        Opens connections ahead of the first command. Backends without a connection pool have nothing to do.
+        '''
+        pass
+
+    #Migrations for data written by older versions of the bot, backends without legacy data have nothing to migrate
+    def migrate_embedded_scores(self):
+        return 0
+
+    def migrate_time_scores(self):
+        return 0
+
+    def migrate_guild_scores(self, guild_id: int):
+        '''
+        Moves scores submitted before guilds were tracked into guild_id.
+        '''
+        raise NotImplementedError
+
+class MongoStorage(Storage):
+    '''
+    Stores bot data in mongo DB, using the bunnet document models in model.py for the schema and indexes.
+    options are the base_config.mongo_client settings: the CLIENT_OPTIONS for the connection pool and timeouts,
+    plus read_preference and max_staleness_seconds for the read-only score queries behind listing, history and exports.
+    Writes, and the reads the in-memory indexes are built from, always go to the primary.
+    '''
+    CLIENT_OPTIONS = {
+        "max_pool_size": "maxPoolSize",
+        "min_pool_size": "minPoolSize",
+        "max_idle_time_ms": "maxIdleTimeMS",
+        "connect_timeout_ms": "connectTimeoutMS",
+        "server_selection_timeout_ms": "serverSelectionTimeoutMS",
+        "socket_timeout_ms": "socketTimeoutMS",
+        "wait_queue_timeout_ms": "waitQueueTimeoutMS",
+    }
+    READ_PREFERENCES = {
+        "primary": Primary,
+        "primaryPreferred": PrimaryPreferred,
+        "secondary": Secondary,
+        "secondaryPreferred": SecondaryPreferred,
+        "nearest": Nearest,
+    }
+    #Mongo rejects a smaller max staleness
+    MIN_STALENESS_SECONDS = 90
+
+    def __init__(self, url: str, db_name: str = 'BOTDATA', options: dict = None):
+        options = dict(options or {})
+        self.read_preference = self._read_preference(options.pop("read_preference", "primary"), options.pop("max_staleness_seconds", -1))
+        self.reads_may_lag = not isinstance(self.read_preference, Primary)
+        unknown_options = set(options) - set(self.CLIENT_OPTIONS)
+        if unknown_options:
+            raise ValueError(f"Unknown mongo client options {', '.join(sorted(unknown_options))}")
+        self.min_pool_size = options.get("min_pool_size") or 1
+
+        self.mongo_client = MongoClient(url, **{self.CLIENT_OPTIONS[name]: value for name, value in options.items() if value is not None})
+        self.db_name = db_name
+        self.db = self.mongo_client[db_name]
+        init_model(self.db)
+        self.games = Game.get_motor_collection()
+        self.channels = Channel.get_motor_collection()
+        self.scores = Score.get_motor_collection()
+        self.archive = self.db[ARCHIVE_COLLECTION]
+        self.archive.create_indexes(ARCHIVE_INDEXES)
+        self.snapshots = self.db[SNAPSHOT_COLLECTION]
+        #Read-only handles for the score queries that can tolerate replication lag
+        self.score_reads = self.scores.with_options(read_preference=self.read_preference)
+        self.archive_reads = self.archive.with_options(read_preference=self.read_preference)
+
+    def _read_preference(self, name: str, max_staleness: int):
+        if name not in self.READ_PREFERENCES:
+            raise ValueError(f"Invalid read_preference {name}, expected one of {', '.join(self.READ_PREFERENCES)}")
+        if name == "primary":
+            return Primary()
+        if max_staleness is None or max_staleness == -1:
+            max_staleness = -1
+        elif max_staleness < self.MIN_STALENESS_SECONDS:
+            raise ValueError(f"max_staleness_seconds must be -1 or at least {self.MIN_STALENESS_SECONDS}, got {max_staleness}")
+        return self.READ_PREFERENCES[name](max_staleness=max_staleness)
+
+    def _score_entry(self, score: dict):
+        score_type = "Point" if score["_class_id"] == PointScore._class_id else "Time"
+        return ScoreEntry(id=score["_id"], guild_id=score.get("guild_id"), score_type=score_type,
+                          **{field: score[field] for field in ("game", "category", "player_id", "value", "create_time")})
+
+    def _score_doc(self, score: ScoreEntry):
+        score_class = PointScore if score.score_type == "Point" else TimeScore
+        return {"_class_id": score_class._class_id, **score.dict(exclude={"id", "score_type"})}
+
+    def load_games(self):
+        for game in self.games.find({}, {"name": 1, "is_enabled": 1, "categories": 1, "retention": 1}):
+            yield {"id": game["_id"], "name": game["name"], "is_enabled": game["is_enabled"], "categories": game.get("categories") or [],
+                   "retention": game.get("retention")}
+
+    def load_channels(self):
+        #Links are DBRefs, they are left unfetched
+        for channel in self.channels.find({}, {"guild_id": 1, "channel_id": 1, "name": 1, "games": 1}):
+            yield {"guild_id": channel.get("guild_id"), "channel_id": channel.get("channel_id"), "name": channel.get("name"),
+                   "games": [ref.id for ref in channel.get("games", [])]}
+
+    def upsert_games(self, games: List[dict]):
+        writes = [UpdateOne({"name": game["name"]}, {"$set": {"is_enabled": game["is_enabled"], "categories": game["categories"],
+                                                              "retention": game.get("retention")}}, upsert=True)
+                  for game in games]
+        result = self.games.bulk_write(writes, ordered=False)
+        return {games[index]["name"]: game_id for index, game_id in result.upserted_ids.items()}
+
+    def link_channel_games(self, channel_games: Dict[str, List]):
+        #guild_id None also matches channels stored before guilds were tracked
+        writes = [UpdateOne({"name": name, "guild_id": None}, {"$addToSet": {"games": {"$each": self._game_refs(game_ids)}}}, upsert=True)
+                  for name, game_ids in channel_games.items()]
+        self.channels.bulk_write(writes, ordered=False)
+
+    def bind_channels(self, channels: List[dict]):
+        writes = []
+        for channel in channels:
+            update = {"$addToSet": {"games": {"$each": self._game_refs(channel["games"])}}}
+            if channel["name"] is not None:
+                update["$set"] = {"name": channel["name"]}
+            writes.append(UpdateOne({"guild_id": channel["guild_id"], "channel_id": channel["channel_id"]}, update, upsert=True))
+        self.channels.bulk_write(writes, ordered=False)
+
+    def _game_refs(self, game_ids: List):
+        return [DBRef(self.games.name, game_id) for game_id in game_ids]
+
+    def insert_scores(self, scores: List[ScoreEntry]):
+        result = self.scores.insert_many([self._score_doc(score) for score in scores])
+        for score, score_id in zip(scores, result.inserted_ids):
+            score.id = score_id
+
+    def find_scores(self, game_name: str, category_path: str, guild_id: int = None):
+        #Served by the (guild_id, game, category, create_time) index
+        scores = self.score_reads.find({"guild_id": guild_id, "game": game_name, "category": category_path}).sort([("create_time", 1), ("_id", 1)])
+        return [self._score_entry(score) for score in scores]
+
+    def find_scores_page(self, game_name: str, category_path: str, order_by: str, direction: int, cursor, limit: int,
+                         guild_id: int = None):
+        query = {"guild_id": guild_id, "game": game_name, "category": category_path}
+        if cursor:
+            op = "$gt" if direction == 1 else "$lt"
+            query["$or"] = [{order_by: {op: cursor[0]}}, {order_by: cursor[0], "_id": {op: cursor[1]}}]
+
+        scores = self.score_reads.find(query).sort([(order_by, direction), ("_id", direction)]).limit(limit)
+        return [self._score_entry(score) for score in scores]
+
+    def find_personal_bests(self, guild_id: int = None):
+        #Best first for either score type, ties go to the earliest score like in leaderboard.Board and SQLite
+        pipeline = [{"$match": {"guild_id": guild_id}}] if guild_id is not None else []
+        pipeline += [
+            {"$addFields": {"rank_key": {"$cond": [{"$eq": ["$_class_id", PointScore._class_id]}, {"$multiply": ["$value", -1]}, "$value"]}}},
+            {"$sort": {"rank_key": 1, "create_time": 1, "_id": 1}},
+            {"$group": {
+                "_id": {"guild_id": "$guild_id", "game": "$game", "category": "$category", "player_id": "$player_id"},
+                "best": {"$first": "$$ROOT"}
+            }}
+        ]
+        for best in self.scores.aggregate(pipeline, allowDiskUse=True):
+            yield self._score_entry(best["best"])
+
+    def archive_scores(self, game_name: str, keep_recent: int, batch_size: int = 1000):
+        #Newest first within each player's scores, only the fields needed to pick the scores to keep
+        pipeline = [
+            {"$match": {"game": game_name}},
+            {"$project": {"guild_id": 1, "category": 1, "player_id": 1, "value": 1, "create_time": 1, "_class_id": 1}},
+            {"$sort": {"guild_id": 1, "category": 1, "player_id": 1, "create_time": -1, "_id": -1}}
+        ]
+        player_key = lambda score: (score.get("guild_id"), score["category"], score["player_id"])
+        archived = 0
+        score_ids = []
+        for _, player_scores in itertools.groupby(self.scores.aggregate(pipeline, allowDiskUse=True), key=player_key):
+            player_scores = list(player_scores)
+            sign = -1 if player_scores[0]["_class_id"] == PointScore._class_id else 1
+            best = min(player_scores, key=lambda score: (sign * score["value"], score["create_time"]))
+            score_ids += [score["_id"] for score in player_scores[keep_recent:] if score is not best]
+            if len(score_ids) >= batch_size:
+                archived += self._move_to_archive(score_ids)
+                score_ids = []
+        if score_ids:
+            archived += self._move_to_archive(score_ids)
+        return archived
+
+    def _move_to_archive(self, score_ids: List):
+        #Upserted by _id before the originals are deleted, so a compaction cut short can run again without duplicates
+        scores = list(self.scores.find({"_id": {"$in": score_ids}}))
+        if scores:
+            self.archive.bulk_write([ReplaceOne({"_id": score["_id"]}, score, upsert=True) for score in scores], ordered=False)
+        return self.scores.delete_many({"_id": {"$in": score_ids}}).deleted_count
+
+    def find_player_scores(self, game_name: str, category_path: str, player_id: str, limit: int, guild_id: int = None):
+        query = {"guild_id": guild_id, "game": game_name, "category": category_path, "player_id": player_id}
+        sort = [("create_time", -1), ("_id", -1)]
+        scores = list(self.score_reads.find(query).sort(sort).limit(limit)) + list(self.archive_reads.find(query).sort(sort).limit(limit))
+        scores.sort(key=lambda score: (score["create_time"], score["_id"]), reverse=True)
+        return [self._score_entry(score) for score in scores[:limit]]
+
+    def load_snapshot(self, name: str):
+        snapshot = self.snapshots.find_one({"_id": name})
+        return {field: snapshot[field] for field in ("hash", "games", "channels")} if snapshot else None
+
+    def save_snapshot(self, name: str, snapshot: dict):
+        self.snapshots.replace_one({"_id": name}, snapshot, upsert=True)
+
+    def delete_snapshot(self, name: str):
+        self.snapshots.delete_one({"_id": name})
+
+    def drop(self):
+        self.mongo_client.drop_database(self.db_name)
+
+    def close(self):
+        self.mongo_client.close()
+
+    def warm_up(self):
+        #Concurrent pings check out min_pool_size connections at once, so the pool opens them now instead of during
+        #the first commands, server selection and the connection handshakes included. The driver keeps min_pool_size open after.
+        with ThreadPoolExecutor(max_workers=self.min_pool_size) as executor:
+            list(executor.map(lambda _: self.db.command("ping"), range(self.min_pool_size)))
+        if self.reads_may_lag:
+            self.db.command("ping", read_preference=self.read_preference)
+
+    #Migrations
+    def _migrate_category_scores(self, game_name: str, categories, parent_path: str = None):
+        '''
+        Pops embedded scores out of raw category dicts and returns them as score documents.
+        '''
+        scores = []
+        for category in categories or []:
+            path = f"{parent_path}/{category['name']}" if parent_path else category['name']
+            score_type = category.get("score_type", "Time")
+            for score in category.pop("scores", None) or []:
+                value = score["value"]
+                if isinstance(value, datetime):
+                    value = datetime_to_micros(value)
+                scores.append(self._score_doc(ScoreEntry(
+                    game=game_name,
+                    category=path,
+                    player_id=score["player_id"],
+                    score_type=score_type,
+                    value=value,
+                    create_time=score["create_time"]
+                )))
+            scores += self._migrate_category_scores(game_name, category.get("categories"), path)
+        return scores
+
+    def migrate_embedded_scores(self):
+        '''
+        Moves scores embedded in Game documents (Category.scores) into the scores collection.
+        Safe to run more than once, games without embedded scores are left untouched.
+        '''
+        migrated = 0
+        for game in self.games.find({}, {"name": 1, "categories": 1}):
+            scores = self._migrate_category_scores(game["name"], game.get("categories"))
+            if scores:
+                self.scores.insert_many(scores)
+                self.games.update_one({"_id": game["_id"]}, {"$set": {"categories": game["categories"]}})
+                migrated += len(scores)
+                log.info("Migrated %d scores for %s", len(scores), game['name'])
+
+        return migrated
+
+    def migrate_time_scores(self):
+        '''
+        Converts time scores still stored as strptime datetimes into integer microseconds.
+        Done server side in one update, BSON dates only hold milliseconds so nothing is lost.
+        '''
+        result = self.scores.update_many(
+            {"_class_id": TimeScore._class_id, "value": {"$type": "date"}},
+            [{"$set": {"value": {"$multiply": [{"$subtract": ["$value", TIME_EPOCH]}, 1000]}}}]
+        )
+        return result.modified_count
+
+    def migrate_guild_scores(self, guild_id: int):
+        return self.scores.update_many({"guild_id": None}, {"$set": {"guild_id": guild_id}}).modified_count
+
+class SqliteStorage(Storage):
+    '''
+    Stores bot data in an embedded SQLite DB, for small deployments without a mongo server.
+    A single connection is shared between threads and serialized with a lock.
+    '''
+    SCHEMA_VERSION = 3
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            is_enabled INTEGER NOT NULL,
+            categories TEXT NOT NULL,
+            retention INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS channels (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER,
+            channel_id INTEGER,
+            name TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS channels_config ON channels (name) WHERE guild_id IS NULL;
+        CREATE UNIQUE INDEX IF NOT EXISTS channels_guild ON channels (guild_id, channel_id) WHERE channel_id IS NOT NULL;
+        CREATE TABLE IF NOT EXISTS channel_games (
+            channel_id INTEGER NOT NULL REFERENCES channels(id),
+            game_id INTEGER NOT NULL REFERENCES games(id),
+            PRIMARY KEY (channel_id, game_id)
+        );
+        CREATE TABLE IF NOT EXISTS scores (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER,
+            game TEXT NOT NULL,
+            category TEXT NOT NULL,
+            player_id TEXT NOT NULL,
+            score_type TEXT NOT NULL,
+            value INTEGER NOT NULL,
+            create_time TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS scores_player ON scores (guild_id, game, category, player_id, value);
+        CREATE INDEX IF NOT EXISTS scores_value ON scores (guild_id, game, category, value, id);
+        CREATE INDEX IF NOT EXISTS scores_create_time ON scores (guild_id, game, category, create_time, id);
+        CREATE TABLE IF NOT EXISTS scores_archive (
+            id INTEGER NOT NULL,
+            guild_id INTEGER,
+            game TEXT NOT NULL,
+            category TEXT NOT NULL,
+            player_id TEXT NOT NULL,
+            score_type TEXT NOT NULL,
+            value INTEGER NOT NULL,
+            create_time TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS scores_archive_player ON scores_archive (guild_id, game, category, player_id, create_time);
+        CREATE TABLE IF NOT EXISTS snapshots (
+            name TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            state TEXT NOT NULL
+        );
+    """
+    #Version 1 keyed channels by name only and had no guild_id on scores
+    MIGRATE_V1 = """
+        ALTER TABLE scores ADD COLUMN guild_id INTEGER;
+        DROP INDEX scores_player;
+        DROP INDEX scores_value;
+        DROP INDEX scores_create_time;
+        CREATE TABLE channels_v2 (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER,
+            channel_id INTEGER,
+            name TEXT
+        );
+        INSERT INTO channels_v2 (id, name) SELECT id, name FROM channels;
+        DROP TABLE channels;
+        ALTER TABLE channels_v2 RENAME TO channels;
+    """
+    #Version 2 had no per game retention
+    MIGRATE_V2 = """
+        ALTER TABLE games ADD COLUMN retention INTEGER;
+    """
+    #Scores that are neither their player's personal best nor one of their keep_recent newest, ties broken like find_personal_bests
+    ARCHIVE_CANDIDATES = """
+        SELECT id FROM (
+          SELECT id,
+            ROW_NUMBER() OVER (
+              PARTITION BY guild_id, category, player_id
+              ORDER BY CASE WHEN score_type = 'Point' THEN -value ELSE value END, create_time, id
+            ) AS best_rank,
+            ROW_NUMBER() OVER (PARTITION BY guild_id, category, player_id ORDER BY create_time DESC, id DESC) AS recent_rank
+          FROM scores WHERE game = ?
+        ) WHERE best_rank > 1 AND recent_rank > ?
+    """
+    SCORE_COLUMNS = "id, guild_id, game, category, player_id, score_type, value, create_time"
+    ORDER_COLUMNS = ("value", "create_time")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._migrate_schema()
+
+    def _migrate_schema(self):
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        has_tables = self.connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scores'").fetchone()
+        if has_tables and version < 2:
+            self.connection.executescript(self.MIGRATE_V1)
+        if has_tables and version < 3:
+            self.connection.executescript(self.MIGRATE_V2)
+        self.connection.executescript(self.SCHEMA)
+        self.connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    #create_time is stored as fixed width ISO text so it sorts correctly
+    def _time_text(self, value: datetime):
+        return value.isoformat(timespec="microseconds")
+
+    def _score_entry(self, row):
+        score_id, guild_id, game, category, player_id, score_type, value, create_time = row
+        return ScoreEntry(id=score_id, guild_id=guild_id, game=game, category=category, player_id=player_id, score_type=score_type,
+                          value=value, create_time=datetime.fromisoformat(create_time))
+
+    def load_games(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT id, name, is_enabled, categories, retention FROM games ORDER BY id").fetchall()
+        return [{"id": game_id, "name": name, "is_enabled": bool(is_enabled), "categories": json.loads(categories), "retention": retention}
+                for game_id, name, is_enabled, categories, retention in rows]
+
+    def load_channels(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT channels.id, channels.guild_id, channels.channel_id, channels.name, channel_games.game_id FROM channels "
+                "LEFT JOIN channel_games ON channel_games.channel_id = channels.id "
+                "ORDER BY channels.id, channel_games.rowid"
+            ).fetchall()
+
+        channels = {}
+        for row_id, guild_id, channel_id, name, game_id in rows:
+            channel = channels.setdefault(row_id, {"guild_id": guild_id, "channel_id": channel_id, "name": name, "games": []})
+            if game_id is not None:
+                channel["games"].append(game_id)
+        return list(channels.values())
+
+    def upsert_games(self, games: List[dict]):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO games (name, is_enabled, categories, retention) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET is_enabled = excluded.is_enabled, categories = excluded.categories, retention = excluded.retention",
+                [(game["name"], game["is_enabled"], json.dumps(game["categories"]), game.get("retention")) for game in games]
+            )
+            names = [game["name"] for game in games]
+            rows = self.connection.execute(f"SELECT name, id FROM games WHERE name IN ({', '.join('?' * len(names))})", names).fetchall()
+        return dict(rows)
+
+    def link_channel_games(self, channel_games: Dict[str, List]):
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO channels (name) VALUES (?)", [(name,) for name in channel_games])
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO channel_games (channel_id, game_id) SELECT id, ? FROM channels WHERE guild_id IS NULL AND name = ?",
+                [(game_id, name) for name, game_ids in channel_games.items() for game_id in game_ids]
+            )
+
+    def bind_channels(self, channels: List[dict]):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO channels (guild_id, channel_id, name) VALUES (?, ?, ?) "
+                "ON CONFLICT (guild_id, channel_id) WHERE channel_id IS NOT NULL DO UPDATE SET name = coalesce(excluded.name, name)",
+                [(channel["guild_id"], channel["channel_id"], channel["name"]) for channel in channels]
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO channel_games (channel_id, game_id) SELECT id, ? FROM channels WHERE guild_id = ? AND channel_id = ?",
+                [(game_id, channel["guild_id"], channel["channel_id"]) for channel in channels for game_id in channel["games"]]
+            )
+
+    def insert_scores(self, scores: List[ScoreEntry]):
+        with self.lock, self.connection:
+            for score in scores:
+                cursor = self.connection.execute(
+                    "INSERT INTO scores (guild_id, game, category, player_id, score_type, value, create_time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (score.guild_id, score.game, score.category, score.player_id, score.score_type, score.value, self._time_text(score.create_time))
+                )
+                score.id = cursor.lastrowid
+
+    #guild_id IS ? matches NULL for scores from before guilds were tracked, and still uses the indexes
+    def find_scores(self, game_name: str, category_path: str, guild_id: int = None):
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {self.SCORE_COLUMNS} FROM scores WHERE guild_id IS ? AND game = ? AND category = ? ORDER BY create_time, id",
+                (guild_id, game_name, category_path)
+            ).fetchall()
+        return [self._score_entry(row) for row in rows]
+
+    def find_scores_page(self, game_name: str, category_path: str, order_by: str, direction: int, cursor, limit: int,
+                         guild_id: int = None):
+        if order_by not in self.ORDER_COLUMNS:
+            raise ValueError(f"Invalid order_by {order_by}")
+
+        order = "ASC" if direction == 1 else "DESC"
+        sql = f"SELECT {self.SCORE_COLUMNS} FROM scores WHERE guild_id IS ? AND game = ? AND category = ?"
+        params = [guild_id, game_name, category_path]
+        if cursor:
+            cursor_value = self._time_text(cursor[0]) if order_by == "create_time" else cursor[0]
+            sql += f" AND ({order_by}, id) {'>' if direction == 1 else '<'} (?, ?)"
+            params += [cursor_value, cursor[1]]
+        sql += f" ORDER BY {order_by} {order}, id {order} LIMIT ?"
+        params.append(limit)
+
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        return [self._score_entry(row) for row in rows]
+
+    def find_personal_bests(self, guild_id: int = None):
+        guild_filter, params = ("WHERE guild_id = ?", (guild_id,)) if guild_id is not None else ("", ())
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {self.SCORE_COLUMNS} FROM ("
+                f"  SELECT {self.SCORE_COLUMNS}, ROW_NUMBER() OVER ("
+                "    PARTITION BY guild_id, game, category, player_id"
+                "    ORDER BY CASE WHEN score_type = 'Point' THEN -value ELSE value END, create_time, id"
+                f"  ) AS player_rank FROM scores {guild_filter}"
+                ") WHERE player_rank = 1",
+                params
+            ).fetchall()
+        return [self._score_entry(row) for row in rows]
+
+    def archive_scores(self, game_name: str, keep_recent: int):
+        #One transaction, the scores are either all moved or all left in place
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS archive_ids (id INTEGER PRIMARY KEY)")
+            self.connection.execute("DELETE FROM archive_ids")
+            self.connection.execute(f"INSERT INTO archive_ids {self.ARCHIVE_CANDIDATES}", (game_name, keep_recent))
+            self.connection.execute(
+                f"INSERT INTO scores_archive ({self.SCORE_COLUMNS}) SELECT {self.SCORE_COLUMNS} FROM scores WHERE id IN (SELECT id FROM archive_ids)"
+            )
+            return self.connection.execute("DELETE FROM scores WHERE id IN (SELECT id FROM archive_ids)").rowcount
+
+    def find_player_scores(self, game_name: str, category_path: str, player_id: str, limit: int, guild_id: int = None):
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {self.SCORE_COLUMNS} FROM scores WHERE guild_id IS ? AND game = ? AND category = ? AND player_id = ? "
+                f"UNION ALL SELECT {self.SCORE_COLUMNS} FROM scores_archive WHERE guild_id IS ? AND game = ? AND category = ? AND player_id = ? "
+                "ORDER BY create_time DESC, id DESC LIMIT ?",
+                (guild_id, game_name, category_path, player_id) * 2 + (limit,)
+            ).fetchall()
+        return [self._score_entry(row) for row in rows]
+
+    def load_snapshot(self, name: str):
+        with self.lock:
+            row = self.connection.execute("SELECT hash, state FROM snapshots WHERE name = ?", (name,)).fetchone()
+        return {"hash": row[0], **json.loads(row[1])} if row else None
+
+    def save_snapshot(self, name: str, snapshot: dict):
+        state = json.dumps({"games": snapshot["games"], "channels": snapshot["channels"]})
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO snapshots (name, hash, state) VALUES (?, ?, ?)", (name, snapshot["hash"], state))
+
+    def delete_snapshot(self, name: str):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM snapshots WHERE name = ?", (name,))
+
+    def drop(self):
+        with self.lock, self.connection:
+            for table in ("channel_games", "channels", "games", "scores", "scores_archive", "snapshots"):
+                self.connection.execute(f"DELETE FROM {table}")
+
+    def close(self):
+        self.connection.close()
+
+    def migrate_guild_scores(self, guild_id: int):
+        with self.lock, self.connection:
+            return self.connection.execute("UPDATE scores SET guild_id = ? WHERE guild_id IS NULL", (guild_id,)).rowcount
+
+class MeteredStorage():
+    '''
+    Wraps a storage backend and records every public call as a DB operation, attributed to the command making it.
+    Wrapped methods are cached on the instance so the lookup only goes through __getattr__ once.
+    '''
+    def __init__(self, storage: Storage, metrics: Metrics = metrics):
+        self.storage = storage
+        self.metrics = metrics
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.storage, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        def metered(*args, **kwargs):
+            self.metrics.db_op(name)
+            return attr(*args, **kwargs)
+
+        setattr(self, name, metered)
+        return metered
+
+def create_storage(url: str, db_name: str = 'BOTDATA', mongo_options: dict = None) -> Storage:
+    '''
+    Picks the storage backend from the URL scheme. sqlite:///path/to/file.db (or sqlite:///:memory:) uses SQLite,
+    anything else is treated as a mongo URL. mongo_options only apply to mongo, see MongoStorage.
+    '''
+    if url.startswith("sqlite://"):
+        return SqliteStorage(url[len("sqlite:///"):] or f"{db_name}.db")
+    return MongoStorage(url, db_name, mongo_options)